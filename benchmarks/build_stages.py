@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""build_stages.py -- benchmark each stage of a Stillness build on synthetic asset trees.
+
+Generates asset trees of the requested sizes in a temporary directory,
+times asset discovery, FileMap expansion on deep and wide include
+graphs, combining, minifying (with a local stand-in minifier command),
+versioning, and CSS url() rewriting, and writes the results as JSON so
+runs on different commits can be compared::
+
+    python benchmarks/build_stages.py --sizes 1000,10000 --output results.json
+"""
+import os
+import sys
+import time
+import platform
+import tempfile
+import subprocess
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from stillness import managers
+from stillness.path import path
+
+PNG = ('\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f'
+       '\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\xff\xff?\x00\x05\xfe\x02\xfe\xa7\x35\x81\x84\x00\x00'
+       '\x00\x00IEND\xaeB`\x82')
+
+
+def generate_tree(root, files, fanout=20, sources_per_bundle=10):
+    """Generate a media tree of about `files` files.
+
+    Three quarters are images spread over nested directories, `fanout`
+    files and subdirectories per directory; the rest are CSS and JS
+    sources. Returns a two-tuple of the CSS and JS source file keys.
+    """
+    images = files * 3 // 4
+    sources = files - images
+    for i in range(images):
+        rel_dir = []
+        n = i // fanout
+        while n:
+            rel_dir.append('d%d' % (n % fanout))
+            n //= fanout
+        directory = root / 'images' / '/'.join(reversed(rel_dir))
+        if not directory.exists():
+            directory.makedirs()
+        (directory / ('i%d.png' % i)).write_bytes(PNG)
+
+    css, js = [], []
+    for kind, keys in (('css', css), ('js', js)):
+        (root / kind).makedirs()
+        for i in range(sources // 2):
+            key = '%s/s%d.%s' % (kind, i, kind)
+            if kind == 'css':
+                text = ''.join('.c%d-%d { background: url(../images/i%d.png) no-repeat; }\n' % (i, j, (i * 7 + j) % max(images, 1))
+                               for j in range(sources_per_bundle))
+            else:
+                text = ''.join('function f%d_%d(a, b) {\n    return a + b; // add\n}\n' % (i, j)
+                               for j in range(sources_per_bundle))
+            (root / key).write_bytes(text)
+            keys.append(key)
+    return css, js
+
+
+def deep_map(sources, depth):
+    """A chain of `depth` file keys, each including the next."""
+    mapping = {}
+    for level in range(depth):
+        included = ['deep/%d.js' % (level + 1)] if level + 1 < depth else []
+        mapping['deep/%d.js' % level] = [sources[level % len(sources)]] + included
+    return mapping
+
+
+def wide_map(sources, width, per_bundle=10):
+    """A root file key including `width` bundles of `per_bundle` sources each."""
+    mapping = {'wide/all.js': []}
+    for i in range(width):
+        key = 'wide/%d.js' % i
+        mapping[key] = [sources[(i * per_bundle + j) % len(sources)] for j in range(per_bundle)]
+        mapping['wide/all.js'].append(key)
+    return mapping
+
+
+def bundles(sources, per_bundle=10):
+    mapping = {}
+    for i in range(0, len(sources), per_bundle):
+        mapping['bundles/%d.%s' % (i // per_bundle, sources[0].rsplit('.', 1)[1])] = sources[i:i + per_bundle]
+    return mapping
+
+
+class Timer(object):
+    def __init__(self, results, **tags):
+        self.results = results
+        self.tags = tags
+
+    def time(self, stage, func, *args, **extra):
+        start = time.time()
+        value = func(*args)
+        elapsed = time.time() - start
+        result = dict(self.tags, stage=stage, seconds=round(elapsed, 6))
+        result.update(extra)
+        self.results.append(result)
+        sys.stderr.write('%(files)8d files  %(stage)-20s %(seconds)10.4fs\n' % result)
+        return value
+
+
+def run_size(files, minify_cmd, results):
+    root = path(tempfile.mkdtemp(prefix='stillness-bench-'))
+    try:
+        media = root / 'media'
+        css_sources, js_sources = generate_tree(media, files)
+        assets = managers.AssetManager(
+            debug = False,
+            common_path = media,
+            build_path = root / 'build',
+            assets = dict(paths = (('images', {}),)),
+            css = dict(map = bundles(css_sources), minify_cmd = minify_cmd),
+            js = dict(map = bundles(js_sources), minify_cmd = minify_cmd),
+            )
+        timer = Timer(results, files=files)
+
+        found = timer.time('discovery', lambda: list(assets.find_assets()))
+
+        for name, mapping in (('expansion_deep', deep_map(js_sources, min(files, 5000))),
+                              ('expansion_wide', wide_map(js_sources, max(files // 10, 1)))):
+            file_map = managers.FileMap(assets, 'js', mapping)
+            timer.time(name, lambda: [file_map[fk] for fk in file_map], keys=len(mapping))
+
+        css_map = assets.options['css']['map']
+        js_map = assets.options['js']['map']
+        texts = timer.time('combine', lambda: [m._combine(*(media / fk for fk in m[key]))
+                                               for m in (css_map, js_map) for key in sorted(m)])
+        combined_bytes = sum(len(t) for t in texts)
+        timer.time('minify', lambda: [js_map._minify_text(t) for t in texts],
+                   bundles=len(texts), bytes=combined_bytes)
+
+        timer.time('versioning', lambda: assets.versions.mapVersions(
+                'SHA1Sum', media, *[media.relpathto(fp) for fp in found]), assets=len(found))
+
+        stylesheet = ''.join(t for t in texts[:len(css_map)])
+        timer.time('css_rewriting', lambda: css_map._version_css_url_includes('css/all.css', stylesheet),
+                   bytes=len(stylesheet))
+    finally:
+        root.rmtree()
+
+
+def git_revision():
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        return process.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [--sizes 1000,10000,100000] [--output FILE]')
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help='comma-separated numbers of files to generate (default: %default)')
+    parser.add_option('--minify-cmd', default='cat',
+                      help='stand-in minifier command (default: %default)')
+    parser.add_option('--output', default='-',
+                      help='file to write JSON results to, or - for stdout (default: %default)')
+    options, args = parser.parse_args(argv)
+    if json is None:
+        parser.error('json is not available.')
+
+    results = []
+    for size in options.sizes.split(','):
+        run_size(int(size), options.minify_cmd, results)
+
+    report = dict(revision=git_revision(), python=platform.python_version(),
+                  platform=platform.platform(), results=results)
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        fo = open(options.output, 'w')
+        try:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        finally:
+            fo.close()
+
+
+if __name__ == '__main__':
+    main()
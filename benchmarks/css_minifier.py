@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""css_minifier.py -- benchmark the in-process CSS minifier against the YUI Compressor jar.
+
+Minifies each stylesheet under the test media, and a combined bundle of
+all of them, with both minifiers, and writes the timings and output
+sizes as JSON::
+
+    python benchmarks/css_minifier.py --repeat 5 --output results.json
+
+The jar is skipped if java is not installed.
+"""
+import os
+import sys
+import time
+import platform
+import subprocess
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from stillness import managers
+from stillness.cssmin import minify_css
+from stillness.path import path
+
+CSS_MEDIA = path(__file__).abspath().dirname().parent / 'tests' / 'media' / 'css'
+
+
+def yui(text):
+    process = subprocess.Popen('java -jar %s --type css' % managers.YUICOMPRESSOR, shell=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return process.communicate(text)[0]
+
+
+def have_java():
+    try:
+        subprocess.Popen(['java', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    except OSError:
+        return False
+    return True
+
+
+def best_of(repeat, func, text):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        output = func(text)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, output
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [--repeat N] [--output FILE]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs per input; the fastest is reported (default: %default)')
+    parser.add_option('--output', default='-',
+                      help='file to write JSON results to, or - for stdout (default: %default)')
+    options, args = parser.parse_args(argv)
+    if json is None:
+        parser.error('json is not available.')
+
+    engines = [('stillness:css', minify_css)]
+    if have_java():
+        engines.append(('yuicompressor', yui))
+
+    inputs = [(CSS_MEDIA.relpathto(fp), fp.bytes()) for fp in sorted(CSS_MEDIA.walkfiles('*.css'))]
+    inputs.append(('(combined)', '\n'.join(text for name, text in inputs)))
+
+    results = []
+    for name, text in inputs:
+        outputs = {}
+        for engine, func in engines:
+            seconds, outputs[engine] = best_of(options.repeat, func, text)
+            results.append(dict(input=name, engine=engine, seconds=round(seconds, 6),
+                                bytes_in=len(text), bytes_out=len(outputs[engine])))
+            sys.stderr.write('%-40s %-14s %10.4fs %8d -> %8d\n' % (name, engine, seconds, len(text), len(outputs[engine])))
+        if len(outputs) > 1:
+            results[-1]['matches_stillness'] = outputs['yuicompressor'] == outputs['stillness:css']
+
+    report = dict(python=platform.python_version(), platform=platform.platform(), results=results)
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        fo = open(options.output, 'w')
+        try:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        finally:
+            fo.close()
+
+
+if __name__ == '__main__':
+    main()
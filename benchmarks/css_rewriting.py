@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""css_rewriting.py -- benchmark the CSS url() rewriting engine.
+
+Rewrites a generated, minified (single-line) stylesheet of several
+megabytes and writes the time and throughput as JSON, tagged with the
+git revision so runs on different commits can be compared::
+
+    python benchmarks/css_rewriting.py --megabytes 8 --output results.json
+"""
+import os
+import sys
+import time
+import platform
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from stillness import managers
+from build_stages import git_revision
+
+
+def make_stylesheet(size, distinct_urls=500):
+    rules = []
+    total = 0
+    i = 0
+    while total < size:
+        rule = '.r%d{color:#333;background:url(../images/i%d.png) no-repeat 0 0}' % (i, i % distinct_urls)
+        rules.append(rule)
+        total += len(rule)
+        i += 1
+    return ''.join(rules), i
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [--megabytes N] [--repeat N] [--output FILE]')
+    parser.add_option('--megabytes', type='float', default=4,
+                      help='size of the generated stylesheet (default: %default)')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='rewrites to run; the fastest is reported (default: %default)')
+    parser.add_option('--output', default='-',
+                      help='file to write JSON results to, or - for stdout (default: %default)')
+    options, args = parser.parse_args(argv)
+    if json is None:
+        parser.error('json is not available.')
+
+    assets = managers.AssetManager(debug=False, base_urls=['http://a.cdn/media', 'http://b.cdn/media'])
+    for i in range(0, 500, 2):
+        assets.versions['images/i%d.png' % i] = '%08x' % i
+    css, references = make_stylesheet(int(options.megabytes * 1024 * 1024))
+    css_map = assets.options['css']['map']
+
+    best = None
+    for i in range(options.repeat):
+        start = time.time()
+        css_map._version_css_url_includes('css/main.min.css', css)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    megabytes = len(css) / 1048576.0
+    sys.stderr.write('%d url() references in %.1f MB: %.3fs (%.1f MB/s)\n' % (
+        references, megabytes, best, megabytes / best))
+
+    report = dict(revision=git_revision(), python=platform.python_version(),
+                  platform=platform.platform(), repeat=options.repeat,
+                  results=[dict(bytes=len(css), references=references, seconds=round(best, 6),
+                                megabytes_per_second=round(megabytes / best, 3))])
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        fo = open(options.output, 'w')
+        try:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        finally:
+            fo.close()
+
+
+if __name__ == '__main__':
+    main()
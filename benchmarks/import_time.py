@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""import_time.py -- benchmark importing stillness.runtime against stillness.managers.
+
+Each import runs in a fresh interpreter, as a newly forked web worker
+would. Writes the median import time and the number of modules each
+import loads as JSON::
+
+    python benchmarks/import_time.py --repeat 20 --output results.json
+"""
+import os
+import sys
+import platform
+import subprocess
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+SCRIPT = '''import sys, time
+before = set(sys.modules)
+start = time.time()
+import %s
+elapsed = time.time() - start
+print elapsed, len([name for name in set(sys.modules) - before if sys.modules[name] is not None])
+'''
+
+MODULES = ['stillness.runtime', 'stillness.managers']
+
+
+def time_import(module):
+    process = subprocess.Popen([sys.executable, '-c', SCRIPT % module], cwd=ROOT, stdout=subprocess.PIPE)
+    seconds, modules = process.communicate()[0].split()
+    return float(seconds), int(modules)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [--repeat N] [--output FILE]')
+    parser.add_option('--repeat', type='int', default=10,
+                      help='fresh interpreters per module; the median is reported (default: %default)')
+    parser.add_option('--output', default='-',
+                      help='file to write JSON results to, or - for stdout (default: %default)')
+    options, args = parser.parse_args(argv)
+    if json is None:
+        parser.error('json is not available.')
+
+    results = []
+    for module in MODULES:
+        runs = [time_import(module) for i in range(options.repeat)]
+        seconds = median([run[0] for run in runs])
+        modules = runs[-1][1]
+        results.append(dict(module=module, median_seconds=round(seconds, 6), modules_loaded=modules))
+        sys.stderr.write('%-24s %10.4fs %5d modules\n' % (module, seconds, modules))
+
+    report = dict(python=platform.python_version(), platform=platform.platform(),
+                  repeat=options.repeat, results=results)
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        fo = open(options.output, 'w')
+        try:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        finally:
+            fo.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""manager_creation.py -- benchmark creating AssetManagers from keyword arguments and from a Config.
+
+Uses the file maps from the test suite, optionally widened with extra
+generated bundles, and writes the time per manager as JSON::
+
+    python benchmarks/manager_creation.py --bundles 500 --output results.json
+"""
+import os
+import sys
+import time
+import platform
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from stillness import managers
+from tests.managers_tests import AssetManagerTests
+
+
+def make_options(bundles):
+    options = dict(AssetManagerTests.options)
+    js = dict(options['js'])
+    js['map'] = dict(js['map'])
+    for i in range(bundles):
+        js['map']['js/generated/%04d.min.js' % i] = ['js/generated/%04d.js' % i, 'js/modernizr.min.js']
+    options['js'] = js
+    return options
+
+
+def per_call(repeat, func):
+    start = time.time()
+    for i in range(repeat):
+        func()
+    return (time.time() - start) / repeat
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [--repeat N] [--bundles N] [--output FILE]')
+    parser.add_option('--repeat', type='int', default=200,
+                      help='managers to create each way (default: %default)')
+    parser.add_option('--bundles', type='int', default=100,
+                      help='generated bundles to add to the file maps (default: %default)')
+    parser.add_option('--output', default='-',
+                      help='file to write JSON results to, or - for stdout (default: %default)')
+    options, args = parser.parse_args(argv)
+    if json is None:
+        parser.error('json is not available.')
+
+    kwargs = make_options(options.bundles)
+    config = managers.Config(**kwargs)
+
+    def from_kwargs():
+        managers.AssetManager(**kwargs).get_js_urls('js/main.min.js')
+
+    def from_config():
+        config.manager().get_js_urls('js/main.min.js')
+
+    results = []
+    for name, func in (('kwargs', from_kwargs), ('config', from_config)):
+        seconds = per_call(options.repeat, func)
+        results.append(dict(method=name, seconds_per_manager=round(seconds, 9)))
+        sys.stderr.write('%-8s %12.2fus per manager\n' % (name, seconds * 1e6))
+
+    report = dict(python=platform.python_version(), platform=platform.platform(),
+                  repeat=options.repeat, bundles=options.bundles, results=results)
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        fo = open(options.output, 'w')
+        try:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        finally:
+            fo.close()
+
+
+if __name__ == '__main__':
+    main()
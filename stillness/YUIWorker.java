@@ -0,0 +1,112 @@
+// YUIWorker.java -- A resident YUI Compressor for stillness.minifiers.
+//
+// Reads netstring-framed bundles on stdin until it is closed, and
+// answers each with a netstring holding "K" and the compressed text, or
+// "E" and an error message. One JVM then serves a whole build instead of
+// one per bundle. The output matches `java -jar yuicompressor.jar` with
+// its default options.
+//
+// A JDK 11 or later runs it straight from source:
+//
+//     java -cp yuicompressor-2.4.2.jar YUIWorker.java css [charset]
+//
+// Older JDKs need it compiled first:
+//
+//     javac -cp yuicompressor-2.4.2.jar YUIWorker.java
+//     java -cp yuicompressor-2.4.2.jar:. YUIWorker js [charset]
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.io.StringReader;
+import java.io.StringWriter;
+
+import com.yahoo.platform.yui.compressor.CssCompressor;
+import com.yahoo.platform.yui.compressor.JavaScriptCompressor;
+import org.mozilla.javascript.ErrorReporter;
+import org.mozilla.javascript.EvaluatorException;
+
+public class YUIWorker {
+    public static void main(String[] args) throws IOException {
+        if (args.length < 1 || !(args[0].equals("css") || args[0].equals("js"))) {
+            System.err.println("usage: YUIWorker css|js [charset]");
+            System.exit(2);
+        }
+        boolean css = args[0].equals("css");
+        String charset = args.length > 1 ? args[1] : "UTF-8";
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        OutputStream out = new BufferedOutputStream(System.out);
+        byte[] request;
+        while ((request = readNetstring(in)) != null) {
+            String response;
+            try {
+                response = "K" + compress(new String(request, charset), css);
+            } catch (Exception e) {
+                response = "E" + e;
+            }
+            writeNetstring(out, response.getBytes(charset));
+        }
+    }
+
+    static String compress(String text, boolean css) throws IOException {
+        StringWriter out = new StringWriter();
+        if (css) {
+            new CssCompressor(new StringReader(text)).compress(out, -1);
+        } else {
+            new JavaScriptCompressor(new StringReader(text), new Reporter())
+                .compress(out, -1, true, false, false, false);
+        }
+        return out.toString();
+    }
+
+    static byte[] readNetstring(DataInputStream in) throws IOException {
+        int length = 0;
+        boolean started = false;
+        int c;
+        while ((c = in.read()) != ':') {
+            if (c == -1) {
+                if (started) {
+                    throw new EOFException("Stream closed inside a frame header.");
+                }
+                return null;
+            }
+            if (c < '0' || c > '9') {
+                throw new IOException("Malformed frame header.");
+            }
+            length = length * 10 + (c - '0');
+            started = true;
+        }
+        byte[] data = new byte[length];
+        in.readFully(data);
+        if (in.read() != ',') {
+            throw new EOFException("Stream closed inside a frame.");
+        }
+        return data;
+    }
+
+    static void writeNetstring(OutputStream out, byte[] data) throws IOException {
+        out.write((data.length + ":").getBytes("US-ASCII"));
+        out.write(data);
+        out.write(',');
+        out.flush();
+    }
+
+    // Warnings go to stderr, as they do from the command line; errors fail the bundle.
+    static class Reporter implements ErrorReporter {
+        public void warning(String message, String sourceName, int line, String lineSource, int lineOffset) {
+            System.err.println("[WARNING] " + line + ":" + lineOffset + ": " + message);
+        }
+
+        public void error(String message, String sourceName, int line, String lineSource, int lineOffset) {
+            throw runtimeError(message, sourceName, line, lineSource, lineOffset);
+        }
+
+        public EvaluatorException runtimeError(String message, String sourceName, int line,
+                                               String lineSource, int lineOffset) {
+            return new EvaluatorException(message, sourceName, line, lineSource, lineOffset);
+        }
+    }
+}
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """stillness -- a static asset manager for stressed webmasters.
-"""
-__all__ = ['managers']
 
-import managers
\ No newline at end of file
+Build with `stillness.managers`; serve URLs and HTML from a web
+process with the lighter `stillness.runtime`. Neither is imported
+until asked for, so importing one doesn't pay for the other.
+"""
+__all__ = ['managers', 'runtime']
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""stillness.builds -- Builds that run in the background and can be cancelled.
+
+`AssetManager.build_async` starts a build on its own thread and returns
+a BuildHandle straight away, so a caller's event loop is never blocked
+by minifiers or file I/O. The handle works like a future: poll it with
+`done`, wait with `result`, or have `add_done_callback` tell you.
+
+Cancelling kills any minifier processes the build has running, and
+removes the outputs of the bundles in progress. Bundles that had
+already finished keep their outputs.
+"""
+import os
+import sys
+import signal
+import threading
+import traceback
+import subprocess
+
+__all__ = ['BuildHandle', 'CancelToken', 'BuildCancelled']
+
+
+class BuildCancelled(RuntimeError):
+    """Raised by a build that was cancelled.
+    """
+
+
+class CancelToken(object):
+    """Tells a build to stop, and kills the processes it registered.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    def popen(self, *args, **kwargs):
+        """Start a subprocess.Popen that cancelling will kill, and track it.
+
+        Where possible the process leads its own process group, so that
+        the children of a shell command are killed with it.
+        """
+        if hasattr(os, 'setpgrp'):
+            kwargs['preexec_fn'] = os.setpgrp
+        process = subprocess.Popen(*args, **kwargs)
+        self.track(process)
+        return process
+
+    def cancel(self):
+        self._event.set()
+        self._lock.acquire()
+        try:
+            processes = list(self._processes)
+        finally:
+            self._lock.release()
+        for process in processes:
+            kill(process)
+
+    def cancelled(self):
+        return self._event.isSet()
+
+    def check(self):
+        """Raise BuildCancelled if the build has been cancelled.
+        """
+        if self._event.isSet():
+            raise BuildCancelled('The build was cancelled.')
+
+    def track(self, process):
+        """Kill `process` if the build is cancelled before it is untracked.
+        """
+        self._lock.acquire()
+        try:
+            self._processes.add(process)
+        finally:
+            self._lock.release()
+        if self._event.isSet():
+            kill(process)
+
+    def untrack(self, process):
+        self._lock.acquire()
+        try:
+            self._processes.discard(process)
+        finally:
+            self._lock.release()
+
+
+def kill(process):
+    try:
+        if hasattr(os, 'killpg') and os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:  # It has already exited.
+        pass
+
+
+class BuildHandle(object):
+    """A build running on a background thread.
+
+    @param build: called with a CancelToken; its return value is the build's result.
+    """
+    def __init__(self, build):
+        self.token = CancelToken()
+        self._build = build
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, name='stillness-build')
+        self._thread.setDaemon(True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self._result = self._build(self.token)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._lock.acquire()
+        try:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            self._call(callback)
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            sys.stderr.write('Exception in build callback %r:\n' % callback)
+            traceback.print_exc()
+
+    def cancel(self):
+        """Ask the build to stop. Returns False if it had already finished.
+        """
+        if self._done.isSet():
+            return False
+        self.token.cancel()
+        return True
+
+    def cancelled(self):
+        return self._done.isSet() and self._exc_info is not None and isinstance(self._exc_info[1], BuildCancelled)
+
+    def done(self):
+        return self._done.isSet()
+
+    def running(self):
+        return not self._done.isSet()
+
+    def wait(self, timeout=None):
+        """Wait for the build to finish. Returns whether it has.
+        """
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """Wait for the build, and return its result or raise its exception.
+
+        Raises RuntimeError if `timeout` seconds pass first.
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('The build is still running.')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the build, and return the exception it failed with, or None.
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('The build is still running.')
+        return self._exc_info and self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        """Call `callback` with this handle once the build finishes.
+
+        Callbacks run on the build thread; use something like the event
+        loop's `call_soon_threadsafe` to get back onto your own.
+        """
+        self._lock.acquire()
+        try:
+            if not self._done.isSet():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        self._call(callback)
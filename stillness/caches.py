@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""stillness.caches -- An on-disk, content-addressed minification cache.
+
+Entries are stored under the cache directory by the SHA1 digest of the
+minifier input, the minify command, and a stamp of any files named in
+the command (such as the compressor jar). Reading an entry touches its
+mtime, so eviction removes the least recently used entries first. A
+full cache is pruned to below its maximum size, so that eviction, which
+scans the whole cache, happens once per many writes rather than on each.
+
+To prune a cache from the command line::
+
+    python -m stillness.caches /path/to/cache --max-size 100M
+"""
+import os
+import shutil
+import hashlib
+import threading
+import optparse
+
+from path import path
+
+__all__ = ['MinifyCache']
+
+
+class MinifyCache(object):
+    """A size-bounded, least-recently-used cache of minified text.
+
+    @param low_water: the fraction of `max_size` to prune down to once
+    the cache goes over it.
+    """
+    def __init__(self, directory, max_size=256 * 1024 * 1024, low_water=0.8):
+        self.directory = path(directory)
+        self.max_size = max_size
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """Return a dictionary of the cache counters.
+        """
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def _command_stamp(self, command):
+        """Return a stamp of the files named in `command`.
+
+        Swapping in a different compressor jar under the same name
+        still invalidates the cache.
+        """
+        try:
+            return self._stamps[command]
+        except KeyError:
+            pass
+        stamp = hashlib.sha1()
+        for token in command.split():
+            token = token.strip('\'"')
+            if os.path.isfile(token):
+                stamp.update(path(token).read_md5())
+        return self._stamps.setdefault(command, stamp.hexdigest())
+
+    def key(self, text, command):
+        """Return the cache key for minifying `text` with `command`.
+        """
+        return self.key_chunks([text], command)
+
+    def key_chunks(self, chunks, command):
+        """Return the cache key for minifying the concatenated `chunks` with `command`.
+        """
+        digest = hashlib.sha1()
+        digest.update(command)
+        digest.update('\0')
+        digest.update(self._command_stamp(command))
+        digest.update('\0')
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return self.directory / key[:2] / key[2:]
+
+    def get(self, key):
+        """Return the cached text for `key`, or None.
+        """
+        fi = self.open(key)
+        if fi is None:
+            return None
+        try:
+            return fi.read()
+        finally:
+            fi.close()
+
+    def open(self, key):
+        """Return an open file of the cached text for `key`, or None.
+        """
+        fp = self._entry_path(key)
+        try:
+            fi = open(fp, 'rb')
+        except IOError:
+            self._increment('misses')
+            return None
+        try:
+            os.utime(fp, None)
+        except OSError:
+            pass  # Evicted by another process in the meantime.
+        self._increment('hits')
+        return fi
+
+    def put(self, key, text):
+        """Store `text` under `key`, evicting old entries if the cache is full.
+        """
+        fp, tmp_fp = self._prepare_entry(key)
+        fo = open(tmp_fp, 'wb')
+        try:
+            fo.write(text)
+        finally:
+            fo.close()
+        self._commit_entry(tmp_fp, fp)
+
+    def put_file(self, key, filename):
+        """Store a copy of the file `filename` under `key`.
+        """
+        fp, tmp_fp = self._prepare_entry(key)
+        shutil.copyfile(filename, tmp_fp)
+        self._commit_entry(tmp_fp, fp)
+
+    def _prepare_entry(self, key):
+        fp = self._entry_path(key)
+        if not fp.parent.exists():
+            try:
+                fp.parent.makedirs()
+            except OSError:
+                if not fp.parent.isdir():
+                    raise
+        tmp_fp = fp + '.%s.%s.tmp' % (os.getpid(), threading.currentThread().getName())
+        return fp, tmp_fp
+
+    def _commit_entry(self, tmp_fp, fp):
+        size = os.path.getsize(tmp_fp)
+        try:
+            size -= os.path.getsize(fp)  # Replacing an entry.
+        except OSError:
+            pass
+        os.rename(tmp_fp, fp)
+
+        self._lock.acquire()
+        try:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self.max_size is not None and self._size > self.max_size:
+                self._prune(int(self.max_size * self.low_water))
+        finally:
+            self._lock.release()
+
+    def prune(self, max_size=None):
+        """Evict least recently used entries until the cache fits in `max_size` bytes.
+
+        Returns the number of entries removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        self._lock.acquire()
+        try:
+            return self._prune(max_size)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        return self.prune(0)
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        entries = []
+        for fp in self.directory.walkfiles():
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fp))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for mtime, size, fp in self._entries())
+
+    def _prune(self, max_size):
+        entries = self._entries()
+        entries.sort()
+        total = sum(size for mtime, size, fp in entries)
+        removed = 0
+        for mtime, size, fp in entries:
+            if total <= max_size:
+                break
+            try:
+                fp.remove()
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        self._size = total
+        self.evictions += removed
+        return removed
+
+    def _increment(self, counter):
+        self._lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self._lock.release()
+
+
+def parse_size(size):
+    """Parse a size like '512K', '100M' or '2G' into bytes.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper()
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog CACHE_DIR [--max-size SIZE]')
+    parser.add_option('--max-size', default='256M',
+                      help='prune the cache down to this size, e.g. 100M (default: %default)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('expected exactly one cache directory')
+    cache = MinifyCache(args[0])
+    removed = cache.prune(parse_size(options.max_size))
+    print 'Removed %d entries from %s' % (removed, cache.directory)
+
+
+if __name__ == '__main__':
+    main()
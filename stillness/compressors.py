@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""stillness.compressors -- Precompressed sidecars for build outputs.
+
+Web servers that support static precompressed serving (such as nginx's
+gzip_static) will send `name.gz` in place of `name` to clients that
+accept gzip, instead of compressing the same bytes on every request.
+"""
+import os
+import gzip
+
+__all__ = ['gzip_file']
+
+CHUNK_SIZE = 64 * 1024
+
+
+def gzip_file(filename, sidecar=None, level=9):
+    """Compress `filename` to a gzip sidecar, `filename.gz` by default.
+
+    The sidecar has no embedded name or timestamp, so identical
+    inputs always give identical sidecars. Returns the sidecar's size.
+    """
+    if sidecar is None:
+        sidecar = filename + '.gz'
+    tmp_sidecar = sidecar + '.tmp'
+    fi = open(filename, 'rb')
+    try:
+        fo = open(tmp_sidecar, 'wb')
+        try:
+            gz = gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=fo, mtime=0)
+            try:
+                chunk = fi.read(CHUNK_SIZE)
+                while chunk:
+                    gz.write(chunk)
+                    chunk = fi.read(CHUNK_SIZE)
+            finally:
+                gz.close()
+        finally:
+            fo.close()
+    except:
+        if os.path.exists(tmp_sidecar):
+            os.remove(tmp_sidecar)
+        raise
+    finally:
+        fi.close()
+    os.rename(tmp_sidecar, sidecar)
+    return os.path.getsize(sidecar)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""stillness.configs -- Immutable option trees, and reading them from files.
+
+`freeze` turns a tree of options into FrozenDicts and tuples, which
+can be hashed and shared between threads without copying. `thaw`
+turns one back into plain dicts that can be changed.
+"""
+import posixpath
+
+try:
+    import json
+except ImportError:
+    json = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+__all__ = ['FrozenDict', 'freeze', 'thaw', 'read_options']
+
+
+class FrozenDict(dict):
+    """A dict that can't be changed, and so can be hashed.
+    """
+    __slots__ = ('_hash',)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('These options are frozen; make a new Config with Config.replace() instead.')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.iteritems()))
+            return self._hash
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, dict.__repr__(self))
+
+
+def freeze(value):
+    """Return an immutable copy of `value`, with dicts made FrozenDicts and lists tuples.
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+def thaw(value):
+    """Return a copy of `value` with every dict, frozen or not, made a new plain dict.
+    """
+    if isinstance(value, dict):
+        return dict((k, thaw(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(thaw(v) for v in value)
+    return value
+
+
+def _str_keys(pairs):
+    return dict((str(k), v) for k, v in pairs)
+
+
+def read_options(filename):
+    """Read a dict of AssetManager options from a JSON or YAML file, going by its extension.
+    """
+    ext = posixpath.splitext(filename)[1].lower()
+    if ext in ('.yaml', '.yml'):
+        if yaml is None:
+            raise RuntimeError('yaml is not available.')
+        load = yaml.safe_load
+    else:
+        if json is None:
+            raise RuntimeError('json is not available.')
+        load = lambda fi: json.load(fi, object_pairs_hook=_str_keys)
+    fi = open(filename, 'r')
+    try:
+        return load(fi) or {}
+    finally:
+        fi.close()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""stillness.cssmin -- An in-process CSS minifier.
+
+Follows the rules of the YUI Compressor's CSS minifier, so output is
+close to what the bundled jar produces, without starting a JVM:
+
+  - Comments are removed, except for `/*! ... */` comments and the
+    Mac IE comment hack (`/*\\*/ ... /**/`).
+  - Whitespace is collapsed and removed around punctuation.
+  - Zero values lose their units, and runs of zeros collapse to one.
+  - Leading zeros are dropped from fractions.
+  - rgb() colours become hex, and #aabbcc becomes #abc.
+  - Redundant semicolons and empty rules are dropped.
+
+Strings are never modified.
+"""
+import re
+
+__all__ = ['minify_css']
+
+VERSION = '1'
+
+_tokens_re = re.compile(r'''("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')|(/\*.*?\*/)''', re.DOTALL)
+_placeholder_re = re.compile(r'___STILLNESS_(?:STRING|COMMENT)_(\d+)___')
+_comment_space_re = re.compile(r'\s*(___STILLNESS_COMMENT_\d+___)\s*')
+_whitespace_re = re.compile(r'\s+')
+_pseudo_class_re = re.compile(r'(^|\})(([^\{:])+:)+([^\{]*\{)')
+_space_before_re = re.compile(r'\s+([!{};:>+\)\],])')
+_space_after_re = re.compile(r'([!{}:;>+\(\[,])\s+')
+_trailing_semicolon_re = re.compile(r';+\}')
+_zero_units_re = re.compile(r'(^|[^.0-9a-zA-Z_-])(?:0?\.)?0(?:px|em|%|in|cm|mm|pc|pt|ex)(?![a-zA-Z0-9%])')
+_zeros_re = re.compile(r':0(?: 0){1,3}(;|\})')
+_background_position_re = re.compile(r'(background-position|transform-origin|-webkit-transform-origin|-moz-transform-origin):0(;|\})', re.I)
+_leading_zero_re = re.compile(r'(:|\s|,|\()(-?)0+\.(\d+)')
+_rgb_re = re.compile(r'rgb\s*\(\s*([0-9,\s]+)\s*\)', re.I)
+_hex_re = re.compile(r'([^"\'=\s])(\s*)#([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])([0-9a-fA-F])')
+_none_re = re.compile(r'(border|border-top|border-right|border-bottom|border-left|outline|background):none(;|\})', re.I)
+_alpha_re = re.compile(r'progid:DXImageTransform\.Microsoft\.Alpha\(Opacity=', re.I)
+_empty_rule_re = re.compile(r'[^\};\{\/]+\{\}')
+_semicolons_re = re.compile(r';;+')
+_charset_re = re.compile(r'^(.+?)(@charset ___STILLNESS_STRING_\d+___;)', re.I)
+
+
+def minify_css(css):
+    """Return the minified text of the stylesheet `css`.
+    """
+    preserved = []
+    state = {'in_hack': False}
+
+    def preserve(kind, text):
+        preserved.append(text)
+        return '___STILLNESS_%s_%d___' % (kind, len(preserved) - 1)
+
+    def protect(match):
+        string, comment = match.groups()
+        if string is not None:
+            return preserve('STRING', string)
+        if comment.startswith('/*!'):
+            return preserve('COMMENT', comment)
+        if comment.endswith('\\*/'):
+            state['in_hack'] = True
+            return preserve('COMMENT', '/*\\*/')
+        if state['in_hack']:
+            state['in_hack'] = False
+            return preserve('COMMENT', '/**/')
+        return ' '
+
+    css = _tokens_re.sub(protect, css)
+
+    css = _whitespace_re.sub(' ', css)
+    css = _comment_space_re.sub(r'\1', css)
+    # Keep the space in descendant pseudo-class selectors like `p :link`.
+    css = _pseudo_class_re.sub(lambda m: m.group().replace(':', '___STILLNESS_COLON___'), css)
+    css = _space_before_re.sub(r'\1', css)
+    css = css.replace('___STILLNESS_COLON___', ':')
+    css = _space_after_re.sub(r'\1', css)
+    css = _trailing_semicolon_re.sub('}', css)
+
+    css = _zero_units_re.sub(r'\g<1>0', css)
+    css = _zeros_re.sub(r':0\1', css)
+    css = _background_position_re.sub(lambda m: '%s:0 0%s' % (m.group(1).lower(), m.group(2)), css)
+    css = _leading_zero_re.sub(r'\1\2.\3', css)
+
+    css = _rgb_re.sub(_rgb_to_hex, css)
+    css = _hex_re.sub(_shorten_hex, css)
+    css = _none_re.sub(lambda m: '%s:0%s' % (m.group(1).lower(), m.group(2)), css)
+    css = _alpha_re.sub('alpha(opacity=', css)
+
+    css = _empty_rule_re.sub('', css)
+    css = _semicolons_re.sub(';', css)
+    css = _charset_re.sub(_hoist_charset, css)
+
+    css = _placeholder_re.sub(lambda m: preserved[int(m.group(1))], css)
+    return css.strip()
+
+
+def _rgb_to_hex(match):
+    try:
+        channels = [int(c) for c in match.group(1).split(',')]
+    except ValueError:
+        return match.group()
+    if len(channels) != 3 or [c for c in channels if c > 255]:
+        return match.group()
+    return '#%02x%02x%02x' % tuple(channels)
+
+
+def _shorten_hex(match):
+    prefix, space, a, b, c, d, e, f = match.groups()
+    if a.lower() == b.lower() and c.lower() == d.lower() and e.lower() == f.lower():
+        return '%s%s#%s%s%s' % (prefix, space, a, c, e)
+    return '%s%s#%s%s%s%s%s%s' % (prefix, space, a, b, c, d, e, f)
+
+
+def _hoist_charset(match):
+    """Only one @charset is allowed, at the very start."""
+    return match.group(2) + match.group(1)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""stillness.discovery -- Fast asset discovery for Stillness.
+
+Walks asset directories with `scandir`, where available, so that file
+types come from the directory listing instead of a stat call per
+entry. Whole directories can be pruned by pattern before they are
+listed, and top-level subtrees can be walked in parallel.
+"""
+import os
+import re
+import stat
+import posixpath
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from path import path
+
+__all__ = ['AssetFinder']
+
+
+def list_directory(directory):
+    """Return a sorted list of (name, is_dir, is_file) for each entry of the directory.
+
+    Like `path.isdir` and `path.isfile`, symbolic links are followed.
+    Entries that vanish or can't be examined are skipped.
+    """
+    entries = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            try:
+                is_dir = entry.is_dir()
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+            entries.append((entry.name, is_dir, is_file))
+    else:
+        for name in os.listdir(directory):
+            try:
+                mode = os.stat(os.path.join(directory, name)).st_mode
+            except OSError:
+                continue
+            entries.append((name, stat.S_ISDIR(mode), stat.S_ISREG(mode)))
+    entries.sort()
+    return entries
+
+
+class AssetFinder(object):
+    """Finds files whose names match a pattern, compiled once and reused.
+
+    @param pattern: a regular expression that file names must match.
+
+    @param recurse: whether to descend into subdirectories.
+
+    @param include_dirs: if given, a regular expression searched for in
+    each subdirectory's path, relative to the root; only matching
+    directories are entered.
+
+    @param exclude_dirs: if given, a regular expression searched for in
+    each subdirectory's relative path; matching directories are pruned.
+    """
+    def __init__(self, pattern, recurse=True, include_dirs=None, exclude_dirs=None):
+        self.pattern = re.compile(pattern)
+        self.recurse = recurse
+        self.include_dirs = include_dirs and re.compile(include_dirs)
+        self.exclude_dirs = exclude_dirs and re.compile(exclude_dirs)
+
+    def _enters(self, rel_dir):
+        if self.include_dirs and not self.include_dirs.search(rel_dir):
+            return False
+        if self.exclude_dirs and self.exclude_dirs.search(rel_dir):
+            return False
+        return True
+
+    def find(self, root, jobs=1):
+        """Return a list of the matching files under `root`, in a stable order.
+
+        With more than one job, the top-level subdirectories of `root`
+        are walked by a pool of threads.
+        """
+        root = path(root)
+        found = []
+        subdirs = []
+        match = self.pattern.match
+        for name, is_dir, is_file in list_directory(root):
+            if is_file:
+                if match(name):
+                    found.append(root / name)
+            elif is_dir and self.recurse and self._enters(name):
+                subdirs.append(name)
+
+        if jobs > 1 and len(subdirs) > 1:
+            pool = ThreadPool(min(jobs, len(subdirs)))
+            try:
+                subtrees = pool.map(lambda rel_dir: self._walk(root, rel_dir), subdirs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            subtrees = [self._walk(root, rel_dir) for rel_dir in subdirs]
+        for subtree in subtrees:
+            found.extend(subtree)
+        return found
+
+    def _walk(self, root, top):
+        """Walk the subtree `top` of `root` depth-first, without recursion.
+        """
+        found = []
+        match = self.pattern.match
+        join = posixpath.join
+        stack = [top]
+        while stack:
+            rel_dir = stack.pop()
+            directory = root / rel_dir
+            subdirs = []
+            for name, is_dir, is_file in list_directory(directory):
+                if is_file:
+                    if match(name):
+                        found.append(directory / name)
+                elif is_dir:
+                    rel_subdir = join(rel_dir, name)
+                    if self._enters(rel_subdir):
+                        subdirs.append(rel_subdir)
+            stack.extend(reversed(subdirs))
+        return found
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""stillness.fingerprints -- Fingerprinted output filenames.
+
+With fingerprinting on, each built bundle and versioned asset is also
+written as `name.<version>.ext`. A changed file gets a new name, so the
+old names can be served with far-future cache headers.
+
+Contents are stored once, under their SHA-1 in an object directory,
+and every fingerprinted name with those contents is a hard link to
+the object. Where hard links aren't available, files are copied.
+"""
+import os
+import errno
+import shutil
+import hashlib
+
+from path import path
+from runtime import fingerprinted_key
+
+__all__ = ['fingerprinted_key', 'ObjectStore']
+
+
+class ObjectStore(object):
+    """A directory of file contents named by their SHA-1.
+
+    @param directory: where the objects are kept. Must be on the same
+    filesystem as the links to them for hard links to work.
+
+    @param hash_file: called with a hash object and a filename, feeds the
+    file to the hash object and returns it. Defaults to reading it whole.
+    """
+    def __init__(self, directory, hash_file=None):
+        self.directory = path(directory)
+        self.hash_file = hash_file or _hash_file
+
+    def _object_path(self, digest):
+        return self.directory / digest[:2] / digest[2:]
+
+    def add(self, source):
+        """Store the contents of `source` if they aren't already, and return the object's path.
+        """
+        digest = self.hash_file(hashlib.sha1(), source).hexdigest()
+        obj = self._object_path(digest)
+        if not obj.exists():
+            if not obj.parent.exists():
+                try:
+                    obj.parent.makedirs()
+                except OSError:
+                    if not obj.parent.isdir():
+                        raise
+            tmp = obj + '.%d.tmp' % os.getpid()
+            shutil.copyfile(source, tmp)
+            os.rename(tmp, obj)
+        return obj
+
+    def link(self, source, target):
+        """Make `target` a file with the contents of `source`, sharing storage with identical files.
+        """
+        target = path(target)
+        obj = self.add(source)
+        if target.exists() and _same_file(obj, target):
+            return target
+        if not target.parent.exists():
+            target.parent.makedirs()
+        tmp = target + '.%d.tmp' % os.getpid()
+        if tmp.exists():
+            tmp.remove()
+        try:
+            os.link(obj, tmp)
+        except (AttributeError, OSError):  # No hard links on this platform or filesystem.
+            shutil.copyfile(obj, tmp)
+        os.rename(tmp, target)
+        return target
+
+    def prune(self):
+        """Remove objects no longer linked from anywhere. Returns the number removed.
+        """
+        removed = 0
+        if not self.directory.exists():
+            return removed
+        for obj in self.directory.walkfiles():
+            try:
+                if os.stat(obj).st_nlink <= 1:
+                    obj.remove()
+                    removed += 1
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return removed
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except (AttributeError, OSError):
+        return False
+
+
+def _hash_file(hasher, filename):
+    hasher.update(path(filename).bytes())
+    return hasher
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""stillness.images -- Lossless PNG recompression.
+
+`optimize_png` rewrites a PNG with the same pixels in fewer bytes: it
+drops ancillary chunks that don't affect how the image looks, chooses
+a filter for each scanline, and deflates the image data again at the
+highest zlib level. It is pure Python, so the build runs it across a
+process pool, with `optimize_png_file` reading and writing each image
+in the worker.
+
+Animated PNGs, and PNGs this module can't read, are left as they are.
+"""
+import os
+import zlib
+import struct
+import traceback
+
+__all__ = ['optimize_png', 'optimize_png_file', 'write_png', 'PNGError', 'KEEP_CHUNKS', 'format_report']
+
+VERSION = '1'  # Bump when the output for the same input changes.
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Ancillary chunks kept by default, because they change the colours shown.
+KEEP_CHUNKS = ('gAMA', 'cHRM', 'sRGB', 'iCCP')
+
+# Ancillary chunks that are always kept, because they are part of the pixels.
+ALWAYS_KEEP = ('tRNS',)
+
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+_CHUNK_HEADER = struct.Struct('>I4s')
+_IHDR = struct.Struct('>IIBBBBB')
+_ABS = [min(v, 256 - v) for v in range(256)]
+
+
+class PNGError(ValueError):
+    """Raised for data that isn't a PNG this module can rewrite.
+    """
+
+
+def read_chunks(data):
+    """Return the (type, data) chunks of a PNG, checking their CRCs.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise PNGError('Not a PNG.')
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        if pos + 12 > len(data):
+            raise PNGError('Truncated chunk at byte %d.' % pos)
+        length, chunk_type = _CHUNK_HEADER.unpack_from(data, pos)
+        body = data[pos + 8:pos + 8 + length]
+        crc = data[pos + 8 + length:pos + 12 + length]
+        if len(crc) != 4 or struct.unpack('>I', crc)[0] != zlib.crc32(chunk_type + body) & 0xffffffff:
+            raise PNGError('Bad CRC in %r chunk at byte %d.' % (chunk_type, pos))
+        chunks.append((chunk_type, body))
+        pos += 12 + length
+        if chunk_type == 'IEND':
+            break
+    if not chunks or chunks[0][0] != 'IHDR' or chunks[-1][0] != 'IEND':
+        raise PNGError('Missing IHDR or IEND chunk.')
+    return chunks
+
+
+def write_chunk(chunk_type, body):
+    return (_CHUNK_HEADER.pack(len(body), chunk_type) + body +
+            struct.pack('>I', zlib.crc32(chunk_type + body) & 0xffffffff))
+
+
+def _unfilter(filtered, height, stride, bpp):
+    """Return the raw scanlines of non-interlaced image data.
+    """
+    if len(filtered) < height * (stride + 1):
+        raise PNGError('Image data is too short.')
+    lines = []
+    prev = bytearray(stride)
+    pos = 0
+    for y in xrange(height):
+        filter_type = ord(filtered[pos])
+        line = bytearray(filtered[pos + 1:pos + 1 + stride])
+        pos += stride + 1
+        if filter_type == 1:
+            for i in xrange(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 255
+        elif filter_type == 2:
+            line = bytearray((a + b) & 255 for a, b in zip(line, prev))
+        elif filter_type == 3:
+            for i in xrange(stride):
+                left = i >= bpp and line[i - bpp] or 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 255
+        elif filter_type == 4:
+            for i in xrange(stride):
+                if i >= bpp:
+                    a = line[i - bpp]
+                    c = prev[i - bpp]
+                else:
+                    a = c = 0
+                b = prev[i]
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    line[i] = (line[i] + a) & 255
+                elif pb <= pc:
+                    line[i] = (line[i] + b) & 255
+                else:
+                    line[i] = (line[i] + c) & 255
+        elif filter_type != 0:
+            raise PNGError('Unknown filter type %d.' % filter_type)
+        lines.append(line)
+        prev = line
+    return lines
+
+
+def _paeth(r, a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return (r - a) & 255
+    if pb <= pc:
+        return (r - b) & 255
+    return (r - c) & 255
+
+
+def _filter_adaptive(lines, bpp):
+    """Filter each scanline with whichever filter gives the smallest sum of absolute differences.
+    """
+    out = []
+    prev = bytearray(len(lines[0]))
+    for line in lines:
+        left = bytearray(bpp) + line[:-bpp]
+        upleft = bytearray(bpp) + prev[:-bpp]
+        candidates = [
+            line,
+            bytearray((r - a) & 255 for r, a in zip(line, left)),
+            bytearray((r - b) & 255 for r, b in zip(line, prev)),
+            bytearray((r - ((a + b) >> 1)) & 255 for r, a, b in zip(line, left, prev)),
+            bytearray(_paeth(r, a, b, c) for r, a, b, c in zip(line, left, prev, upleft)),
+            ]
+        scores = [sum(map(_ABS.__getitem__, candidate)) for candidate in candidates]
+        best = scores.index(min(scores))
+        out.append(chr(best))
+        out.append(str(candidates[best]))
+        prev = line
+    return ''.join(out)
+
+
+def _filter_none(lines):
+    return ''.join('\0' + str(line) for line in lines)
+
+
+def _deflate(data, level):
+    """Return the smallest of `data` deflated with each zlib strategy.
+    """
+    best = None
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+        compressed = compressor.compress(data) + compressor.flush()
+        if best is None or len(compressed) < len(best):
+            best = compressed
+    return best
+
+
+def optimize_png(data, level=9, keep_chunks=KEEP_CHUNKS):
+    """Return a PNG with the same pixels as `data`, in as few bytes as this module can manage.
+
+    Returns `data` itself if it can't be made smaller. Raises PNGError
+    if it isn't a PNG that can be read.
+
+    @param level: the zlib compression level for the image data.
+
+    @param keep_chunks: the ancillary chunk types to keep. Others, such
+    as text and timestamps, are dropped; transparency is always kept.
+    """
+    chunks = read_chunks(data)
+    types = set(chunk_type for chunk_type, body in chunks)
+    if 'acTL' in types:
+        return data  # Animated; its frames are in ancillary chunks.
+    width, height, bit_depth, color_type, compression, filter_method, interlace = _IHDR.unpack(chunks[0][1])
+    if color_type not in CHANNELS or compression != 0 or filter_method != 0:
+        raise PNGError('Unsupported IHDR.')
+    try:
+        filtered = zlib.decompress(''.join(body for chunk_type, body in chunks if chunk_type == 'IDAT'))
+    except zlib.error, e:
+        raise PNGError('Bad image data: %s' % e)
+
+    candidates = [filtered]
+    if not interlace and width and height:
+        bits = CHANNELS[color_type] * bit_depth
+        stride = (width * bits + 7) // 8
+        bpp = max(1, bits // 8)
+        lines = _unfilter(filtered, height, stride, bpp)
+        candidates.append(_filter_none(lines))
+        if color_type != 3 and bit_depth >= 8:  # Filtering rarely helps palette or low bit depth images.
+            candidates.append(_filter_adaptive(lines, bpp))
+    image_data = min((_deflate(candidate, level) for candidate in candidates), key=len)
+
+    keep = set(keep_chunks) | set(ALWAYS_KEEP)
+    out = [PNG_SIGNATURE]
+    wrote_data = False
+    for chunk_type, body in chunks:
+        if chunk_type == 'IDAT':
+            if not wrote_data:
+                out.append(write_chunk('IDAT', image_data))
+                wrote_data = True
+        elif chunk_type[0].isupper() or chunk_type in keep:
+            out.append(write_chunk(chunk_type, body))
+    optimized = ''.join(out)
+    if len(optimized) >= len(data):
+        return data
+    return optimized
+
+
+def optimize_png_file(args):
+    """Optimize the PNG file `source` into `target`, for a process pool.
+
+    `args` is a tuple of (file key, source, target, level, keep_chunks).
+    Only sizes come back, so the images themselves never pass through
+    the parent process. Returns a tuple of (file key, bytes in, bytes
+    out, formatted traceback), with None for the sizes if it failed.
+    """
+    file_key, source, target, level, keep_chunks = args
+    try:
+        fi = open(source, 'rb')
+        try:
+            data = fi.read()
+        finally:
+            fi.close()
+        try:
+            optimized = optimize_png(data, level, keep_chunks)
+        except PNGError:
+            optimized = data
+        write_png(target, optimized)
+        return file_key, len(data), len(optimized), None
+    except Exception:
+        return file_key, None, None, traceback.format_exc()
+
+
+def write_png(filename, data):
+    """Write `data` to `filename` through a temporary file, unless it already holds exactly that.
+    """
+    try:
+        if os.path.getsize(filename) == len(data):
+            fi = open(filename, 'rb')
+            try:
+                if fi.read() == data:
+                    return
+            finally:
+                fi.close()
+    except (OSError, IOError):
+        pass
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):  # Another worker made it first.
+                raise
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    fo = open(tmp_filename, 'wb')
+    try:
+        fo.write(data)
+    finally:
+        fo.close()
+    os.rename(tmp_filename, filename)
+
+
+def format_report(report):
+    """Return a text table of an image optimization report, largest savings first.
+
+    @param report: a mapping of directory to a dictionary of `files`,
+    `bytes_in` and `bytes_out`, as returned by `AssetManager.optimize_images`.
+    """
+    lines = ['%-40s %6s %12s %12s %12s' % ('directory', 'files', 'bytes in', 'bytes out', 'saved')]
+    rows = sorted(report.items(), key=lambda item: item[1]['bytes_out'] - item[1]['bytes_in'])
+    for directory, totals in rows:
+        lines.append('%-40s %6d %12d %12d %12d' % (directory or '.', totals['files'], totals['bytes_in'],
+                                                   totals['bytes_out'], totals['bytes_in'] - totals['bytes_out']))
+    return '\n'.join(lines)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""stillness.instruments -- Build timing events and collectors.
+
+Listeners registered with `AssetManager.add_listener` are called with
+a StageEvent when each build stage starts and ends. Stages nest: a
+`bundle` stage (building one file key) contains `read`, `minify` and
+`write` (or a single `stream`) stages, and a `version` stage contains
+`hash` and, for CSS, `css_rewrite`. `discovery` covers `find_assets`,
+`gzip` the writing of each precompressed sidecar, `fingerprint`
+the linking of each fingerprinted name, `html` the rendering of the
+HTML manifest, and `images` the recompression of PNG assets.
+
+TimingCollector is a listener that totals the events up and prints
+the slowest stages and bundles::
+
+    collector = TimingCollector()
+    manager.add_listener(collector)
+    manager.options['css']['map'].combine_files()
+    collector.report()
+"""
+import sys
+import time
+import threading
+
+__all__ = ['StageEvent', 'TimingCollector']
+
+TOP_LEVEL_STAGES = ('bundle', 'version')
+
+
+class StageEvent(object):
+    """The start or end of one build stage.
+
+    `phase` is 'start' or 'end'. End events also carry the `duration`
+    in seconds, and where known the number of `bytes` produced,
+    whether the stage was a `cache_hit`, and the `error` it failed with.
+    """
+    __slots__ = ('stage', 'file_key', 'kind', 'phase', 'started',
+                 'duration', 'bytes', 'cache_hit', 'error')
+
+    def __init__(self, stage, file_key=None, kind=None, phase='start', started=None,
+                 duration=None, bytes=None, cache_hit=None, error=None):
+        self.stage = stage
+        self.file_key = file_key
+        self.kind = kind
+        self.phase = phase
+        if started is None:
+            started = time.time()
+        self.started = started
+        self.duration = duration
+        self.bytes = bytes
+        self.cache_hit = cache_hit
+        self.error = error
+
+    def finished(self, bytes=None, cache_hit=None, error=None):
+        """Return the end event for this start event.
+        """
+        return StageEvent(self.stage, self.file_key, self.kind, 'end', self.started,
+                          time.time() - self.started, bytes, cache_hit, error)
+
+    def __repr__(self):
+        return '<StageEvent %s %s %s %r>' % (self.phase, self.kind, self.stage, self.file_key)
+
+
+class StageTotals(object):
+    __slots__ = ('count', 'seconds', 'bytes', 'hits', 'misses', 'errors')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def add(self, event):
+        self.count += 1
+        self.seconds += event.duration
+        self.bytes += event.bytes or 0
+        if event.cache_hit is True:
+            self.hits += 1
+        elif event.cache_hit is False:
+            self.misses += 1
+        if event.error is not None:
+            self.errors += 1
+
+
+class TimingCollector(object):
+    """A listener that totals build time by stage and by file key.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.file_keys = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event.phase != 'end':
+            return
+        self._lock.acquire()
+        try:
+            self.stages.setdefault(event.stage, StageTotals()).add(event)
+            if event.file_key is not None and event.stage in TOP_LEVEL_STAGES:
+                key = (event.kind, event.file_key)
+                self.file_keys.setdefault(key, StageTotals()).add(event)
+        finally:
+            self._lock.release()
+
+    def summary(self, limit=10):
+        """Return a text table of the stages, and of the `limit` slowest bundles.
+        """
+        lines = ['%-14s %6s %10s %12s %6s %6s %6s' % ('stage', 'count', 'seconds', 'bytes', 'hits', 'misses', 'errors')]
+        stages = sorted(self.stages.items(), key=lambda item: -item[1].seconds)
+        for stage, t in stages:
+            lines.append('%-14s %6d %10.3f %12d %6d %6d %6d' % (stage, t.count, t.seconds, t.bytes, t.hits, t.misses, t.errors))
+        lines.append('')
+        lines.append('%-40s %10s %12s' % ('slowest bundles', 'seconds', 'bytes'))
+        bundles = sorted(self.file_keys.items(), key=lambda item: -item[1].seconds)[:limit]
+        for (kind, file_key), t in bundles:
+            lines.append('%-40s %10.3f %12d' % ('%s %s' % (kind, file_key), t.seconds, t.bytes))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, stream=None, limit=10):
+        """Write the summary table to `stream`, stderr by default.
+        """
+        (stream or sys.stderr).write(self.summary(limit))
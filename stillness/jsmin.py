@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""stillness.jsmin -- An in-process JavaScript whitespace and comment stripper.
+
+The source is split into tokens -- strings, template literals, regular
+expression literals, comments, words and punctuation -- and joined
+back with as little whitespace as keeps the meaning:
+
+  - Comments are removed, except `/*! ... */` and `/*@cc_on ... */`.
+  - A space is kept only where two tokens would otherwise merge, as
+    in `var a` or `a + +b`.
+  - A newline is kept only where automatic semicolon insertion could
+    depend on it: between a token that can end a statement and one
+    that can start the next.
+
+Names are not shortened, so the output is larger than the YUI
+Compressor's, but it costs no process startup.
+"""
+import re
+
+__all__ = ['minify_js', 'JSMinError']
+
+VERSION = '1'
+
+_token_re = re.compile(r'''
+    (?P<space>[ \t\f\v]+)
+  | (?P<newline>[\r\n]+)
+  | (?P<line_comment>//[^\r\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>"(?:\\[\s\S]|[^"\\\r\n])*"|'(?:\\[\s\S]|[^'\\\r\n])*')
+  | (?P<template>`(?:\\[\s\S]|[^`\\])*`)
+  | (?P<word>[\w$\\\x80-\xff]+)
+''', re.VERBOSE | re.DOTALL)
+_regex_re = re.compile(r'/(?![*/])(?:\\.|\[(?:\\.|[^\]\\\r\n])*\]|[^/\\\[\r\n])+/[\w$]*')
+_digits_re = re.compile(r'\d+$')
+
+# Words after which a slash starts a regular expression rather than a division.
+_regex_keywords = frozenset(['return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete',
+                             'void', 'throw', 'case', 'do', 'else', 'yield', 'await'])
+_word_chars = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$\\'
+                        + ''.join(chr(c) for c in range(0x80, 0x100)))
+# Characters that can end a statement, and that can start one, for ASI.
+_statement_ends = _word_chars | frozenset(')]}\'"`/+-')
+_statement_starts = _word_chars | frozenset('([{\'"`/+-!~')
+# Pairs that would read differently with the space between them removed.
+_unsafe_pairs = frozenset([('+', '+'), ('-', '-'), ('<', '!'), ('-', '>'), ('/', '/'), ('/', '*')])
+
+
+class JSMinError(ValueError):
+    """Raised for source that can't be tokenized, such as an unterminated string.
+    """
+
+
+def minify_js(js):
+    """Return `js` with insignificant whitespace and comments removed.
+    """
+    out = []
+    last = ''  # The last significant token written.
+    before_last = ''
+    regex_allowed = True
+    space = newline = False
+    pos = 0
+    end = len(js)
+    while pos < end:
+        c = js[pos]
+        match = None
+        if c == '/' and regex_allowed and js[pos + 1:pos + 2] not in ('/', '*'):
+            match = _regex_re.match(js, pos)
+            if match is None:
+                raise JSMinError('Unterminated regular expression at line %d.' % (js.count('\n', 0, pos) + 1))
+            kind = 'regex'
+        else:
+            match = _token_re.match(js, pos)
+            kind = match and match.lastgroup
+        if match is None:
+            if c in '"\'`':
+                raise JSMinError('Unterminated string at line %d.' % (js.count('\n', 0, pos) + 1))
+            token = c
+            kind = 'punct'
+            pos += 1
+        else:
+            token = match.group()
+            pos = match.end()
+
+        if kind == 'space' or kind == 'line_comment':
+            space = True
+            continue
+        if kind == 'newline':
+            newline = True
+            continue
+        if kind == 'block_comment':
+            if not (token.startswith('/*!') or token.startswith('/*@cc_on')):
+                if '\n' in token or '\r' in token:
+                    newline = True
+                else:
+                    space = True
+                continue
+            if out and newline:
+                out.append('\n')
+            out.append(token)
+            out.append('\n')
+            space = newline = False
+            continue
+
+        if last:
+            if newline and last[-1] in _statement_ends and token[0] in _statement_starts:
+                out.append('\n')
+            elif (space or newline) and _needs_space(last, token):
+                out.append(' ')
+        out.append(token)
+        space = newline = False
+
+        if kind == 'word':
+            regex_allowed = token in _regex_keywords
+        elif kind == 'punct':
+            # `a++ / b` divides; `++` can only follow an operand.
+            postfix = token in '+-' and last == token and before_last != '' and before_last[-1] in _statement_ends
+            regex_allowed = token not in ')]}' and not postfix
+        else:
+            regex_allowed = False
+        before_last = last
+        last = token
+    return ''.join(out).strip()
+
+
+def _needs_space(last, token):
+    if last[-1] in _word_chars and token[0] in _word_chars:
+        return True
+    if (last[-1], token[0]) in _unsafe_pairs:
+        return True
+    # `1 .toString()` is not `1.toString()`.
+    return token == '.' and _digits_re.match(last) is not None
@@ -3,54 +3,199 @@
 """
 import sys
 import os
+import posixpath
 import copy
+import fnmatch
+import errno
+import hashlib
 import subprocess
 import itertools
 import time
 import re
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
-from versioners import Versions
+from versioners import Versions, StatCache, MappedVersions
+from minifiers import MinifierService, MinifyError, get_engine, looks_minified
+from manifests import BuildManifest, CompressionManifest, FingerprintManifest, write_json
+from fingerprints import ObjectStore
+from runtime import (fingerprinted_key, shard_base_url, render_css_html, render_js_html, BASE_URL_STRATEGIES,
+                     css_html_key, js_html_key, html_settings, HTMLManifest,
+                     CSS_HTML, CSS_HTML_DEFAULTS, JS_HTML, JS_HTML_DEFAULTS)
+from compressors import gzip_file
+from caches import MinifyCache
+from images import optimize_png_file, write_png, KEEP_CHUNKS, VERSION as IMAGES_VERSION
+from discovery import AssetFinder
+from watchers import Watcher
+from instruments import StageEvent
+from builds import BuildHandle, BuildCancelled
+from configs import freeze, thaw, read_options
 
 from path import path
 
 __path__ = path(__file__).abspath().dirname()
 
-__all__ = ['Assetmanager', 'FileMap']
-
-_RECURSION_LIMIT = sys.getrecursionlimit() - 2  # Just to be safe...!
+__all__ = ['Assetmanager', 'Config', 'FileMap', 'BuildError', 'IncludeCycleError', 'BuildCancelled', 'MinifyError']
 
 YUICOMPRESSOR = __path__ / 'yuicompressor-2.4.2.jar'
 
+# The CancelToken of the build running on each thread, if any.
+_build_context = threading.local()
+
+
+class BuildError(RuntimeError):
+    """Raised when one or more files fail to build.
+
+    `errors` maps each failed file key to its formatted traceback.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        details = '\n'.join('%s:\n%s' % (fk, errors[fk]) for fk in sorted(errors))
+        super(BuildError, self).__init__('%d file(s) failed to build.\n%s' % (len(errors), details))
+
+
+class IncludeCycleError(RuntimeError):
+    """Raised when a FileMap includes itself, directly or indirectly.
+
+    `cycle` is the list of file keys forming the loop, starting and
+    ending with the same key.
+    """
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super(IncludeCycleError, self).__init__('Include cycle in file map: %s' % ' -> '.join(cycle))
+
 
 class FileMap(dict):
-    """A recursive dictionary. Watch out for infinite loops!
+    """A recursive dictionary.
+
+    Looking up a file key returns its mapped files with every included
+    file key expanded in place. The expansions are compiled once into a
+    table, and recompiled after the map is changed. Mapped lists should
+    be replaced rather than modified in place.
     """
     def __init__(self, manager, kind, *args, **kwargs):
         self.manager = manager
         self.kind = kind
+        self.generation = 0
+        self._expanded = None
+        self._include_order = None
+        self._asset_pattern = None
+        self._css_urls = {}
+        self._css_assets = {}
         super(FileMap, self).__init__(*args, **kwargs)
 
-    def _recurse_included_filekeys(self, filekey, callcount=0):
-        """Process the given file map recursively, expanding included files.
-    
-        @param to_file_key: The filename on the left of the map to combine to.
-        """
-        if callcount == _RECURSION_LIMIT:
-            raise RuntimeError("Hit the recursion limit while trying to include recursively-mapped files. Perhaps your have a loop?")
-        for inc_key in self.get(filekey, ()):
-            if inc_key in self:
-                for rfk in self._recurse_included_filekeys(inc_key, callcount + 1):
-                    yield rfk
-            else:
-                yield inc_key
+    def _compile(self):
+        """Flatten the include graph into a table of expanded file lists.
+
+        Walks the graph iteratively, so deep include chains can't hit
+        the recursion limit, and reports a loop as soon as it's found.
+        """
+        expanded = {}
+        order = []
+        for root in sorted(dict.keys(self)):
+            if root in expanded:
+                continue
+            stack = [(root, iter(dict.__getitem__(self, root)))]
+            trail = [root]
+            visiting = {root: 0}
+            while stack:
+                key, children = stack[-1]
+                for child in children:
+                    if child in expanded or not dict.__contains__(self, child):
+                        continue
+                    if child in visiting:
+                        raise IncludeCycleError(trail[visiting[child]:] + [child])
+                    visiting[child] = len(trail)
+                    trail.append(child)
+                    stack.append((child, iter(dict.__getitem__(self, child))))
+                    break
+                else:
+                    stack.pop()
+                    trail.pop()
+                    del visiting[key]
+                    files = []
+                    for child in dict.__getitem__(self, key):
+                        if child in expanded:
+                            files.extend(expanded[child])
+                        else:
+                            files.append(child)
+                    expanded[key] = files
+                    order.append(key)
+        self._expanded = expanded
+        self._include_order = order
+
+    def _invalidate(self):
+        self.generation += 1
+        self._expanded = None
+        self._include_order = None
+
+    def bind(self, manager):
+        """Return a copy of this map for `manager`, sharing the compiled expansions.
+
+        The copy is made in one C-level dict.update, sharing the mapped
+        lists, so this stays cheap for large maps.
+        """
+        if self._expanded is None:
+            self._compile()
+        bound = FileMap(manager, self.kind)
+        dict.update(bound, self)
+        bound.generation = self.generation
+        bound._expanded = self._expanded
+        bound._include_order = self._include_order
+        return bound
+
+    def include_order(self):
+        """Return the mapped file keys, with included keys before their includers.
+        """
+        if self._expanded is None:
+            self._compile()
+        return list(self._include_order)
 
     def __getitem__(self, key):
-        return list(self._recurse_included_filekeys(key))
+        if self._expanded is None:
+            self._compile()
+        return list(self._expanded.get(key, ()))
+
+    def __setitem__(self, key, value):
+        super(FileMap, self).__setitem__(key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        super(FileMap, self).__delitem__(key)
+        self._invalidate()
+
+    def clear(self):
+        super(FileMap, self).clear()
+        self._invalidate()
+
+    def pop(self, *args):
+        try:
+            return super(FileMap, self).pop(*args)
+        finally:
+            self._invalidate()
+
+    def popitem(self):
+        try:
+            return super(FileMap, self).popitem()
+        finally:
+            self._invalidate()
+
+    def setdefault(self, key, default=None):
+        try:
+            return super(FileMap, self).setdefault(key, default)
+        finally:
+            self._invalidate()
+
+    def update(self, *args, **kwargs):
+        super(FileMap, self).update(*args, **kwargs)
+        self._invalidate()
 
     def minify_command(self):
         if self.kind == 'js':
@@ -61,6 +206,26 @@ class FileMap(dict):
             return 'cat'
     minify_command = property(minify_command)
 
+    def minify_engine(self):
+        return get_engine(self.minify_command)
+    minify_engine = property(minify_engine)
+
+    def minify_source_rules(self):
+        """The [pattern, command] rules choosing a minifier for individual sources.
+        """
+        rules = self.manager.options.get(self.kind, {}).get('minify_sources') or ()
+        if hasattr(rules, 'items'):
+            rules = sorted(rules.items())
+        return [[pattern, command or None] for pattern, command in rules]
+    minify_source_rules = property(minify_source_rules)
+
+    def minifies_by_source(self):
+        """Are the sources of a bundle minified separately, rather than all at once?
+        """
+        options = self.manager.options.get(self.kind, {})
+        return bool(options.get('minify_sources') or options.get('skip_minified'))
+    minifies_by_source = property(minifies_by_source)
+
     def minify(self):
         if self.kind == 'js':
             return self.manager.options['js']['minify']
@@ -88,88 +253,573 @@ class FileMap(dict):
             return 'Constant'
     versioner = property(versioner)
 
-    def combine_files(self):
+    def combine_files(self, jobs=None, file_keys=None, cancel=None):
         """Combine the mapped files, minifying if specified.
+
+        With more than one job, bundles are combined and minified by a
+        pool of threads. Versioning always happens afterwards, in file
+        key order, so the output doesn't depend on scheduling. Failures
+        are collected and raised together as a BuildError.
+
+        If the `incremental` option is set, file keys whose inputs and
+        settings match the build manifest are skipped, and keep the
+        version recorded there.
+
+        @param jobs: the number of bundles to build at once. Defaults to the `jobs` option.
+
+        @param file_keys: the file keys to build. Defaults to all of them.
+
+        @param cancel: a CancelToken. Once it is cancelled, no more
+        bundles are started, running minifiers are killed, outputs in
+        progress are removed, and BuildCancelled is raised.
+        """
+        if jobs is None:
+            jobs = self.manager.options['jobs']
+        if file_keys is None:
+            requested = sorted(self)
+        else:
+            requested = sorted(fk for fk in set(file_keys) if fk in self)
+        build_path = self.manager.options['build_path']
+        self._css_urls = {}
+        self._css_assets = {}
+        manifest = None
+        if self.manager.options['incremental']:
+            manifest = self.manager.get_build_manifest()
+
+        errors = {}
+        fingerprints = {}
+        file_keys = []
+        for file_key in requested:
+            if manifest is None:
+                file_keys.append(file_key)
+                continue
+            try:
+                inputs, settings = self._fingerprint(manifest, file_key)
+            except Exception:
+                errors[file_key] = traceback.format_exc()
+                manifest.pop(file_key, None)
+                continue
+            if manifest.is_current(file_key, inputs, settings, build_path / file_key, self.manager.versions):
+                self._end(self._start('bundle', file_key), cache_hit=True)
+                entry = manifest[file_key]
+                version = entry['version']
+                if version is not None:
+                    self.manager.versions[file_key] = version
+                manifest.record(file_key, inputs, settings, version, entry.get('assets'))
+            else:
+                fingerprints[file_key] = (inputs, settings)
+                file_keys.append(file_key)
+
+        build = lambda file_key: self._build_file_safely(file_key, cancel)
+        if jobs > 1 and len(file_keys) > 1:
+            pool = ThreadPool(min(jobs, len(file_keys)))
+            try:
+                results = pool.map(build, file_keys)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [build(fk) for fk in file_keys]
+        if cancel is not None:
+            cancel.check()
+
+        for file_key, (hasher, failure) in zip(file_keys, results):
+            if failure is None and self.version:
+                try:
+                    self._version_file(file_key, hasher)
+                except Exception:
+                    failure = traceback.format_exc()
+            if failure is not None:
+                errors[file_key] = failure
+                if manifest is not None:
+                    manifest.pop(file_key, None)
+            elif manifest is not None:
+                inputs, settings = fingerprints[file_key]
+                manifest.record(file_key, inputs, settings, self.manager.versions.get(file_key),
+                                self._css_assets.get(file_key))
+
+        if manifest is not None:
+            manifest.save()
+        self.manager.versions.saveStatCache()
+        built = [fk for fk in requested if fk not in errors]
+        if self.version and self.manager.options['fingerprint']['enabled']:
+            try:
+                built.extend(self.manager.fingerprint(built).values())
+            except BuildError, e:
+                errors.update(e.errors)
+        if self.manager.options['gzip']['enabled']:
+            try:
+                self.manager.precompress([fk for fk in built if fk not in errors])
+            except BuildError, e:
+                errors.update(e.errors)
+        self.manager.save_html_manifest()
+        self.manager.save_version_manifest()
+        if errors:
+            raise BuildError(errors)
+
+    def _build_settings(self):
+        """Return the options that affect the built output of this map.
+        """
+        settings = dict(
+            delimiter = self.manager.options['delimiter'],
+            minify = self.minify,
+            minifier = self.minify and self._minifier_id() or None,
+            minify_sources = self.minify and [[pattern, command and self._minifier_id(command)]
+                                              for pattern, command in self.minify_source_rules] or None,
+            skip_minified = self.minify and bool(self.manager.options[self.kind].get('skip_minified')),
+            version = self.version,
+            versioner = self.version and self.versioner or None,
+            )
+        if self.kind == 'css' and self.version:
+            settings['asset_pattern'] = self.manager.options['css']['asset_pattern']
+            settings['base_urls'] = list(self.manager.options['base_urls'])
+            settings['base_url_strategy'] = self.manager.options['base_url_strategy']
+        return settings
+
+    def _fingerprint(self, manifest, file_key):
+        common_path = self.manager.options['common_path']
+        inputs = manifest.fingerprint_inputs(file_key, (common_path / fk for fk in self[file_key]))
+        return inputs, self._build_settings()
+
+    def _build_file_safely(self, file_key, cancel=None):
+        """Build one file, returning a two-tuple of (hasher, formatted traceback).
+        """
+        if cancel is not None and cancel.cancelled():
+            return None, 'The build was cancelled.'
+        event = self._start('bundle', file_key)
+        _build_context.cancel = cancel
+        try:
+            hasher = self._build_file(file_key, event)
+        except Exception, e:
+            self._end(event, error=e)
+            return None, traceback.format_exc()
+        finally:
+            _build_context.cancel = None
+        return hasher, None
+
+    def _check_cancelled(self):
+        cancel = getattr(_build_context, 'cancel', None)
+        if cancel is not None:
+            cancel.check()
+
+    def _start(self, stage, file_key=None):
+        return self.manager.start_stage(stage, file_key, self.kind)
+
+    def _end(self, event, **kwargs):
+        self.manager.end_stage(event, **kwargs)
+
+    def _build_file(self, file_key, event=None):
+        """Build one file, ending the `bundle` stage event if given.
+
+        Returns a hash object already fed the output, if the streaming
+        build could compute one, or None.
         """
         common_path = self.manager.options['common_path']
         build_path = self.manager.options['build_path']
-        for file_key in self:
-            out_path = build_path / file_key
-            if not out_path.parent.exists():
+        out_path = build_path / file_key
+        if not out_path.parent.exists():
+            try:
                 out_path.parent.makedirs()
-            to_combine = self[file_key]
-            combined = self._combine(*(common_path / fk for fk in to_combine))
+            except OSError:
+                if not out_path.parent.isdir():  # Not just a race with another job.
+                    raise
+        filepaths = [common_path / fk for fk in self[file_key]]
+        if self.manager.options['streaming']:
+            hasher = self._stream_file(out_path, filepaths, file_key)
+            self._end(event, bytes=os.path.getsize(out_path))
+            return hasher
+        if self.minify and self.minifies_by_source:
+            combined = self._minify_sources(filepaths, file_key)
+        else:
+            read = self._start('read', file_key)
+            combined = self._combine(*filepaths)
+            self._end(read, bytes=len(combined))
             if self.minify:
-                combined = self._minify_text(combined)
-            fo = open(out_path, 'w')
+                combined = self._minify_text(combined, file_key)
+        self._check_cancelled()
+        write = self._start('write', file_key)
+        tmp_path = out_path + '.tmp'
+        fo = open(tmp_path, 'w')
+        try:
             try:
                 fo.write(combined)
             finally:
                 fo.close()
-            if self.version:
+        except:
+            tmp_path.remove()
+            raise
+        os.rename(tmp_path, out_path)
+        self._end(write, bytes=len(combined))
+        self._end(event, bytes=len(combined))
+        return None
+
+    def _stream_file(self, out_path, filepaths, file_key=None):
+        """Stream the combined, minified files to `out_path` in fixed-size chunks.
+
+        The output is written to a temporary file and moved into place
+        once complete, so a failed build never leaves a truncated file.
+        """
+        hasher = None
+        if self.version:
+            hasher = self.manager.versions.newHasher(self.versioner)
+        tmp_path = out_path + '.tmp'
+        fo = open(tmp_path, 'wb')
+        written = [0]
+        def write(chunk):
+            fo.write(chunk)
+            written[0] += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+        event = self._start('stream', file_key)
+        try:
+            try:
+                cache_key, cache_hit = self._stream_combined(filepaths, write)
+            finally:
+                fo.close()
+            self._check_cancelled()
+        except:
+            tmp_path.remove()
+            raise
+        os.rename(tmp_path, out_path)
+        self._end(event, bytes=written[0], cache_hit=cache_hit)
+        if cache_key is not None:
+            self.manager.get_minify_cache().put_file(cache_key, out_path)
+        return hasher
+
+    def _stream_combined(self, filepaths, write):
+        """Stream the combined, minified files to `write`.
+
+        Returns a two-tuple of the minify cache key the output should
+        be stored under, if it should be cached, and whether the output
+        came from the cache (None if there is no cache).
+        """
+        if not self.minify:
+            for chunk in self._iter_combined(*filepaths):
+                write(chunk)
+            return None, None
+        if self.minifies_by_source:
+            write(self._minify_sources(filepaths))
+            return None, None
+        if self.minify_service_command or self.minify_engine:
+            # The service protocol and in-process engines work on whole bundles.
+            write(self._minify_text(self._combine(*filepaths)))
+            return None, None
+
+        cache = self.manager.get_minify_cache()
+        if cache is not None:
+            key = cache.key_chunks(self._iter_combined(*filepaths), self.minify_command)
+            fi = cache.open(key)
+            if fi is not None:
+                try:
+                    for chunk in iter_chunks(fi, self.manager.options['chunk_size']):
+                        write(chunk)
+                finally:
+                    fi.close()
+                return None, True
+            self._stream_through_minifier(self._iter_combined(*filepaths), write)
+            return key, False
+        self._stream_through_minifier(self._iter_combined(*filepaths), write)
+        return None, None
+
+    def _stream_through_minifier(self, chunks, write):
+        """Feed `chunks` to the minify command, passing its output to `write`.
+        """
+        errors = []
+        def feed(stdin):
+            try:
+                try:
+                    for chunk in chunks:
+                        stdin.write(chunk)
+                except IOError, e:
+                    if e.errno != errno.EPIPE:  # The minifier may exit without reading everything.
+                        errors.append(sys.exc_info())
+                except Exception:
+                    errors.append(sys.exc_info())
+            finally:
+                try:
+                    stdin.close()
+                except IOError:
+                    pass
+
+        self.manager.minify_slots.acquire()
+        try:
+            compressor, cancel = self._popen_minifier(self.minify_command)
+            feeder = threading.Thread(target=feed, args=(compressor.stdin,))
+            feeder.start()
+            try:
+                for chunk in iter_chunks(compressor.stdout, self.manager.options['chunk_size']):
+                    write(chunk)
+            finally:
+                compressor.stdout.close()
+                feeder.join()
+                returncode = compressor.wait()
+                if cancel is not None:
+                    cancel.untrack(compressor)
+        finally:
+            self.manager.minify_slots.release()
+        self._check_minifier_status(self.minify_command, returncode)
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+
+    def _version_file(self, file_key, hasher=None):
+        event = self._start('version', file_key)
+        try:
+            self._version_built_file(file_key, hasher)
+        except Exception, e:
+            self._end(event, error=e)
+            raise
+        self._end(event)
+
+    def _version_built_file(self, file_key, hasher):
+        build_path = self.manager.options['build_path']
+        out_path = build_path / file_key
+        event = self._start('hash', file_key)
+        if hasher is not None:
+            self.manager.versions.mapHasher(file_key, hasher)
+        else:
+            self.manager.versions.mapVersions(self.versioner, build_path, file_key)
+        self._end(event)
+        if self.kind == 'css':
+            event = self._start('css_rewrite', file_key)
+            fi = open(out_path, 'r')
+            try:
+                css = fi.read()
+            finally:
+                fi.close()
+            css = self._version_css_url_includes(file_key, css)
+            tmp_path = out_path + '.tmp'
+            fo = open(tmp_path, 'w')
+            try:
+                try:
+                    fo.write(css)
+                finally:
+                    fo.close()
+            except:
+                tmp_path.remove()
+                raise
+            os.rename(tmp_path, out_path)
+            self._end(event, bytes=len(css))
+            if self.manager.options['fingerprint']['enabled']:
+                # The fingerprint must change when only the referenced assets did.
                 self.manager.versions.mapVersions(self.versioner, build_path, file_key)
-                if self.kind == 'css':
-                    fi = open(out_path, 'r')
-                    try:
-                        css = fi.read()
-                    finally:
-                        fi.close()
-                    fo = open(out_path, 'w')
-                    css = self._version_css_url_includes(build_path, file_key, css)
-                    try:
-                        fo.write(css)
-                    finally:
-                        fo.close()
-                    
-    def _version_css_url_includes(self, common_path, css, file_key):
-        cp = re.compile(self.manager.options['css']['asset_pattern'])
-        base_url_iter = self.manager.base_url_iter
 
-        buffer = StringIO()
-        for line in css.split('\n'):
-            matches = []
-            for match in cp.finditer(line):
-                base_url = base_url_iter.next()
-                grp = match.groupdict()
-                relative_path = grp['filename']
-                url = self._derive_absolute_url_from_relative(self, base_url, file_key, relative_path)
-                url = 'url(%s%s)' % (url, grp.get('fragment', ''))
-                matches.append(grp['url'], url)
+    def _version_css_url_includes(self, file_key, css):
+        """Rewrite the url() references of a stylesheet in a single pass.
 
-            for old, new in matches:
-                line = line.replace(old, new)
+        Relative URLs are resolved against the bundle's directory and
+        pointed at a base URL. Versioned assets get their version added,
+        and the versions used are kept for the build manifest.
+        """
+        pattern = self._css_asset_pattern()
+        bundle_dir = posixpath.dirname(file_key)
+        resolve = self._resolve_css_url
+        finish = self._finish_css_url
+        versions = self.manager.versions
+        used = {}
+        def rewrite(match):
+            url, asset_key = resolve(bundle_dir, match.group('filename'))
+            if asset_key is not None:
+                used[asset_key] = versions.get(asset_key)
+            return 'url(%s%s)' % (finish(url, asset_key), match.group('fragment') or '')
+        css = pattern.sub(rewrite, css)
+        self._css_assets[file_key] = sorted([asset_key, version] for asset_key, version in used.items())
+        return css
 
-            buffer.write(line)
+    def _css_asset_pattern(self):
+        source = self.manager.options['css']['asset_pattern']
+        if self._asset_pattern is None or self._asset_pattern.pattern != source:
+            self._asset_pattern = re.compile(source)
+        return self._asset_pattern
 
-        return buffer.getvalue()
+    def _resolve_css_url(self, bundle_dir, filename):
+        """Return the (url, asset file key) for a url() reference, memoized per (bundle dir, filename).
+        """
+        key = (bundle_dir, filename)
+        try:
+            return self._css_urls[key]
+        except KeyError:
+            return self._css_urls.setdefault(key, self._locate_css_asset(None, bundle_dir, filename))
+
+    def _locate_css_asset(self, base_url, bundle_dir, filename):
+        """Return a two-tuple of (url, asset file key) for a url() reference.
+
+        The file key is None for absolute and external URLs. Without a
+        `base_url`, the manager picks one for the asset.
+        """
+        if filename.startswith('/') or '://' in filename:
+            return filename, None
+        asset_key = posixpath.normpath(posixpath.join(bundle_dir, filename))
+        if base_url is None:
+            base_url = self.manager.base_url_for(asset_key)
+        return '%s/%s' % (base_url, asset_key), asset_key
+
+    def _finish_css_url(self, url, asset_key):
+        if self.manager.options['debug']:
+            return self.manager.timestamp_url(url)
+        version = asset_key is not None and self.manager.versions.get(asset_key)
+        if version:
+            if self.manager.options['fingerprint']['enabled']:
+                return url[:-len(asset_key)] + fingerprinted_key(asset_key, version)
+            return self.manager.version_url(url, version)
+        return url
 
     def _derive_absolute_url_from_relative(self, base_url, file_key, to_rel_filepath):
-        if to_rel_filepath.startswith('/'):  # Absolute path
-            abs_path = to_rel_filepath
+        url, asset_key = self._locate_css_asset(base_url, posixpath.dirname(file_key), to_rel_filepath)
+        return self._finish_css_url(url, asset_key)
+
+    def minify_service_command(self):
+        if self.kind == 'js':
+            return self.manager.options['js']['minify_service_cmd']
+        elif self.kind == 'css':
+            return self.manager.options['css']['minify_service_cmd']
         else:
-            common_path = path('')
-            abs_path = ((common_path / file_key).dirname() / to_rel_filepath).abspath()
-            print common_path
-            print abs_path
-            abs_path = abs_path.parent.relpathto(common_path)
-            print abs_path
-        return path(base_url) / abs_path
-
-    def _minify_text(self, text):
-        compressor = subprocess.Popen(self.minify_command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        compressed = compressor.communicate(text)[0]
+            return None
+    minify_service_command = property(minify_service_command)
+
+    def _source_command(self, source_key, text):
+        """Return the minify command for one source of a bundle, or None to pass it through.
+
+        The first of the `minify_sources` rules whose pattern matches
+        the source's file key decides. Otherwise sources that already
+        look minified pass through if `skip_minified` is set.
+        """
+        for pattern, command in self.minify_source_rules:
+            if fnmatch.fnmatchcase(source_key, pattern):
+                return command
+        if self.manager.options[self.kind].get('skip_minified') and looks_minified(text):
+            return None
+        return self.minify_command
+
+    def _minify_sources(self, filepaths, file_key=None):
+        """Minify the given files each with their own command, and combine them.
+
+        Runs of neighbouring sources that share a command are minified
+        together, so a bundle with no overrides still makes one call.
+        Sources passed through are copied without a delimiter.
+        """
+        common_path = path(self.manager.options['common_path'])
+        delimiter = self.manager.options['delimiter']
+        read = self._start('read', file_key)
+        groups = []
+        size = 0
+        for fp in filepaths:
+            fp = path(fp)
+            text = ''.join(self._iter_combined(fp))[len(delimiter % {'name': fp.name}):]
+            size += len(text)
+            command = self._source_command(common_path.relpathto(fp).replace(os.sep, '/'), text)
+            if command is not None:
+                text = delimiter % {'name': fp.name} + text
+            if groups and groups[-1][0] == command:
+                groups[-1][1].append(text)
+            else:
+                groups.append((command, [text]))
+        self._end(read, bytes=size)
+        output = []
+        for command, texts in groups:
+            if command is None:
+                output.extend(texts)
+            else:
+                output.append(self._minify_text(''.join(texts), file_key, command))
+        return '\n'.join(output)
+
+    def _minify_text(self, text, file_key=None, command=None):
+        """Minify the text, consulting the minify cache if one is configured.
+
+        `command` defaults to the map's minifier.
+        """
+        event = self._start('minify', file_key)
+        cache = self.manager.get_minify_cache()
+        if cache is None:
+            minified = self._run_minifier(text, command)
+            self._end(event, bytes=len(minified))
+            return minified
+        key = cache.key(text, self._minifier_id(command))
+        minified = cache.get(key)
+        cache_hit = minified is not None
+        if not cache_hit:
+            minified = self._run_minifier(text, command)
+            cache.put(key, minified)
+        self._end(event, bytes=len(minified), cache_hit=cache_hit)
+        return minified
+
+    def _minifier_id(self, command=None):
+        """Identify the minifier for the minify cache and the build manifest.
+
+        In-process engines are identified by name and version, so
+        bumping an engine's version invalidates what it built.
+        """
+        if command is None or command == self.minify_command:
+            if self.minify_service_command:
+                return self.minify_service_command
+            command = self.minify_command
+        engine = get_engine(command)
+        if engine is not None:
+            return engine.engine_id
+        return command
+
+    def _run_minifier(self, text, command=None):
+        if command is None or command == self.minify_command:
+            if self.minify_service_command:
+                return self.manager.get_minifier_service(self.minify_service_command).minify(text)
+            command = self.minify_command
+        engine = get_engine(command)
+        if engine is not None:
+            return engine(text)
+        self.manager.minify_slots.acquire()
+        try:
+            compressor, cancel = self._popen_minifier(command)
+            try:
+                compressed = compressor.communicate(text)[0]
+            finally:
+                if cancel is not None:
+                    cancel.untrack(compressor)
+        finally:
+            self.manager.minify_slots.release()
+        self._check_minifier_status(command, compressor.returncode)
         return compressed
 
+    def _check_minifier_status(self, command, returncode):
+        """Raise MinifyError if the minify command failed, so its output is never kept.
+
+        A minifier killed by cancelling the build raises BuildCancelled instead.
+        """
+        self._check_cancelled()
+        if returncode:
+            raise MinifyError('Minifier %r exited with status %s.' % (command, returncode))
+
+    def _popen_minifier(self, command):
+        """Start the minify command, returning the process and the current build's CancelToken.
+        """
+        cancel = getattr(_build_context, 'cancel', None)
+        popen = cancel is not None and cancel.popen or subprocess.Popen
+        process = popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return process, cancel
+
     def _combine(self, *filepaths):
         """Combine the given files into one buffer, using the configured delimiter.
         """
         buffer = StringIO()
+        for chunk in self._iter_combined(*filepaths):
+            buffer.write(chunk)
+        return buffer.getvalue()
+
+    def _iter_combined(self, *filepaths):
+        """Yield the combined contents of the given files in chunks.
+
+        Files are read with universal newlines, like `path.text()`.
+        """
         delimiter = self.manager.options['delimiter']
+        chunk_size = self.manager.options['chunk_size']
         for fp in filepaths:
             fp = path(fp)
-            buffer.write(delimiter % {'name': fp.name})
-            buffer.write(fp.text())
-        return buffer.getvalue()
+            fi = open(fp, 'rU')
+            try:
+                yield delimiter % {'name': fp.name}
+                for chunk in iter_chunks(fi, chunk_size):
+                    yield chunk
+            finally:
+                fi.close()
 
 
 class AssetManager(object):
@@ -179,7 +829,45 @@ class AssetManager(object):
         common_path = path('media'),
         build_path = path('build'),
         base_urls = ['/media'],
+        base_url_strategy = 'cycle',  # Or 'hash', to always serve a file key from the same base URL.
         delimiter = '\n/* BEGIN %(name)s */\n',
+        minify_workers = 1,
+        jobs = 1,
+        minify_jobs = None,  # Concurrent minifier subprocesses; defaults to `jobs`.
+        incremental = False,
+        streaming = False,  # Stream bundles through the minifier in chunks.
+        chunk_size = 64 * 1024,
+        hash_buffer_size = 64 * 1024,
+        version_stat_cache = None,  # Stat cache filename, relative to `build_path`.
+        version_manifest = None,  # Binary version map written after each build, relative to `build_path`.
+        html_manifest = None,  # Pre-rendered <link> and <script> tags written after each build, relative to `build_path`.
+        build_manifest = '.stillness-build.json',  # Relative to `build_path`.
+        gzip = dict(
+            enabled = False,  # Write a .gz sidecar next to each output.
+            level = 9,
+            min_size = 512,  # Outputs smaller than this many bytes aren't worth compressing.
+            min_ratio = 0.9,  # Keep a sidecar only if it is at most this fraction of the output.
+            jobs = None,  # Files to compress at once; defaults to `jobs`.
+            manifest = '.stillness-gzip.json',  # Relative to `build_path`.
+            ),
+        minify_cache = dict(
+            path = None,  # Set to a directory to enable the cache.
+            max_size = 256 * 1024 * 1024,
+            ),
+        fingerprint = dict(
+            enabled = False,  # Also write each versioned output as name.<version>.ext.
+            retain = 3,  # Fingerprinted names kept per file key, the newest included.
+            objects = '.stillness-objects',  # Content store, relative to `build_path`.
+            manifest = '.stillness-fingerprints.json',  # Relative to `build_path`.
+            ),
+        images = dict(
+            optimize = False,  # Losslessly recompress the PNGs found by version_assets into `build_path`.
+            level = 9,
+            keep_chunks = KEEP_CHUNKS,  # Ancillary PNG chunks to keep; the rest are stripped.
+            jobs = None,  # Processes to recompress with; defaults to `jobs`.
+            batch_size = 4,  # Images handed to a process at a time.
+            cache = '.stillness-images',  # Recompressed PNGs by content hash, relative to `build_path`.
+            ),
 
         css = dict(
             map = dict(),
@@ -190,14 +878,12 @@ class AssetManager(object):
 
             asset_pattern = r'(?P<url>url(\([\'"]?(?P<filename>[^)]+\.[a-z]{3,4})(?P<fragment>#\w+)?[\'"]?\)))',
             minify_cmd = 'java -jar %(YUICOMPRESSOR)s --type css' % {'YUICOMPRESSOR': YUICOMPRESSOR},
-            html = '<link rel="%(alt)sstylesheet" type="%(type)s" href="%(href)s" media="%(media)s" %(title)s%(class)s/>\n',
-            html_defaults = {
-                'alt': '',
-                'type': 'text/css',
-                'title': '',
-                'class': '',
-                'media': 'all',
-                },
+            minify_service_cmd = None,  # e.g. minifiers.yui_worker_command('css'), to run YUI in one JVM.
+            minify_sources = None,  # [(pattern, command)] choosing a minifier per source; None passes through.
+            skip_minified = False,  # Pass through sources that already look minified.
+            html = CSS_HTML,
+            html_defaults = CSS_HTML_DEFAULTS,
+            html_variants = [{}],  # get_css_html keyword arguments to pre-render in the `html_manifest`.
             ),
 
         js = dict(
@@ -207,11 +893,12 @@ class AssetManager(object):
 
             map = dict(),
             minify_cmd = 'java -jar %(YUICOMPRESSOR)s --type js' % {'YUICOMPRESSOR': YUICOMPRESSOR},
-            html = '<script type="%(type)s" charset="%(charset)s" src="%(src)s"></script>\n',
-            html_defaults = {
-                'type': 'text/javascript',
-                'charset': 'utf-8',
-                },
+            minify_service_cmd = None,  # e.g. minifiers.yui_worker_command('js'), to run YUI in one JVM.
+            minify_sources = None,  # [(pattern, command)] choosing a minifier per source; None passes through.
+            skip_minified = False,  # Pass through sources that already look minified.
+            html = JS_HTML,
+            html_defaults = JS_HTML_DEFAULTS,
+            html_variants = [{}],  # get_js_html keyword arguments to pre-render in the `html_manifest`.
             ),
 
         assets = dict(
@@ -221,6 +908,9 @@ class AssetManager(object):
             default_options = dict(
                 pattern = r'.+(?!\.[0-9a-z]{8})(\.(png|jpg|gif|swf|ico))',
                 recurse = True,
+                include_dirs = None,  # Only enter directories whose relative path matches.
+                exclude_dirs = None,  # Never enter directories whose relative path matches.
+                jobs = 1,  # Threads walking top-level subdirectories.
                 version = True,
                 versioner = 'SHA1Sum',
                 ),
@@ -230,43 +920,608 @@ class AssetManager(object):
         )
 
     def __init__(self, **kwargs):
-        self.options = copy.deepcopy(self.defaults)
-        merge_dictionary(self.options, kwargs)
-        self.options['common_path'] = path(self.options['common_path'])
-        self.options['css']['map'] = FileMap(self, 'css', self.options['css']['map'])
-        self.options['js']['map'] = FileMap(self, 'js', self.options['js']['map'])
+        options = copy.deepcopy(self.defaults)
+        merge_dictionary(options, kwargs)
+        options['common_path'] = path(options['common_path'])
+        options['css']['map'] = FileMap(self, 'css', options['css']['map'])
+        options['js']['map'] = FileMap(self, 'js', options['js']['map'])
+        self.config = None
+        self._setup(options)
+
+    def from_config(cls, config):
+        """Return a new manager for a compiled Config.
+
+        Nothing is deep-copied, merged or recompiled, so this is cheap
+        enough to do per request. The manager's own options, and those
+        for each kind, are shallow copies that can be changed without
+        affecting the config; the options nested below them are frozen.
+        The file maps are shallow copies of the config's compiled maps.
+        """
+        manager = cls.__new__(cls)
+        options = dict(config.options)
+        for kind in ('css', 'js'):
+            options[kind] = dict(options[kind])
+            options[kind]['map'] = config.file_map(kind).bind(manager)
+        manager.config = config
+        manager._setup(options)
+        return manager
+    from_config = classmethod(from_config)
+
+    def _setup(self, options):
+        self.options = options
+        if self.options['base_url_strategy'] not in BASE_URL_STRATEGIES:
+            raise ValueError('Unknown base URL strategy %r.' % (self.options['base_url_strategy'],))
         self.base_url_iter = itertools.cycle(self.options['base_urls'])
         self.versions = Versions()
+        self.versions.buffer_size = self.options['hash_buffer_size']
+        if self.options['version_stat_cache']:
+            self.versions.stat_cache = StatCache(
+                path(self.options['build_path']) / self.options['version_stat_cache'])
+        self.minifier_services = {}
+        self.listeners = []
+        self._asset_finders = {}
+        self.clear_html_cache()
+        self.build_manifest = None
+        self.html_manifest = None
+        self.image_report = None
+        self.compression_manifest = None
+        self.fingerprint_manifest = None
+        self.minify_cache = None
+        self.minify_slots = threading.BoundedSemaphore(
+            max(1, self.options['minify_jobs'] or self.options['jobs']))
+
+    def add_listener(self, listener):
+        """Register a callable to receive a StageEvent as each build stage starts and ends.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def start_stage(self, stage, file_key=None, kind=None):
+        """Announce the start of a build stage, returning its event.
+
+        Returns None, and costs next to nothing, if nobody is listening.
+        """
+        if not self.listeners:
+            return None
+        event = StageEvent(stage, file_key, kind)
+        self._emit(event)
+        return event
+
+    def end_stage(self, event, bytes=None, cache_hit=None, error=None):
+        """Announce the end of the build stage started with `event`.
+        """
+        if event is None:
+            return
+        self._emit(event.finished(bytes, cache_hit, error))
+
+    def _emit(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+
+    def build_async(self, kinds=('css', 'js'), file_keys=None, jobs=None):
+        """Start building on a background thread, and return its BuildHandle.
+
+        The handle's result is {kind: [file_keys]} of the bundles built.
+        Failures in any kind are raised together as one BuildError, and
+        a cancelled build raises BuildCancelled.
+
+        @param kinds: the kinds of file map to build, in order.
+
+        @param file_keys: {kind: [file_keys]} to build. Defaults to all of them.
+
+        @param jobs: the number of bundles to build at once. Defaults to the `jobs` option.
+        """
+        def build(cancel):
+            built = {}
+            errors = {}
+            for kind in kinds:
+                cancel.check()
+                file_map = self.options[kind]['map']
+                keys = file_keys is None and sorted(file_map) or file_keys.get(kind, [])
+                if not keys:
+                    continue
+                try:
+                    file_map.combine_files(jobs, keys, cancel)
+                except BuildError, e:
+                    errors.update(e.errors)
+                built[kind] = sorted(fk for fk in keys if fk in file_map and fk not in errors)
+            if errors:
+                raise BuildError(errors)
+            return built
+        return BuildHandle(build).start()
+
+    def watch(self, **kwargs):
+        """Watch the mapped source files, rebuilding affected bundles as they change.
+
+        Runs until interrupted; keyword arguments are passed to Watcher.
+        """
+        watcher = Watcher(self, **kwargs)
+        watcher.run()
+
+    def get_build_manifest(self):
+        """Return the build manifest for the configured build path.
+        """
+        filename = path(self.options['build_path']) / self.options['build_manifest']
+        if self.build_manifest is None or self.build_manifest.filename != filename:
+            self.build_manifest = BuildManifest(filename)
+        return self.build_manifest
+
+    def get_compression_manifest(self):
+        """Return the record of precompressed sidecars for the configured build path.
+        """
+        filename = path(self.options['build_path']) / self.options['gzip']['manifest']
+        if self.compression_manifest is None or self.compression_manifest.filename != filename:
+            self.compression_manifest = CompressionManifest(filename)
+        return self.compression_manifest
+
+    def get_fingerprint_manifest(self):
+        """Return the record of fingerprinted names for the configured build path.
+        """
+        filename = path(self.options['build_path']) / self.options['fingerprint']['manifest']
+        if self.fingerprint_manifest is None or self.fingerprint_manifest.filename != filename:
+            self.fingerprint_manifest = FingerprintManifest(filename)
+        return self.fingerprint_manifest
+
+    def fingerprinted(self, file_key):
+        """Return the fingerprinted file key for `file_key`, or `file_key` if it has none.
+        """
+        if self.options['fingerprint']['enabled']:
+            version = self.versions.get(file_key)
+            if version:
+                return fingerprinted_key(file_key, version)
+        return file_key
+
+    def fingerprint(self, file_keys, source_path=None):
+        """Write the given versioned files into the build path under fingerprinted names.
+
+        Identical contents share one stored object through hard links.
+        Each file key keeps its newest `retain` fingerprinted names;
+        older ones, and their gzip sidecars, are removed.
+
+        @param file_keys: the file keys to fingerprint; those without a version are skipped.
+
+        @param source_path: where the files are. Defaults to the build path.
+
+        Returns {file_key: fingerprinted file key}.
+        """
+        options = self.options['fingerprint']
+        build_path = path(self.options['build_path'])
+        if source_path is None:
+            source_path = build_path
+        source_path = path(source_path)
+        manifest = self.get_fingerprint_manifest()
+        store = ObjectStore(build_path / options['objects'], self.versions.hashFile)
+        fingerprinted = {}
+        errors = {}
+        for file_key in file_keys:
+            version = self.versions.get(file_key)
+            if not version:
+                continue
+            target_key = fingerprinted_key(file_key, version)
+            target = build_path / target_key
+            event = self.start_stage('fingerprint', file_key)
+            try:
+                current = manifest.get(file_key, [None])[0] == target_key and target.exists() and \
+                    target.getsize() == (source_path / file_key).getsize()
+                if not current:
+                    store.link(source_path / file_key, target)
+                for expired in manifest.record(file_key, target_key, options['retain']):
+                    for fn in (build_path / expired, build_path / (expired + '.gz')):
+                        if fn.exists():
+                            fn.remove()
+            except Exception, e:
+                self.end_stage(event, error=e)
+                errors[file_key] = traceback.format_exc()
+                continue
+            self.end_stage(event, cache_hit=current)
+            fingerprinted[file_key] = target_key
+        manifest.save()
+        store.prune()
+        if errors:
+            raise BuildError(errors)
+        return fingerprinted
+
+    def version_assets(self):
+        """Version the assets found under each configured asset path.
+
+        With `images.optimize` on, the PNGs found are recompressed into
+        the build path, and the report kept as `image_report`. Assets
+        are fingerprinted into the build path if fingerprinting is on.
+        Run this before building CSS, so that url() references get the
+        assets' versions.
+
+        Returns the file keys of the versioned assets.
+        """
+        common_path = path(self.options['common_path'])
+        optimize = self.options['images']['optimize']
+        file_keys = []
+        image_keys = []
+        for asset_path, options in self._asset_paths():
+            if not (options['version'] or optimize):
+                continue
+            keys = [common_path.relpathto(fp).replace(os.sep, '/') for fp in self._find_assets(asset_path, options)]
+            image_keys.extend(fk for fk in keys if _is_png(fk))
+            if not options['version']:
+                continue
+            event = self.start_stage('version', asset_path)
+            self.versions.mapVersions(options['versioner'], common_path, *keys)
+            self.end_stage(event)
+            file_keys.extend(keys)
+        self.versions.saveStatCache()
+        errors = {}
+        optimized = set()
+        if optimize:
+            try:
+                self.image_report = self.optimize_images(image_keys, common_path)
+            except BuildError, e:
+                errors.update(e.errors)
+            optimized = set(fk for fk in image_keys if fk not in errors)
+        if self.options['fingerprint']['enabled']:
+            try:
+                self.fingerprint([fk for fk in file_keys if fk not in optimized], common_path)
+                self.fingerprint([fk for fk in file_keys if fk in optimized])
+            except BuildError, e:
+                errors.update(e.errors)
+        self.save_html_manifest()
+        self.save_version_manifest()
+        if errors:
+            raise BuildError(errors)
+        return file_keys
+
+    def optimize_images(self, file_keys, source_path=None, jobs=None):
+        """Losslessly recompress the given PNGs into the build path.
+
+        See stillness.images for what is done to each one. The work is
+        spread over a pool of processes, which read and write the images
+        themselves, a few at a time, so only the report is kept in
+        memory. Results are cached by content hash under `images.cache`,
+        so an unchanged image costs a hash and a lookup. Other file keys
+        are ignored.
+
+        Returns a report mapping each directory to the `files`,
+        `bytes_in` and `bytes_out` of its PNGs; `images.format_report`
+        prints one.
+
+        @param source_path: where the files are. Defaults to the common path.
+
+        @param jobs: the number of processes. Defaults to `images.jobs`, then `jobs`.
+        """
+        o = self.options['images']
+        if jobs is None:
+            jobs = o['jobs'] or self.options['jobs']
+        build_path = path(self.options['build_path'])
+        source_path = path(source_path or self.options['common_path'])
+        cache = o['cache'] and MinifyCache(build_path / o['cache'])
+        settings = 'png-%s-%s-%s' % (IMAGES_VERSION, o['level'], ','.join(sorted(o['keep_chunks'])))
+        event = self.start_stage('images')
+
+        report = {}
+        errors = {}
+        def add(file_key, bytes_in, bytes_out):
+            totals = report.setdefault(posixpath.dirname(file_key), dict(files=0, bytes_in=0, bytes_out=0))
+            totals['files'] += 1
+            totals['bytes_in'] += bytes_in
+            totals['bytes_out'] += bytes_out
+
+        keys = {}
+        for file_key in sorted(set(fk for fk in file_keys if _is_png(fk))):
+            data = (source_path / file_key).bytes()
+            key = cache and cache.key(data, settings)
+            optimized = cache and cache.get(key)
+            if not optimized:
+                keys[file_key] = key
+                continue
+            try:
+                write_png(build_path / file_key, optimized)
+            except Exception:
+                errors[file_key] = traceback.format_exc()
+                continue
+            add(file_key, len(data), len(optimized))
+
+        tasks = [(file_key, source_path / file_key, build_path / file_key, o['level'], tuple(o['keep_chunks']))
+                 for file_key in sorted(keys)]
+        pool = None
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            outcomes = pool.imap_unordered(optimize_png_file, tasks, o['batch_size'])
+        else:
+            outcomes = itertools.imap(optimize_png_file, tasks)
+        try:
+            for file_key, bytes_in, bytes_out, failure in outcomes:
+                if failure is None and cache:
+                    try:
+                        cache.put_file(keys[file_key], build_path / file_key)
+                    except Exception:
+                        failure = traceback.format_exc()
+                if failure is not None:
+                    errors[file_key] = failure
+                    continue
+                add(file_key, bytes_in, bytes_out)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.end_stage(event, bytes=sum(totals['bytes_out'] for totals in report.values()),
+                       cache_hit=not tasks)
+        if errors:
+            raise BuildError(errors)
+        return report
+
+    def save_version_manifest(self):
+        """Write the versions to the binary `version_manifest`, if one is configured.
+        """
+        if self.options['version_manifest'] and isinstance(self.versions, Versions):
+            filename = path(self.options['build_path']) / self.options['version_manifest']
+            if not filename.parent.exists():
+                filename.parent.makedirs()
+            self.versions.writeBinary(filename)
+
+    def load_version_manifest(self, filename=None):
+        """Serve versions straight from a binary version map, instead of building them.
+
+        Meant for web processes: the map is memory-mapped, not loaded,
+        so it opens instantly and its pages are shared between
+        processes. Call `versions.refresh()` to pick up a newer build.
+
+        @param filename: defaults to the `version_manifest` under the build path.
+        """
+        if filename is None:
+            filename = path(self.options['build_path']) / self.options['version_manifest']
+        self.versions = MappedVersions(filename)
+        return self.versions
+
+    def _html_settings(self):
+        css = self.options['css']
+        js = self.options['js']
+        return html_settings(self.options['base_urls'], self.options['base_url_strategy'],
+                             self.options['fingerprint']['enabled'],
+                             css['html'], css['html_defaults'], js['html'], js['html_defaults'])
+
+    def save_html_manifest(self):
+        """Write the production HTML for every bundle to the `html_manifest`, if one is configured.
+
+        Each file key is rendered with each of its kind's `html_variants`,
+        once for every base URL it can be served from: all of them with
+        the 'cycle' base URL strategy, or its own with 'hash'.
+        """
+        if not self.options['html_manifest'] or not isinstance(self.versions, Versions):
+            return
+        event = self.start_stage('html')
+        hashed = self.options['base_url_strategy'] == 'hash'
+        fragments = []
+        for kind, make_key, render in (('css', css_html_key, self._render_css_html),
+                                       ('js', js_html_key, self._render_js_html)):
+            for file_key in sorted(self.options[kind]['map'].keys()):
+                if hashed:
+                    base_urls = [shard_base_url(self.options['base_urls'], file_key)]
+                else:
+                    base_urls = self.options['base_urls']
+                for variant in self.options[kind]['html_variants']:
+                    key = make_key(file_key, **variant)
+                    html = {}
+                    for base_url in base_urls:
+                        url = '%s/%s' % (base_url, self.fingerprinted(file_key))
+                        html[base_url] = render([url], *key[2:])
+                    fragments.append(list(key) + [html])
+        write_json(path(self.options['build_path']) / self.options['html_manifest'],
+                   dict(settings=self._html_settings(), fragments=fragments))
+        self.end_stage(event)
+
+    def load_html_manifest(self, filename=None):
+        """Look production HTML up in the `html_manifest`, instead of rendering it.
+
+        The manifest is only used if it was rendered with this manager's
+        base URLs, fingerprint setting and templates, and is read again
+        whenever the versions change. Tags it lacks are rendered as usual.
+
+        @param filename: defaults to the `html_manifest` under the build path.
+        """
+        if filename is None:
+            filename = path(self.options['build_path']) / self.options['html_manifest']
+        self.html_manifest = HTMLManifest(filename, self.versions, self._html_settings())
+        return self.html_manifest
+
+    def precompress(self, file_keys, jobs=None):
+        """Write maximally compressed gzip sidecars next to the given build outputs.
+
+        No sidecar is kept for outputs smaller than `gzip.min_size`, or
+        that don't shrink to `gzip.min_ratio` of their size. Outputs
+        unchanged since the last run keep their previous sidecar. Each
+        sidecar kept is recorded in the versions as `file_key + '.gz'`,
+        with the version of its output.
+
+        Returns the file keys whose sidecars were written.
+
+        @param jobs: the number of files to compress at once. Defaults to `gzip.jobs`, then `jobs`.
+        """
+        if jobs is None:
+            jobs = self.options['gzip']['jobs'] or self.options['jobs']
+        file_keys = sorted(set(file_keys))
+        manifest = self.get_compression_manifest()
+        work = lambda fk: self._precompress_file_safely(manifest, fk)
+        if jobs > 1 and len(file_keys) > 1:
+            pool = ThreadPool(min(jobs, len(file_keys)))
+            try:
+                results = pool.map(work, file_keys)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [work(fk) for fk in file_keys]
+
+        errors = {}
+        written = []
+        for file_key, (result, failure) in zip(file_keys, results):
+            if failure is not None:
+                errors[file_key] = failure
+                manifest.pop(file_key, None)
+                continue
+            digest, compressed, wrote = result
+            manifest.record(file_key, digest, compressed)
+            if wrote:
+                written.append(file_key)
+            if compressed and file_key in self.versions:
+                self.versions[file_key + '.gz'] = self.versions[file_key]
+            else:
+                self.versions.pop(file_key + '.gz', None)
+        manifest.save()
+        if errors:
+            raise BuildError(errors)
+        return written
+
+    def _precompress_file_safely(self, manifest, file_key):
+        try:
+            return self._precompress_file(manifest, file_key), None
+        except Exception:
+            return None, traceback.format_exc()
+
+    def _precompress_file(self, manifest, file_key):
+        """Compress one output, if it's worth it and has changed.
+
+        Returns a three-tuple of (sha1 of the output, whether a sidecar
+        is kept, whether the sidecar was written).
+        """
+        o = self.options['gzip']
+        out_path = path(self.options['build_path']) / file_key
+        sidecar = out_path + '.gz'
+        event = self.start_stage('gzip', file_key)
+        digest = self.versions.hashFile(hashlib.sha1(), out_path).hexdigest()
+        if manifest.is_current(file_key, digest, sidecar):
+            self.end_stage(event, cache_hit=True)
+            return digest, manifest[file_key][1], False
+        size = os.path.getsize(out_path)
+        compressed = False
+        if size >= o['min_size']:
+            compressed_size = gzip_file(out_path, sidecar, o['level'])
+            compressed = compressed_size <= size * o['min_ratio']
+        if not compressed and sidecar.exists():
+            sidecar.remove()
+        self.end_stage(event, bytes=compressed and compressed_size or 0, cache_hit=False)
+        return digest, compressed, compressed
+
+    def get_minify_cache(self):
+        """Return the configured minify cache, or None if it is disabled.
+        """
+        cache_options = self.options['minify_cache']
+        if not cache_options['path']:
+            return None
+        cache_path = path(cache_options['path'])
+        if self.minify_cache is None or self.minify_cache.directory != cache_path:
+            self.minify_cache = MinifyCache(cache_path, cache_options['max_size'])
+        return self.minify_cache
+
+    def prune_minify_cache(self, max_size=None):
+        """Evict least recently used minify cache entries down to `max_size` bytes.
+        """
+        cache = self.get_minify_cache()
+        if cache is None:
+            return 0
+        return cache.prune(max_size)
+
+    def get_minifier_service(self, command):
+        """Return the resident minifier service for the given command.
+
+        Services are shared by every FileMap of this manager, and live
+        until `shutdown_minifiers` is called.
+        """
+        try:
+            return self.minifier_services[command]
+        except KeyError:
+            service = MinifierService(command, workers=self.options['minify_workers'])
+            return self.minifier_services.setdefault(command, service)
+
+    def shutdown_minifiers(self):
+        """Stop all resident minifier processes.
+        """
+        while self.minifier_services:
+            command, service = self.minifier_services.popitem()
+            service.shutdown()
 
     def find_assets(self):
         """Find assets matching the configured patterns.
 
-        Yields two-tuples of (configured_asset_path, absolute_path_to_asset)
+        Yields the path of each asset, under the common path. Each
+        configured asset path may set `include_dirs` or `exclude_dirs`
+        patterns to prune directories, and `jobs` to walk its top-level
+        subdirectories in parallel.
         """
-        common_path = path(self.options['common_path'])
-        for asset_path, options in self.options['assets']['paths']:
-            o = copy.deepcopy(self.options['assets']['default_options'])
+        for asset_path, options in self._asset_paths():
+            for f in self._find_assets(asset_path, options):
+                yield f
+
+    def _asset_paths(self):
+        """Return (asset path, options) pairs, with the default options filled in.
+        """
+        asset_paths = self.options['assets']['paths']
+        if isinstance(asset_paths, dict):
+            asset_paths = sorted(asset_paths.items())
+        pairs = []
+        for asset_path, options in asset_paths:
+            o = thaw(self.options['assets']['default_options'])
             merge_dictionary(o, options)
-            if o['recurse']:
-                for f in (common_path /asset_path).walkfilesRE(o['pattern']):
-                    yield f
-            else:
-                for f in (common_path / asset_path).listdirRE(o['pattern']):
-                    yield (asset_path, f)
+            pairs.append((asset_path, o))
+        return pairs
+
+    def _find_assets(self, asset_path, options):
+        finder = self._get_asset_finder(options)
+        event = self.start_stage('discovery', asset_path)
+        found = finder.find(path(self.options['common_path']) / asset_path, jobs=options['jobs'])
+        self.end_stage(event)
+        return found
+
+    def _get_asset_finder(self, options):
+        """Return the AssetFinder for a set of asset path options, compiling it only once.
+        """
+        key = (options['pattern'], options['recurse'], options['include_dirs'], options['exclude_dirs'])
+        try:
+            return self._asset_finders[key]
+        except KeyError:
+            finder = AssetFinder(*key)
+            return self._asset_finders.setdefault(key, finder)
 
     def timestamp_url(self, url):
         return '%s?time=%s' % (url, time.time())
 
-    def get_asset_url(self, file_key):
+    def version_url(self, url, version):
+        return '%s?v=%s' % (url, version)
+
+    def base_url_for(self, file_key):
+        """Return the base URL to serve the given file key from.
+
+        With the 'hash' base URL strategy this is always the same base
+        URL for the same file key; with 'cycle', each call returns the
+        next one.
+        """
+        if self.options['base_url_strategy'] == 'hash':
+            return shard_base_url(self.options['base_urls'], file_key)
+        return self.base_url_iter.next()
+
+    def get_asset_url(self, file_key, base_url=None):
         """Return the URL for the given asset file key.
 
         If more than one base URL is specified, each call to this
-        method will use the next base url.
+        method will use the next base url, unless one is given or the
+        base URL strategy is 'hash'. Hashed URLs are built once per
+        file key outside of debug mode.
         """
         if file_key.startswith('http'):
             url = file_key
+        elif (base_url is None and not self.options['debug']
+              and self.options['base_url_strategy'] == 'hash'):
+            fragments = self._get_html_fragments()
+            try:
+                return fragments[('url', file_key)]
+            except KeyError:
+                url = self.get_asset_url(file_key, shard_base_url(self.options['base_urls'], file_key))
+                return fragments.setdefault(('url', file_key), url)
         else:
-            base_url = self.base_url_iter.next()
+            if base_url is None:
+                base_url = self.base_url_for(file_key)
+            if not self.options['debug']:
+                file_key = self.fingerprinted(file_key)
             url = "%(base_url)s/%(file_key)s" % locals()
 
         if self.options['debug']:
@@ -278,7 +1533,8 @@ class AssetManager(object):
         """Return the URLs for the given CSS asset file key.
 
         If more than one base URL is specified in options, each call
-        to this method will use the next base url.
+        to this method will use the next base url, unless the base
+        URL strategy is 'hash'.
         """
         if self.options['debug']:
             return [self.get_asset_url(css) for css in self.options['css']['map'][file_key]]
@@ -290,35 +1546,42 @@ class AssetManager(object):
         """Return the <link> HTML for the given CSS asset file key.
 
         If more than one base URL is specified in options, each call
-        to this method will use the next base url.
-        """
-        urls = self.get_css_urls(file_key)
-        template = self.options['css']['html']
-        context = dict(self.options['css']['html_defaults'])
-        if alt:
-            context['alt'] = alt
-        if link_type:
-            context['type'] = link_type
-        if title:
-            context['title'] = 'title="%s" ' % title
-        if link_class:
-            context['class'] = 'class="%s" ' % link_class
-        if media:
-            context['media'] = media
+        to this method will use the next base url, unless the base
+        URL strategy is 'hash'.
 
-        buffer = StringIO()
-        for url in urls:
-            context['href'] = url
-            buffer.write(template % context)
-            buffer.write(delimiter)
+        Outside of debug mode, the HTML comes from the loaded HTML
+        manifest if it's there; otherwise it is rendered once per set
+        of arguments and base URL, and cached.
+        """
+        if self.options['debug']:
+            return self._render_css_html(self.get_css_urls(file_key), alt, link_type,
+                                         title, link_class, media, delimiter)
+        base_url = self.base_url_for(file_key)
+        key = css_html_key(file_key, alt, link_type, title, link_class, media, delimiter)
+        if self.html_manifest is not None:
+            html = self.html_manifest.get(key, base_url)
+            if html is not None:
+                return html
+        key += (base_url,)
+        fragments = self._get_html_fragments()
+        try:
+            return fragments[key]
+        except KeyError:
+            self.options['css']['map'][file_key]  # Make sure it's defined.
+            urls = [self.get_asset_url(file_key, base_url)]
+            html = self._render_css_html(urls, alt, link_type, title, link_class, media, delimiter)
+            return fragments.setdefault(key, html)
 
-        return buffer.getvalue()
+    def _render_css_html(self, urls, alt, link_type, title, link_class, media, delimiter):
+        return render_css_html(self.options['css']['html'], self.options['css']['html_defaults'], urls,
+                               alt, link_type, title, link_class, media, delimiter)
 
     def get_js_urls(self, file_key):
         """Return the URLs for the given JS asset file key.
 
         If more than one base URL is specified in options, each call
-        to this method will use the next base url.
+        to this method will use the next base url, unless the base
+        URL strategy is 'hash'.
         """
         if self.options['debug']:
             return [self.get_asset_url(css) for css in self.options['js']['map'][file_key]]
@@ -330,23 +1593,128 @@ class AssetManager(object):
         """Return the <script> HTML for the given JS asset file key.
 
         If more than one base URL is specified in options, each call
-        to this method will use the next base url.
+        to this method will use the next base url, unless the base
+        URL strategy is 'hash'.
+
+        Outside of debug mode, the HTML comes from the loaded HTML
+        manifest if it's there; otherwise it is rendered once per set
+        of arguments and base URL, and cached.
         """
-        urls = self.get_css_urls(file_key)
-        template = self.options['js']['html']
-        context = dict(self.options['js']['html_defaults'])
-        if script_type:
-            context['type'] = script_type
-        if charset:
-            context['charset'] = charset
+        if self.options['debug']:
+            return self._render_js_html(self.get_js_urls(file_key), script_type, charset, delimiter)
+        base_url = self.base_url_for(file_key)
+        key = js_html_key(file_key, script_type, charset, delimiter)
+        if self.html_manifest is not None:
+            html = self.html_manifest.get(key, base_url)
+            if html is not None:
+                return html
+        key += (base_url,)
+        fragments = self._get_html_fragments()
+        try:
+            return fragments[key]
+        except KeyError:
+            self.options['js']['map'][file_key]  # Make sure it's defined.
+            urls = [self.get_asset_url(file_key, base_url)]
+            html = self._render_js_html(urls, script_type, charset, delimiter)
+            return fragments.setdefault(key, html)
 
-        buffer = StringIO()
-        for url in urls:
-            context['src'] = url
-            buffer.write(template % context)
-            buffer.write(delimiter)
+    def _render_js_html(self, urls, script_type, charset, delimiter):
+        return render_js_html(self.options['js']['html'], self.options['js']['html_defaults'], urls,
+                              script_type, charset, delimiter)
 
-        return buffer.getvalue()
+    def _get_html_fragments(self):
+        """Return the cache of rendered HTML fragments.
+
+        The cache is emptied whenever the versions, the file maps, the
+        fingerprint setting, the base URLs and their strategy, or the
+        HTML templates and their defaults have changed.
+        """
+        css = self.options['css']
+        js = self.options['js']
+        stamp = (self.versions.generation, css['map'].generation, js['map'].generation,
+                 self.options['fingerprint']['enabled'], self.options['base_url_strategy'],
+                 tuple(self.options['base_urls']),
+                 css['html'], js['html'], css['html_defaults'], js['html_defaults'])
+        if stamp != self._html_stamp:
+            self._html_stamp = stamp[:8] + (dict(css['html_defaults']), dict(js['html_defaults']))
+            self._html_fragments = {}
+        return self._html_fragments
+
+    def clear_html_cache(self):
+        """Forget all rendered HTML fragments.
+        """
+        self._html_stamp = None
+        self._html_fragments = {}
+
+
+class Config(object):
+    """Compiled AssetManager options: immutable, hashable, and safe to share between threads.
+
+    Takes the same keyword arguments as AssetManager. Build one at
+    startup, then make managers from it as they're needed::
+
+        config = Config(debug=False, js=dict(map={'js/all.js': ['js/a.js']}))
+        assets = config.manager()
+
+    The options are merged over the defaults and frozen, and the file
+    maps compiled, once. To change options, `replace` returns a new
+    Config and leaves this one, and its managers, alone.
+    """
+    def __init__(self, **kwargs):
+        options = copy.deepcopy(AssetManager.defaults)
+        merge_dictionary(options, kwargs)
+        options['common_path'] = path(options['common_path'])
+        self.options = freeze(options)
+        self._maps = {}
+        for kind in ('css', 'js'):
+            # Mapped lists stay lists, so bound maps compare and serialize like the ones passed in.
+            file_map = FileMap(None, kind, ((k, list(v)) for k, v in self.options[kind]['map'].iteritems()))
+            file_map.include_order()  # Compile now, so include cycles are found here.
+            self._maps[kind] = file_map
+
+    def load(cls, filename, **kwargs):
+        """Return a Config of the options in a JSON or YAML file, with `kwargs` merged over them.
+        """
+        return cls(**merge_dictionary(read_options(filename), kwargs))
+    load = classmethod(load)
+
+    def replace(self, **kwargs):
+        """Return a new Config with `kwargs` merged over these options.
+        """
+        return type(self)(**merge_dictionary(thaw(self.options), kwargs))
+
+    def file_map(self, kind):
+        """Return the compiled FileMap for `kind`. It is shared, so bind it rather than changing it.
+        """
+        return self._maps[kind]
+
+    def manager(self):
+        """Return a new AssetManager using these options.
+        """
+        return AssetManager.from_config(self)
+
+    def __eq__(self, other):
+        return isinstance(other, Config) and self.options == other.options
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.options)
+
+
+def _is_png(file_key):
+    return file_key.lower().endswith('.png')
+
+
+def iter_chunks(fi, chunk_size):
+    """Yield the contents of the open file `fi` in chunks of up to `chunk_size` bytes.
+    """
+    while True:
+        chunk = fi.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
 
 
 def merge_dictionary(dst, src):
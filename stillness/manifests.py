@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""stillness.manifests -- Build manifests for incremental builds and precompression.
+"""
+import os
+import hashlib
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from path import path
+
+__all__ = ['JSONManifest', 'BuildManifest', 'CompressionManifest', 'FingerprintManifest', 'write_json']
+
+
+def write_json(filename, data):
+    """Write `data` to `filename` as JSON, replacing it all at once.
+    """
+    filename = path(filename)
+    if not filename.parent.exists():
+        filename.parent.makedirs()
+    tmp_filename = filename + '.tmp'
+    fo = open(tmp_filename, 'w')
+    try:
+        json.dump(data, fo, sort_keys=True)
+    finally:
+        fo.close()
+    os.rename(tmp_filename, filename)
+
+
+class JSONManifest(dict):
+    """A dictionary persisted as a JSON file.
+
+    A missing or corrupt file just starts an empty manifest.
+    """
+    def __init__(self, filename):
+        super(JSONManifest, self).__init__()
+        self.filename = path(filename)
+        if json is not None and self.filename.exists():
+            fi = open(self.filename, 'r')
+            try:
+                try:
+                    self.update(json.load(fi))
+                except ValueError:
+                    pass
+            finally:
+                fi.close()
+
+    def save(self):
+        """Write the manifest back to disk.
+        """
+        if json is None:
+            return
+        write_json(self.filename, dict(self))
+
+
+class BuildManifest(JSONManifest):
+    """A record of how each file key was last built.
+
+    Each entry maps a file key to a dictionary of:
+
+      - `inputs`: a list of [filename, size, mtime, sha1] for each source file, in order.
+      - `settings`: the options that affect the built output.
+      - `version`: the version recorded for the output, if any.
+      - `assets`: a list of [file key, version] for each asset that a
+        stylesheet's url() references were rewritten with.
+    """
+    def fingerprint_inputs(self, file_key, filepaths):
+        """Return the [filename, size, mtime, sha1] list for the given source files.
+
+        Files whose size and mtime match the previous build of
+        `file_key` reuse the recorded hash instead of being read again.
+        """
+        previous = {}
+        for name, size, mtime, digest in self.get(file_key, {}).get('inputs', ()):
+            previous[name] = (size, mtime, digest)
+        inputs = []
+        for fp in filepaths:
+            fp = path(fp)
+            st = os.stat(fp)
+            name = unicode(fp)
+            old = previous.get(name)
+            if old is not None and old[:2] == (st.st_size, st.st_mtime):
+                digest = old[2]
+            else:
+                digest = hashlib.sha1(fp.bytes()).hexdigest()
+            inputs.append([name, st.st_size, st.st_mtime, digest])
+        return inputs
+
+    def is_current(self, file_key, inputs, settings, out_path, versions=None):
+        """Is the built output of `file_key` current for these inputs and settings?
+
+        Matching hashes count as unchanged even if the mtimes moved.
+
+        @param versions: the current asset versions. If given, the
+        output is also out of date when an asset it references now has
+        a different version from the one it was built with.
+        """
+        entry = self.get(file_key)
+        if entry is None or not path(out_path).exists():
+            return False
+        if entry.get('settings') != settings:
+            return False
+        old_inputs = entry.get('inputs', [])
+        if len(old_inputs) != len(inputs):
+            return False
+        for old, new in zip(old_inputs, inputs):
+            if old[0] != new[0] or old[3] != new[3]:
+                return False
+        if versions is not None:
+            for asset_key, version in entry.get('assets') or ():
+                if versions.get(asset_key) != version:
+                    return False
+        return True
+
+    def record(self, file_key, inputs, settings, version=None, assets=None):
+        self[file_key] = dict(inputs=inputs, settings=settings, version=version, assets=assets)
+
+
+class CompressionManifest(JSONManifest):
+    """A record of the precompressed sidecars made for each output.
+
+    Each entry maps an output's file key to [sha1, compressed], where
+    `compressed` says whether a sidecar was kept for that content.
+    """
+    def is_current(self, file_key, digest, sidecar):
+        """Is the recorded decision for `file_key` still good for this content?
+        """
+        entry = self.get(file_key)
+        if entry is None or entry[0] != digest:
+            return False
+        return not entry[1] or path(sidecar).exists()
+
+    def record(self, file_key, digest, compressed):
+        self[file_key] = [digest, compressed]
+
+
+class FingerprintManifest(JSONManifest):
+    """The fingerprinted names kept for each file key, newest first.
+    """
+    def record(self, file_key, fingerprinted, retain):
+        """Record `fingerprinted` as the newest name of `file_key`.
+
+        Returns the names that no longer fit in the `retain` kept.
+        """
+        retain = max(retain, 1)
+        names = [fingerprinted] + [n for n in self.get(file_key, []) if n != fingerprinted]
+        self[file_key] = names[:retain]
+        return names[retain:]
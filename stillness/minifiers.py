@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""stillness.minifiers -- Resident minifier processes for Stillness.
+
+Launching a fresh compressor (and, for YUI, a fresh JVM) for every
+bundle is the slowest part of a build. A minifier service keeps one or
+more compressor processes alive for the length of a build and feeds
+them bundles over their stdin/stdout pipes.
+
+Bundles are framed as netstrings (``<length>:<bytes>,``). Each request
+frame carries the text to minify; each response frame starts with a
+one-byte status -- ``K`` for success, followed by the minified text, or
+``E`` for failure, followed by an error message.
+
+YUI Compressor has no server mode of its own, so Stillness ships
+YUIWorker.java, a small main that keeps one JVM running and calls YUI's
+compressors for each frame. `yui_worker_command` returns the
+`minify_service_cmd` that runs it.
+
+Running a filter command under the reference worker::
+
+    python -m stillness.minifiers 'tr a-z A-Z'
+
+makes it speak the protocol, but still starts the command once per
+bundle. It is useful for testing a service setup, and gives no speedup
+over a plain `minify_cmd`; in particular, wrapping
+``java -jar yuicompressor.jar`` this way still starts a JVM per bundle.
+
+Minifiers written in Python run in-process instead. They are selected
+by giving an engine name, ``stillness:css`` or ``stillness:js``, as the
+`minify_cmd`.
+"""
+import os
+import sys
+import subprocess
+import Queue
+import re
+
+import cssmin
+import jsmin
+
+__all__ = ['MinifyError', 'MinifierWorker', 'MinifierService', 'serve', 'yui_worker_command',
+           'ENGINES', 'register_engine', 'get_engine', 'looks_minified']
+
+ENGINES = {}
+
+YUICOMPRESSOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yuicompressor-2.4.2.jar')
+YUI_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'YUIWorker.java')
+
+_leading_comments_re = re.compile(r'^(?:\s*(?:/\*.*?\*/|//[^\n]*))*\s*', re.DOTALL)
+
+
+class MinifyError(RuntimeError):
+    """Raised when a minifier fails to process a bundle.
+    """
+
+
+class WorkerDied(MinifyError):
+    """Raised when a resident minifier exits mid-conversation.
+    """
+
+
+def write_netstring(stream, data):
+    """Write `data` to `stream` as a netstring, and flush.
+    """
+    stream.write('%d:' % len(data))
+    stream.write(data)
+    stream.write(',')
+    stream.flush()
+
+
+def read_netstring(stream):
+    """Read one netstring from `stream`.
+
+    Returns None if the stream is at EOF before a frame starts.
+    """
+    digits = []
+    while True:
+        c = stream.read(1)
+        if not c:
+            if digits:
+                raise WorkerDied('Stream closed inside a frame header.')
+            return None
+        if c == ':':
+            break
+        if not c.isdigit():
+            raise MinifyError('Malformed frame header: %r' % ''.join(digits + [c]))
+        digits.append(c)
+    length = int(''.join(digits))
+    data = stream.read(length)
+    if len(data) != length or stream.read(1) != ',':
+        raise WorkerDied('Stream closed inside a frame.')
+    return data
+
+
+class MinifierWorker(object):
+    """A single resident minifier process.
+    """
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+    alive = property(alive)
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, shell=True, close_fds=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def stop(self):
+        """Ask the worker to exit by closing its stdin, then reap it.
+        """
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        process.stdout.close()
+        if process.poll() is None:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        process.wait()
+
+    def minify(self, text):
+        if not self.alive:
+            self.stop()
+            self.start()
+        try:
+            write_netstring(self.process.stdin, text)
+            response = read_netstring(self.process.stdout)
+        except IOError, e:
+            raise WorkerDied('Minifier %r died: %s' % (self.command, e))
+        if response is None:
+            raise WorkerDied('Minifier %r exited unexpectedly.' % self.command)
+        status, payload = response[:1], response[1:]
+        if status == 'K':
+            return payload
+        elif status == 'E':
+            raise MinifyError(payload)
+        else:
+            raise MinifyError('Unknown response status %r from %r' % (status, self.command))
+
+
+class MinifierService(object):
+    """A pool of resident minifier processes sharing one command.
+
+    Workers are started lazily, reused between bundles, and restarted if
+    they crash. The service is safe to share between threads.
+    """
+    def __init__(self, command, workers=1, retries=1):
+        self.command = command
+        self.retries = retries
+        self._all = [MinifierWorker(command) for _ in range(max(1, workers))]
+        self._idle = Queue.Queue()
+        for worker in self._all:
+            self._idle.put(worker)
+
+    def minify(self, text):
+        worker = self._idle.get()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return worker.minify(text)
+                except WorkerDied:
+                    worker.stop()
+                    if attempt >= self.retries:
+                        raise
+                    attempt += 1
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for worker in self._all:
+            worker.stop()
+
+
+def register_engine(name, minify_func, version):
+    """Register an in-process minifier under the engine name `name`.
+
+    `version` is part of the minify cache key, so bump it whenever the
+    engine's output changes.
+    """
+    minify_func.engine_id = '%s@%s' % (name, version)
+    ENGINES[name] = minify_func
+
+
+def get_engine(command):
+    """Return the in-process minifier named by `command`, or None for shell commands.
+    """
+    if not command:
+        return None
+    return ENGINES.get(command.strip())
+
+
+register_engine('stillness:css', cssmin.minify_css, cssmin.VERSION)
+register_engine('stillness:js', jsmin.minify_js, jsmin.VERSION)
+
+
+def looks_minified(text, min_size=512, max_whitespace=0.06, min_line_length=150):
+    """Guess whether `text` has already been through a minifier.
+
+    Minified sources have long lines and little whitespace; hand
+    written ones rarely have either. Leading license comments are
+    ignored, and sources under `min_size` bytes are never counted as
+    minified, since there is little to lose by minifying them again.
+    """
+    text = _leading_comments_re.sub('', text)
+    size = len(text)
+    if size < min_size:
+        return False
+    lines = text.count('\n') + 1
+    whitespace = text.count(' ') + text.count('\t') + text.count('\n')
+    return size // lines >= min_line_length and whitespace <= max_whitespace * size
+
+
+def serve(minify_func, stdin=None, stdout=None):
+    """Answer minification frames from `stdin` until EOF.
+
+    `minify_func` takes the bundle text and returns the minified text.
+    Exceptions are reported back to the client as error frames.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    while True:
+        request = read_netstring(stdin)
+        if request is None:
+            break
+        try:
+            response = 'K' + minify_func(request)
+        except Exception, e:
+            response = 'E' + str(e)
+        write_netstring(stdout, response)
+
+
+def yui_worker_command(kind, jar=YUICOMPRESSOR, charset=None, java='java'):
+    """Return a `minify_service_cmd` running YUI Compressor resident in one JVM.
+
+    The worker runs from source, which needs a JDK 11 or later; see
+    YUIWorker.java for compiling it for older ones.
+
+    @param kind: 'css' or 'js'.
+
+    @param charset: the encoding of the bundles; YUIWorker assumes UTF-8.
+    """
+    if kind not in ('css', 'js'):
+        raise ValueError('Unknown YUI Compressor type %r.' % kind)
+    command = '%s -cp %s %s %s' % (java, jar, YUI_WORKER, kind)
+    if charset:
+        command += ' ' + charset
+    return command
+
+
+def filter_command(command):
+    """Return a minify function that pipes text through a filter command.
+
+    The command is started afresh for every bundle.
+    """
+    def minify(text):
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate(text)
+        if process.returncode:
+            raise MinifyError('%r exited with %s: %s' % (command, process.returncode, err.strip()))
+        return out
+    return minify
+
+
+if __name__ == '__main__':
+    command = ' '.join(sys.argv[1:]) or 'cat'
+    serve(get_engine(command) or filter_command(command))
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""stillness.runtime -- Asset URLs and HTML for web processes.
+
+An AssetResolver answers the same questions as a non-debug
+AssetManager -- asset URLs and the <link> and <script> HTML for
+bundles -- from a version map written at build time. It imports
+nothing from the build machinery, so web workers start quickly::
+
+    from stillness import runtime
+    assets = runtime.load('build/versions.bin', base_urls=['//cdn.example.com/media'], fingerprint=True)
+    assets.get_css_html('css/main.min.css')
+
+Given the HTML manifest from the same build, tags are looked up
+rather than rendered.
+"""
+import zlib
+import itertools
+import posixpath
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from versionmaps import MappedVersions
+
+__all__ = ['AssetResolver', 'HTMLManifest', 'load', 'fingerprinted_key', 'shard_base_url',
+           'render_css_html', 'render_js_html', 'css_html_key', 'js_html_key', 'html_settings']
+
+BASE_URL_STRATEGIES = ('cycle', 'hash')
+
+CSS_HTML = '<link rel="%(alt)sstylesheet" type="%(type)s" href="%(href)s" media="%(media)s" %(title)s%(class)s/>\n'
+CSS_HTML_DEFAULTS = {
+    'alt': '',
+    'type': 'text/css',
+    'title': '',
+    'class': '',
+    'media': 'all',
+    }
+JS_HTML = '<script type="%(type)s" charset="%(charset)s" src="%(src)s"></script>\n'
+JS_HTML_DEFAULTS = {
+    'type': 'text/javascript',
+    'charset': 'utf-8',
+    }
+
+
+def fingerprinted_key(file_key, version):
+    """Return `file_key` with `version` inserted before its extension.
+
+    >>> fingerprinted_key('css/main.min.css', '1a2b3c4d')
+    'css/main.min.1a2b3c4d.css'
+    """
+    root, ext = posixpath.splitext(file_key)
+    return '%s.%s%s' % (root, version, ext)
+
+
+def shard_base_url(base_urls, file_key):
+    """Return the base URL that `file_key` is always served from.
+
+    The choice is a CRC-32 of the key, so it is the same in every
+    process and every build, for as long as `base_urls` is unchanged.
+    """
+    return base_urls[(zlib.crc32(file_key) & 0xffffffff) % len(base_urls)]
+
+
+def css_html_key(file_key, alt='', link_type='', title='', link_class='', media='', delimiter='\n'):
+    """Return the HTML manifest key for `get_css_html` called with these arguments.
+    """
+    return ('css', file_key, alt, link_type, title, link_class, media, delimiter)
+
+
+def js_html_key(file_key, script_type='', charset='', delimiter='\n'):
+    """Return the HTML manifest key for `get_js_html` called with these arguments.
+    """
+    return ('js', file_key, script_type, charset, delimiter)
+
+
+def html_settings(base_urls, base_url_strategy, fingerprint, css_html, css_html_defaults, js_html, js_html_defaults):
+    """Return the settings that shape pre-rendered HTML, as recorded in an HTML manifest.
+    """
+    settings = dict(base_urls=list(base_urls), base_url_strategy=base_url_strategy, fingerprint=bool(fingerprint),
+                    css_html=css_html, css_html_defaults=dict(css_html_defaults),
+                    js_html=js_html, js_html_defaults=dict(js_html_defaults))
+    if json is not None:
+        settings = json.loads(json.dumps(settings))  # Compare as they'd be read back.
+    return settings
+
+
+def render_css_html(template, defaults, urls, alt='', link_type='', title='', link_class='', media='', delimiter='\n'):
+    """Render the <link> template for each URL.
+    """
+    context = dict(defaults)
+    if alt:
+        context['alt'] = alt
+    if link_type:
+        context['type'] = link_type
+    if title:
+        context['title'] = 'title="%s" ' % title
+    if link_class:
+        context['class'] = 'class="%s" ' % link_class
+    if media:
+        context['media'] = media
+    parts = []
+    for url in urls:
+        context['href'] = url
+        parts.append(template % context)
+        parts.append(delimiter)
+    return ''.join(parts)
+
+
+def render_js_html(template, defaults, urls, script_type='', charset='', delimiter='\n'):
+    """Render the <script> template for each URL.
+    """
+    context = dict(defaults)
+    if script_type:
+        context['type'] = script_type
+    if charset:
+        context['charset'] = charset
+    parts = []
+    for url in urls:
+        context['src'] = url
+        parts.append(template % context)
+        parts.append(delimiter)
+    return ''.join(parts)
+
+
+class HTMLManifest(object):
+    """The <link> and <script> tags pre-rendered by a build, keyed by
+    `css_html_key` or `js_html_key` and then by base URL.
+
+    @param filename: the manifest written by `AssetManager.save_html_manifest`.
+
+    @param versions: the versions the tags were rendered with. When
+    their generation changes, after a refresh, the manifest is read
+    again.
+
+    @param settings: the `html_settings` the caller would render with.
+    A manifest rendered with different settings, or missing, is empty.
+    """
+    def __init__(self, filename, versions=None, settings=None):
+        self.filename = filename
+        self.versions = versions
+        self.expected_settings = settings
+        self.read()
+
+    def read(self):
+        self._generation = getattr(self.versions, 'generation', None)
+        data = {}
+        if json is not None:
+            try:
+                fi = open(self.filename, 'r')
+                try:
+                    data = json.load(fi)
+                finally:
+                    fi.close()
+            except (IOError, ValueError):
+                pass
+        self.settings = data.get('settings')
+        if self.expected_settings is not None and self.settings != self.expected_settings:
+            self.fragments = {}
+        else:
+            self.fragments = dict((tuple(entry[:-1]), entry[-1]) for entry in data.get('fragments', ()))
+
+    def get(self, key, base_url):
+        """Return the tag for `key` served from `base_url`, or None if it wasn't pre-rendered.
+        """
+        if self.versions is not None and self.versions.generation != self._generation:
+            self.read()
+        try:
+            return self.fragments[key][base_url]
+        except KeyError:
+            return None
+
+
+class AssetResolver(object):
+    """Serves asset URLs and HTML from a prebuilt version map.
+
+    @param versions: a mapping of file keys to versions, such as a MappedVersions.
+
+    @param base_urls: base URLs to spread requests over.
+
+    @param base_url_strategy: 'cycle' to take each base URL in turn, or
+    'hash' to always serve a file key from the same one.
+
+    @param fingerprint: whether the build wrote fingerprinted filenames.
+
+    @param css_html, css_html_defaults, js_html, js_html_defaults: the
+    HTML templates and their defaults, as in the AssetManager options.
+
+    @param html_manifest: an HTML manifest from the same build, to look
+    tags up in before rendering them.
+    """
+    def __init__(self, versions, base_urls=('/media',), fingerprint=False, base_url_strategy='cycle',
+                 css_html=CSS_HTML, css_html_defaults=None, js_html=JS_HTML, js_html_defaults=None,
+                 html_manifest=None):
+        if base_url_strategy not in BASE_URL_STRATEGIES:
+            raise ValueError('Unknown base URL strategy %r.' % (base_url_strategy,))
+        self.versions = versions
+        self.base_urls = list(base_urls)
+        self.base_url_iter = itertools.cycle(self.base_urls)
+        self.base_url_strategy = base_url_strategy
+        self.fingerprint = fingerprint
+        self.css_html = css_html
+        self.css_html_defaults = css_html_defaults or CSS_HTML_DEFAULTS
+        self.js_html = js_html
+        self.js_html_defaults = js_html_defaults or JS_HTML_DEFAULTS
+        self._fragments = {}
+        self._generation = getattr(versions, 'generation', None)
+        self.html_manifest = None
+        if html_manifest is not None:
+            settings = html_settings(self.base_urls, base_url_strategy, fingerprint, self.css_html,
+                                     self.css_html_defaults, self.js_html, self.js_html_defaults)
+            self.html_manifest = HTMLManifest(html_manifest, versions, settings)
+
+    def refresh(self):
+        """Pick up a newer version map, if the versions support it.
+        """
+        refresh = getattr(self.versions, 'refresh', None)
+        if refresh is not None:
+            refresh()
+
+    def base_url_for(self, file_key):
+        if self.base_url_strategy == 'hash':
+            return shard_base_url(self.base_urls, file_key)
+        return self.base_url_iter.next()
+
+    def get_asset_url(self, file_key, base_url=None):
+        if file_key.startswith('http'):
+            return file_key
+        if base_url is None:
+            if self.base_url_strategy == 'hash':
+                fragments = self._get_fragments()
+                try:
+                    return fragments[('url', file_key)]
+                except KeyError:
+                    url = self.get_asset_url(file_key, shard_base_url(self.base_urls, file_key))
+                    return fragments.setdefault(('url', file_key), url)
+            base_url = self.base_url_iter.next()
+        if self.fingerprint:
+            version = self.versions.get(file_key)
+            if version:
+                file_key = fingerprinted_key(file_key, version)
+        return '%s/%s' % (base_url, file_key)
+
+    def get_css_urls(self, file_key):
+        return [self.get_asset_url(file_key)]
+
+    def get_js_urls(self, file_key):
+        return [self.get_asset_url(file_key)]
+
+    def get_css_html(self, file_key, alt='', link_type='', title='', link_class='', media='', delimiter='\n'):
+        base_url = self.base_url_for(file_key)
+        key = css_html_key(file_key, alt, link_type, title, link_class, media, delimiter)
+        if self.html_manifest is not None:
+            html = self.html_manifest.get(key, base_url)
+            if html is not None:
+                return html
+        key += (base_url,)
+        fragments = self._get_fragments()
+        try:
+            return fragments[key]
+        except KeyError:
+            html = render_css_html(self.css_html, self.css_html_defaults, [self.get_asset_url(file_key, base_url)],
+                                   alt, link_type, title, link_class, media, delimiter)
+            return fragments.setdefault(key, html)
+
+    def get_js_html(self, file_key, script_type='', charset='', delimiter='\n'):
+        base_url = self.base_url_for(file_key)
+        key = js_html_key(file_key, script_type, charset, delimiter)
+        if self.html_manifest is not None:
+            html = self.html_manifest.get(key, base_url)
+            if html is not None:
+                return html
+        key += (base_url,)
+        fragments = self._get_fragments()
+        try:
+            return fragments[key]
+        except KeyError:
+            html = render_js_html(self.js_html, self.js_html_defaults, [self.get_asset_url(file_key, base_url)],
+                                  script_type, charset, delimiter)
+            return fragments.setdefault(key, html)
+
+    def _get_fragments(self):
+        generation = getattr(self.versions, 'generation', None)
+        if generation != self._generation:
+            self._generation = generation
+            self._fragments = {}
+        return self._fragments
+
+
+def load(filename, **options):
+    """Return an AssetResolver over the binary version map in `filename`.
+
+    Keyword arguments, such as `html_manifest`, are passed on to AssetResolver.
+    """
+    return AssetResolver(MappedVersions(filename), **options)
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 """stillness.versioners -- File content versioners for Stillness.
 """
+import os
+import mmap
+import time
 import hashlib
 
 import ConfigParser
@@ -16,11 +19,117 @@ except ImportError:
     yaml = None
 
 from path import path
+from versionmaps import MappedVersions, write_binary
 
-__all__ = ['Versions']
+__all__ = ['Versions', 'StatCache', 'MappedVersions']
+
+
+class StatCache(dict):
+    """A persistent map of filenames to their stat signature and computed versions.
+
+    A file whose inode, size and mtime match the recorded signature
+    reuses its recorded version instead of being hashed again.
+    """
+    racy_window = 2  # Seconds; files modified more recently than this aren't cached.
+
+    def __init__(self, filename=None):
+        super(StatCache, self).__init__()
+        self.filename = filename and path(filename)
+        if self.filename and json is not None and self.filename.exists():
+            fi = open(self.filename, 'r')
+            try:
+                try:
+                    self.update(json.load(fi))
+                except ValueError:
+                    pass  # A corrupt cache just means hashing everything again.
+            finally:
+                fi.close()
+
+    def signature(self, st):
+        return [st.st_ino, st.st_size, st.st_mtime]
+
+    def lookup(self, filename, method, st):
+        """Return the recorded version of the file, or None if it may have changed.
+        """
+        entry = self.get(unicode(filename))
+        if entry is None or entry['stat'] != self.signature(st):
+            return None
+        return entry['versions'].get(method)
+
+    def store(self, filename, method, st, version):
+        """Record the version computed for the file with the given stat result.
+        """
+        if st.st_mtime >= time.time() - self.racy_window:
+            return  # Could still change within the same mtime tick.
+        key = unicode(filename)
+        signature = self.signature(st)
+        entry = self.get(key)
+        if entry is None or entry['stat'] != signature:
+            entry = self[key] = dict(stat=signature, versions={})
+        entry['versions'][method] = version
+
+    def save(self):
+        """Write the cache back to its file.
+        """
+        if not self.filename or json is None:
+            return
+        if not self.filename.parent.exists():
+            self.filename.parent.makedirs()
+        tmp_filename = self.filename + '.tmp'
+        fo = open(tmp_filename, 'w')
+        try:
+            json.dump(dict(self), fo)
+        finally:
+            fo.close()
+        os.rename(tmp_filename, self.filename)
 
 
 class Versions(dict):
+    buffer_size = 64 * 1024  # Bytes read at a time when hashing a file.
+    mmap_threshold = 16 * 1024 * 1024  # Files at least this large are hashed through mmap.
+
+    hashers = {
+        'SHA1Sum': hashlib.sha1,
+        'MD5Sum': hashlib.md5,
+        }
+
+    stat_cache = None  # A StatCache consulted before hashing file contents.
+    generation = 0  # Bumped on every change, so dependent caches can tell when to reset.
+
+    def __setitem__(self, key, value):
+        super(Versions, self).__setitem__(key, value)
+        self.generation += 1
+
+    def __delitem__(self, key):
+        super(Versions, self).__delitem__(key)
+        self.generation += 1
+
+    def clear(self):
+        super(Versions, self).clear()
+        self.generation += 1
+
+    def pop(self, *args):
+        try:
+            return super(Versions, self).pop(*args)
+        finally:
+            self.generation += 1
+
+    def popitem(self):
+        try:
+            return super(Versions, self).popitem()
+        finally:
+            self.generation += 1
+
+    def setdefault(self, key, default=None):
+        try:
+            return super(Versions, self).setdefault(key, default)
+        finally:
+            self.generation += 1
+
+    def update(self, *args, **kwargs):
+        super(Versions, self).update(*args, **kwargs)
+        self.generation += 1
+
     def mapVersions(self, method, common_path, *file_keys):
         """Build a version map, using the given method, from the given files.
 
@@ -29,21 +138,84 @@ class Versions(dict):
         @common_path: the common filesystem path that should be prepended to each file key.
 
         @file_keys: the relative file paths for each filename to version, based off the common path.
+
+        If a stat cache is set, files whose stat signature hasn't
+        changed since they were last hashed keep their cached version.
         """
         versioner = getattr(self, method)
+        stat_cache = None
+        if method in self.hashers:
+            stat_cache = self.stat_cache
         for fn in file_keys:
-            self[fn] = versioner(path(common_path) / fn)
+            filename = path(common_path) / fn
+            if stat_cache is None:
+                self[fn] = versioner(filename)
+                continue
+            filename = filename.abspath()
+            st = os.stat(filename)
+            version = stat_cache.lookup(filename, method, st)
+            if version is None:
+                version = versioner(filename)
+                stat_cache.store(filename, method, st, version)
+            self[fn] = version
+
+    def saveStatCache(self):
+        """Write the stat cache, if there is one, back to disk.
+        """
+        if self.stat_cache is not None:
+            self.stat_cache.save()
+
+    def newHasher(self, method):
+        """Return a fresh hash object for the given versioning method.
+
+        Returns None if the method doesn't version by content hash.
+        """
+        factory = self.hashers.get(method)
+        if factory is None:
+            return None
+        return factory()
+
+    def mapHasher(self, file_key, hasher):
+        """Map the file key to the version given by a hash object fed its contents.
+        """
+        self[file_key] = hasher.hexdigest()[:8]
+
+    def hashFile(self, hasher, filename):
+        """Feed the raw bytes of the file to the hash object, and return it.
+
+        Reads `buffer_size` bytes at a time, or maps the whole file
+        into memory if it is larger than `mmap_threshold`.
+        """
+        fi = open(filename, 'rb')
+        try:
+            size = os.fstat(fi.fileno()).st_size
+            if self.mmap_threshold is not None and size and size >= self.mmap_threshold:
+                mapped = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    hasher.update(mapped)
+                finally:
+                    mapped.close()
+            else:
+                read = fi.read
+                buffer_size = self.buffer_size
+                chunk = read(buffer_size)
+                while chunk:
+                    hasher.update(chunk)
+                    chunk = read(buffer_size)
+        finally:
+            fi.close()
+        return hasher
 
     ### Versioners
     def SHA1Sum(klass, filename):
-        """Returns 8 characters from the SHA1 sum of the file contents.
+        """Returns 8 characters from the SHA1 sum of the file's bytes.
         """
-        return hashlib.sha1(path(filename).text()).hexdigest()[:8]
+        return klass.hashFile(hashlib.sha1(), filename).hexdigest()[:8]
 
     def MD5Sum(klass, filename):
-        """Returns 8 characters from the MD5 sum of the file contents.
+        """Returns 8 characters from the MD5 sum of the file's bytes.
         """
-        return hashlib.md5(path(filename).text()).hexdigest()[:8]
+        return klass.hashFile(hashlib.md5(), filename).hexdigest()[:8]
 
     def FileTimestamp(klass, filename):
         """Returns the timestamp of the file.
@@ -108,6 +280,24 @@ class Versions(dict):
 
         return self
         
+    def writeBinary(self, filename):
+        """Write the version map to a compact binary file, for reading with MappedVersions.
+
+        The file is replaced atomically, so processes still mapping the
+        old one are unaffected.
+        """
+        write_binary(self, filename)
+
+    def readBinary(self, filename):
+        """Read the version map from a binary file written by writeBinary.
+        """
+        mapped = MappedVersions(filename)
+        try:
+            self.update(mapped.iteritems())
+        finally:
+            mapped.close()
+        return self
+
     def writeINI(self, filename):
         """Write the version map to an INI file.
         """
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""stillness.versionmaps -- The binary version map format.
+
+Written by `Versions.writeBinary` at build time, and read through
+mmap by MappedVersions. Only the standard library is imported, so web
+processes can read version maps without loading the build machinery.
+"""
+import os
+import mmap
+import struct
+from UserDict import DictMixin
+
+__all__ = ['MappedVersions', 'write_binary']
+
+BINARY_MAGIC = 'STV1'
+BINARY_HEADER = struct.Struct('<4sI')  # Magic, entry count.
+BINARY_ENTRY = struct.Struct('<IHH')  # Offset of the key, key length, value length; the value follows the key.
+
+
+def _encode(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return str(s)
+
+
+class MappedVersions(DictMixin, object):
+    """A read-only version map over a file written by `Versions.writeBinary`.
+
+    The file is memory-mapped rather than parsed, so opening it costs
+    the same however many versions it holds, and processes mapping the
+    same file share its pages. Lookups binary search the sorted index.
+    """
+    generation = 0  # Bumped by refresh when the file has been replaced.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._map = None
+        self._open()
+
+    def _open(self):
+        fi = open(self.filename, 'rb')
+        try:
+            self._stat = os.fstat(fi.fileno())
+            self._map = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fi.close()
+        magic, self._count = BINARY_HEADER.unpack_from(self._map, 0)
+        if magic != BINARY_MAGIC:
+            self.close()
+            raise ValueError('%s is not a binary version map.' % self.filename)
+
+    def refresh(self):
+        """Map the file again if it has been replaced. Returns whether it had.
+        """
+        st = os.stat(self.filename)
+        if (st.st_ino, st.st_mtime, st.st_size) == (self._stat.st_ino, self._stat.st_mtime, self._stat.st_size):
+            return False
+        self.close()
+        self._open()
+        self.generation += 1
+        return True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _entry(self, i):
+        offset, key_length, value_length = BINARY_ENTRY.unpack_from(self._map, BINARY_HEADER.size + i * BINARY_ENTRY.size)
+        return offset, key_length, value_length
+
+    def _key(self, i):
+        offset, key_length, value_length = self._entry(i)
+        return self._map[offset:offset + key_length]
+
+    def __getitem__(self, key):
+        wanted = _encode(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset, key_length, value_length = self._entry(middle)
+            found = self._map[offset:offset + key_length]
+            if found < wanted:
+                low = middle + 1
+            elif found > wanted:
+                high = middle
+            else:
+                offset += key_length
+                return self._map[offset:offset + value_length].decode('utf-8')
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+    has_key = __contains__
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self._key(i).decode('utf-8')
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for i in xrange(self._count):
+            offset, key_length, value_length = self._entry(i)
+            yield (self._map[offset:offset + key_length].decode('utf-8'),
+                   self._map[offset + key_length:offset + key_length + value_length].decode('utf-8'))
+
+
+def write_binary(versions, filename):
+    """Write the `versions` mapping to `filename` in the binary format, atomically.
+    """
+    items = sorted((_encode(k), _encode(v)) for k, v in versions.iteritems())
+    index = []
+    data = []
+    offset = BINARY_HEADER.size + BINARY_ENTRY.size * len(items)
+    for key, value in items:
+        index.append(BINARY_ENTRY.pack(offset, len(key), len(value)))
+        data.append(key)
+        data.append(value)
+        offset += len(key) + len(value)
+    tmp_filename = filename + '.tmp'
+    fo = open(tmp_filename, 'wb')
+    try:
+        fo.write(BINARY_HEADER.pack(BINARY_MAGIC, len(items)))
+        fo.write(''.join(index))
+        fo.write(''.join(data))
+    finally:
+        fo.close()
+    os.rename(tmp_filename, filename)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""stillness.watchers -- Rebuild bundles as their sources change.
+
+A Watcher keeps a reverse index from each source file to the file keys
+that include it, directly or through other file keys. When sources
+change, only the affected bundles are rebuilt and re-versioned.
+
+Changes are detected with inotify if `pyinotify` is installed, and by
+polling file stats otherwise. Bursts of changes, such as an editor
+saving several files or a version control checkout, are collected
+until things have been quiet for the debounce period.
+"""
+import os
+import sys
+import time
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from path import path
+
+__all__ = ['Watcher', 'StatPoller', 'InotifyMonitor']
+
+
+def stat_signature(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+class StatPoller(object):
+    """Detects changes to a set of files by comparing their stats.
+    """
+    def __init__(self, filenames=()):
+        self.signatures = {}
+        self.watch(filenames)
+
+    def watch(self, filenames):
+        """Set the files to watch, keeping the known state of files already watched.
+        """
+        signatures = {}
+        for fn in filenames:
+            if fn in self.signatures:
+                signatures[fn] = self.signatures[fn]
+            else:
+                signatures[fn] = stat_signature(fn)
+        self.signatures = signatures
+
+    def changes(self, timeout):
+        """Wait up to `timeout` seconds for changes, and return the set of changed files.
+        """
+        deadline = time.time() + timeout
+        while True:
+            changed = set()
+            for fn, old in self.signatures.items():
+                new = stat_signature(fn)
+                if new != old:
+                    self.signatures[fn] = new
+                    changed.add(fn)
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(remaining, 0.1))
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    """Detects changes to a set of files with inotify, by watching their directories.
+    """
+    mask = 0
+    if pyinotify is not None:
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_ATTRIB)
+
+    def __init__(self, filenames=()):
+        if pyinotify is None:
+            raise RuntimeError('pyinotify is not available.')
+        self.filenames = set()
+        self.pending = set()
+        self.watches = {}
+        self.watch_manager = pyinotify.WatchManager()
+        monitor = self
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                monitor.pending.add(path(event.pathname))
+        self.notifier = pyinotify.Notifier(self.watch_manager, Handler())
+        self.watch(filenames)
+
+    def watch(self, filenames):
+        self.filenames = set(filenames)
+        directories = set(fn.parent for fn in self.filenames)
+        for directory in directories.difference(self.watches):
+            if directory.isdir():
+                self.watches.update(self.watch_manager.add_watch(directory, self.mask))
+        stale = [self.watches.pop(d) for d in list(self.watches) if d not in directories]
+        if stale:
+            self.watch_manager.rm_watch(stale)
+
+    def changes(self, timeout):
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        changed = self.pending.intersection(self.filenames)
+        self.pending.clear()
+        return changed
+
+    def close(self):
+        self.notifier.stop()
+
+
+class Watcher(object):
+    """Watches an AssetManager's sources and rebuilds the bundles that include them.
+
+    @param manager: the AssetManager to build with.
+
+    @param interval: seconds to wait for changes in each cycle.
+
+    @param debounce: seconds of quiet to wait for after a change before rebuilding.
+
+    @param use_inotify: use inotify (True), polling (False), or inotify if available (None).
+
+    @param on_build: called with ({kind: [file_keys]}, set of changed files) after each rebuild.
+
+    @param on_error: called with each BuildError; by default it is written to stderr.
+    """
+    def __init__(self, manager, interval=0.5, debounce=0.2, use_inotify=None,
+                 on_build=None, on_error=None):
+        self.manager = manager
+        self.interval = interval
+        self.debounce = debounce
+        if use_inotify is None:
+            use_inotify = pyinotify is not None
+        self.monitor = use_inotify and InotifyMonitor() or StatPoller()
+        self.on_build = on_build
+        self.on_error = on_error or self._report_error
+        self._index = None
+        self._index_stamp = None
+        self._stop = threading.Event()
+        self.refresh()
+
+    def _maps(self):
+        return [(kind, self.manager.options[kind]['map']) for kind in ('css', 'js')]
+
+    def refresh(self):
+        """Rebuild the reverse index if the file maps or common path have changed.
+        """
+        stamp = (self.manager.options['common_path'],) + tuple(m.generation for k, m in self._maps())
+        if stamp == self._index_stamp:
+            return
+        common_path = path(self.manager.options['common_path'])
+        index = {}
+        for kind, file_map in self._maps():
+            for file_key in file_map:
+                for source in file_map[file_key]:
+                    index.setdefault(common_path / source, set()).add((kind, file_key))
+        self._index = index
+        self._index_stamp = stamp
+        self.monitor.watch(index.keys())
+
+    def reverse_index(self):
+        """Return the map of source files to the set of (kind, file key) that include them.
+        """
+        self.refresh()
+        return self._index
+
+    def affected(self, changed):
+        """Return {kind: [file_keys]} for the bundles that include any of the changed files.
+        """
+        index = self.reverse_index()
+        affected = {}
+        for fn in changed:
+            for kind, file_key in index.get(fn, ()):
+                affected.setdefault(kind, set()).add(file_key)
+        return dict((kind, sorted(keys)) for kind, keys in affected.items())
+
+    def wait_for_changes(self, timeout=None):
+        """Wait for changes, then for the debounce period of quiet, and return the changed files.
+        """
+        if timeout is None:
+            timeout = self.interval
+        changed = set(self.monitor.changes(timeout))
+        while changed:
+            more = self.monitor.changes(self.debounce)
+            if not more:
+                break
+            changed.update(more)
+        return changed
+
+    def rebuild(self, changed):
+        """Rebuild and re-version the bundles affected by the changed files.
+
+        Returns {kind: [file_keys]} of the bundles rebuilt.
+        """
+        from managers import BuildError
+        affected = self.affected(changed)
+        for kind in sorted(affected):
+            try:
+                self.manager.options[kind]['map'].combine_files(file_keys=affected[kind])
+            except BuildError, e:
+                self.on_error(e)
+        if affected and self.on_build is not None:
+            self.on_build(affected, changed)
+        return affected
+
+    def step(self, timeout=None):
+        """Run one watch cycle: wait for changes and rebuild what they affect.
+        """
+        self.refresh()
+        changed = self.wait_for_changes(timeout)
+        if not changed:
+            return {}
+        return self.rebuild(changed)
+
+    def run(self):
+        """Watch and rebuild until `stop` is called.
+        """
+        try:
+            while not self._stop.isSet():
+                self.step()
+        finally:
+            self.monitor.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def _report_error(self, error):
+        sys.stderr.write('%s\n' % error)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""tests -- helpers shared by the Stillness test modules.
+"""
+import copy
+import unittest
+import tempfile
+import subprocess
+
+from stillness import managers
+from stillness.path import path
+
+
+def have_java():
+    try:
+        subprocess.Popen(['java', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    except OSError:
+        return False
+    return True
+
+
+class ManagerTestCase(unittest.TestCase):
+    """Tests that build into a temporary root with their own AssetManagers.
+
+    Each test gets a fresh `root`, with an empty `media` directory as the
+    common path and `build` as the build path. Subclasses put the options
+    their managers share, such as the css and js maps, in
+    `manager_options`; `make_manager` merges its keyword arguments over
+    those.
+    """
+    manager_options = {}
+
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        self.media = self.root / 'media'
+        self.media.makedirs()
+        self.build_path = self.root / 'build'
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def make_manager(self, **options):
+        kwargs = dict(common_path=self.media, build_path=self.build_path)
+        managers.merge_dictionary(kwargs, copy.deepcopy(self.manager_options))
+        managers.merge_dictionary(kwargs, options)
+        return managers.AssetManager(**kwargs)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""builds_tests.py -- tests for background builds and cancellation.
+"""
+import unittest
+import subprocess
+import time
+
+from stillness import managers
+from stillness.builds import BuildHandle, CancelToken, BuildCancelled
+
+from tests import ManagerTestCase
+
+
+class BuildHandleTests(unittest.TestCase):
+    def test_result(self):
+        handle = BuildHandle(lambda cancel: 42).start()
+        self.assertEqual(handle.result(5), 42)
+        self.assert_(handle.done())
+        self.failIf(handle.cancelled())
+        self.failIf(handle.cancel())
+
+    def test_exception(self):
+        def build(cancel):
+            raise ValueError('broken')
+        handle = BuildHandle(build).start()
+        self.assertRaises(ValueError, handle.result, 5)
+        self.assert_(isinstance(handle.exception(), ValueError))
+
+    def test_done_callbacks(self):
+        called = []
+        handle = BuildHandle(lambda cancel: time.sleep(0.1))
+        handle.add_done_callback(called.append)
+        handle.start().wait(5)
+        handle.add_done_callback(called.append)
+        self.assertEqual(called, [handle, handle])
+
+    def test_timeout(self):
+        handle = BuildHandle(lambda cancel: time.sleep(0.5)).start()
+        self.assertRaises(RuntimeError, handle.result, 0.01)
+        handle.wait(5)
+
+    def test_cancel_kills_tracked_processes(self):
+        token = CancelToken()
+        process = subprocess.Popen(['sleep', '30'])
+        token.track(process)
+        token.cancel()
+        self.assertNotEqual(process.wait(), 0)
+        self.assertRaises(BuildCancelled, token.check)
+
+
+class BuildAsyncTests(ManagerTestCase):
+    manager_options = dict(
+        css = dict(map = {'ab.css': ['a.css', 'b.css'], 'cd.css': ['c.css', 'd.css']},
+                   minify_cmd = 'cat'),
+        js = dict(map = {'ab.js': ['a.js', 'b.js'], 'cd.js': ['c.js', 'd.js']},
+                  minify_cmd = 'cat'),
+        )
+
+    def setUp(self):
+        super(BuildAsyncTests, self).setUp()
+        for name in 'abcd':
+            (self.media / ('%s.js' % name)).write_bytes('var %s = 1;\n' % name)
+            (self.media / ('%s.css' % name)).write_bytes('.%s { color: red }\n' % name)
+
+    def test_build(self):
+        assets = self.make_manager()
+        handle = assets.build_async(jobs=2)
+        self.assertEqual(handle.result(30), {'css': ['ab.css', 'cd.css'], 'js': ['ab.js', 'cd.js']})
+        self.assertEqual(sorted(self.root.joinpath('build').listdir('*.*s')),
+                         [self.root / 'build' / name for name in ('ab.css', 'ab.js', 'cd.css', 'cd.js')])
+        self.assertEqual(sorted(assets.versions), ['ab.css', 'ab.js', 'cd.css', 'cd.js'])
+
+    def test_build_selected_file_keys(self):
+        handle = self.make_manager().build_async(file_keys={'js': ['cd.js']})
+        self.assertEqual(handle.result(30), {'js': ['cd.js']})
+
+    def test_errors_from_all_kinds(self):
+        assets = self.make_manager()
+        assets.options['css']['map']['broken.css'] = ['missing.css']
+        assets.options['js']['map']['broken.js'] = ['missing.js']
+        handle = assets.build_async()
+        self.assertRaises(managers.BuildError, handle.result, 30)
+        self.assertEqual(sorted(handle.exception().errors), ['broken.css', 'broken.js'])
+
+    def assertCancels(self, **options):
+        slow = dict(minify_cmd='sleep 30; cat')
+        assets = self.make_manager(css=slow, js=slow, **options)
+        start = time.time()
+        handle = assets.build_async(jobs=2)
+        time.sleep(0.5)
+        self.assert_(handle.cancel())
+        self.assertRaises(BuildCancelled, handle.result, 20)
+        self.assert_(handle.cancelled())
+        self.assert_(time.time() - start < 20)
+        self.assertEqual(list((self.root / 'build').walkfiles()), [])
+        self.assertEqual(dict(assets.versions), {})
+
+    def test_cancel(self):
+        self.assertCancels()
+
+    def test_cancel_streaming(self):
+        self.assertCancels(streaming=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
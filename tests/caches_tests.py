@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""caches_tests.py -- tests for the minification cache.
+"""
+import unittest
+import tempfile
+import os
+
+from stillness import managers
+from stillness import caches
+from stillness.path import path
+
+from tests import ManagerTestCase
+
+
+class MinifyCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = path(tempfile.mkdtemp())
+        self.cache = caches.MinifyCache(self.directory, max_size=10)
+
+    def tearDown(self):
+        self.directory.rmtree()
+
+    def test_key_depends_on_text_and_command(self):
+        key = self.cache.key('a {}', 'cat')
+        self.assertEqual(key, self.cache.key('a {}', 'cat'))
+        self.assertNotEqual(key, self.cache.key('b {}', 'cat'))
+        self.assertNotEqual(key, self.cache.key('a {}', 'cat -u'))
+
+    def test_key_depends_on_files_named_in_command(self):
+        jar = self.directory / 'compressor.jar'
+        jar.write_bytes('one')
+        key = self.cache.key('a {}', 'java -jar %s' % jar)
+        jar.write_bytes('two')
+        self.assertNotEqual(key, caches.MinifyCache(self.directory).key('a {}', 'java -jar %s' % jar))
+
+    def test_get_and_put(self):
+        self.assertEqual(self.cache.get('abcdef'), None)
+        self.cache.put('abcdef', 'a{}')
+        self.assertEqual(self.cache.get('abcdef'), 'a{}')
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=1, evictions=0))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.put('aaaa', '1234')
+        self.cache.put('bbbb', '1234')
+        os.utime(self.cache._entry_path('aaaa'), (1000, 1000))
+        os.utime(self.cache._entry_path('bbbb'), (2000, 2000))
+        self.cache.put('cccc', '1234')
+        self.assertEqual(self.cache.get('aaaa'), None)
+        self.assertEqual(self.cache.get('bbbb'), '1234')
+        self.assertEqual(self.cache.get('cccc'), '1234')
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_full_cache_is_not_scanned_on_every_put(self):
+        cache = caches.MinifyCache(self.directory, max_size=1000)
+        scans = []
+        entries = cache._entries
+        def _entries():
+            scans.append(1)
+            return entries()
+        cache._entries = _entries
+        for i in range(300):
+            cache.put('%04d' % i, 'x' * 10)
+        self.assert_(len(scans) <= 15, len(scans))
+        self.assert_(cache._scan_size() <= 1000)
+        self.assertEqual(cache._size, cache._scan_size())
+
+    def test_replacing_an_entry_keeps_the_size(self):
+        self.cache.put('aaaa', '1234')
+        self.cache.put('aaaa', '123')
+        self.assertEqual(self.cache._size, 3)
+
+    def test_prune(self):
+        self.cache.put('aaaa', '1234')
+        self.cache.put('bbbb', '1234')
+        self.assertEqual(self.cache.prune(0), 2)
+        self.assertEqual(self.cache.get('bbbb'), None)
+
+    def test_parse_size(self):
+        self.assertEqual(caches.parse_size('512'), 512)
+        self.assertEqual(caches.parse_size('2k'), 2048)
+        self.assertEqual(caches.parse_size('1.5M'), 1536 * 1024)
+
+
+class FileMapMinifyCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = path(tempfile.mkdtemp())
+        self.manager = managers.AssetManager(minify_cache={'path': self.directory},
+                                             css={'minify_cmd': 'tr a-z A-Z'})
+
+    def tearDown(self):
+        self.directory.rmtree()
+
+    def test_cache_hit_skips_minifier(self):
+        css_map = self.manager.options['css']['map']
+        self.assertEqual(css_map._minify_text('a {}'), 'A {}')
+        css_map._run_minifier = lambda text: self.fail('Minifier should not run.')
+        self.assertEqual(css_map._minify_text('a {}'), 'A {}')
+        self.assertEqual(self.manager.get_minify_cache().stats(), dict(hits=1, misses=1, evictions=0))
+
+
+class FailedMinifierTests(ManagerTestCase):
+    manager_options = dict(
+        incremental = True,
+        js = {'map': {'js/all.js': ['a.js']}},
+        )
+
+    def setUp(self):
+        super(FailedMinifierTests, self).setUp()
+        (self.media / 'a.js').write_bytes('var a = 1;\n')
+
+    def make_manager(self, minify_cmd, **options):
+        return super(FailedMinifierTests, self).make_manager(
+            minify_cache={'path': self.root / 'cache'}, js={'minify_cmd': minify_cmd}, **options)
+
+    def assertNotKept(self, **options):
+        assets = self.make_manager('exit 3', **options)
+        js_map = assets.options['js']['map']
+        self.assertRaises(managers.BuildError, js_map.combine_files)
+        self.failIf((self.root / 'build' / 'js' / 'all.js').exists())
+        self.assertEqual(list((self.root / 'cache').walkfiles()) if (self.root / 'cache').exists() else [], [])
+        self.failIf('js/all.js' in assets.get_build_manifest())
+        self.assertEqual(dict(assets.versions), {})
+        assets = self.make_manager('cat', **options)
+        assets.options['js']['map'].combine_files()
+        self.assertEqual((self.root / 'build' / 'js' / 'all.js').bytes().count('var a = 1;'), 1)
+
+    def test_failed_output_is_not_kept(self):
+        self.assertNotKept()
+
+    def test_failed_streamed_output_is_not_kept(self):
+        self.assertNotKept(streaming=True)
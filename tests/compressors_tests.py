@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""compressors_tests.py -- tests for precompressed sidecars.
+"""
+import unittest
+import tempfile
+import gzip
+import os
+
+from stillness import managers
+from stillness.compressors import gzip_file
+from stillness.path import path
+
+
+class GzipFileTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        self.filename = self.root / 'a.js'
+        self.filename.write_bytes('var a = 1;\n' * 1000)
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_round_trip(self):
+        size = gzip_file(self.filename)
+        self.assertEqual(size, os.path.getsize(self.filename + '.gz'))
+        self.assertEqual(gzip.open(self.filename + '.gz').read(), self.filename.bytes())
+
+    def test_sidecars_are_reproducible(self):
+        gzip_file(self.filename, self.root / 'one.gz')
+        self.filename.utime((1000, 1000))
+        gzip_file(self.filename, self.root / 'two.gz')
+        self.assertEqual((self.root / 'one.gz').bytes(), (self.root / 'two.gz').bytes())
+
+
+class PrecompressTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        (self.root / 'media' / 'js').makedirs()
+        (self.root / 'media' / 'js' / 'big.js').write_bytes('var a = 1;\n' * 1000)
+        (self.root / 'media' / 'js' / 'tiny.js').write_bytes('var b;\n')
+        (self.root / 'media' / 'js' / 'random.js').write_bytes(os.urandom(4096))
+        self.assets = managers.AssetManager(
+            common_path = self.root / 'media',
+            build_path = self.root / 'build',
+            jobs = 2,
+            gzip = dict(enabled = True),
+            js = dict(map = {'big.min.js': ['js/big.js'],
+                             'tiny.min.js': ['js/tiny.js'],
+                             'random.min.js': ['js/random.js']},
+                      minify = False),
+            )
+        self.build = self.root / 'build'
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_sidecars_only_where_worthwhile(self):
+        self.assets.options['js']['map'].combine_files()
+        self.assert_((self.build / 'big.min.js.gz').exists())
+        self.failIf((self.build / 'tiny.min.js.gz').exists())
+        self.failIf((self.build / 'random.min.js.gz').exists())
+        self.assertEqual(self.assets.versions['big.min.js.gz'], self.assets.versions['big.min.js'])
+        self.failIf('tiny.min.js.gz' in self.assets.versions)
+
+    def test_unchanged_outputs_are_not_recompressed(self):
+        js_map = self.assets.options['js']['map']
+        js_map.combine_files()
+        self.assertEqual(self.assets.precompress(js_map.keys()), [])
+        (self.root / 'media' / 'js' / 'big.js').write_bytes('var c = 2;\n' * 1000)
+        js_map.combine_files()
+        self.assertEqual(gzip.open(self.build / 'big.min.js.gz').read(), (self.build / 'big.min.js').bytes())
+        assets = managers.AssetManager(build_path=self.build, gzip=dict(enabled=True))
+        self.assertEqual(assets.precompress(js_map.keys()), [])
+
+    def test_removed_sidecar_is_rewritten(self):
+        js_map = self.assets.options['js']['map']
+        js_map.combine_files()
+        (self.build / 'big.min.js.gz').remove()
+        self.assertEqual(self.assets.precompress(js_map.keys()), ['big.min.js'])
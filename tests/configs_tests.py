@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""configs_tests.py -- tests for frozen options and compiled AssetManager configs.
+"""
+import copy
+import json
+import unittest
+import tempfile
+
+from stillness import managers
+from stillness.configs import FrozenDict, freeze, thaw, read_options
+from stillness.path import path
+
+
+class FreezeTests(unittest.TestCase):
+    def test_freeze(self):
+        frozen = freeze({'a': [1, {'b': 2}], 'c': {'d': set([3])}})
+        self.assertEqual(frozen, {'a': (1, {'b': 2}), 'c': {'d': frozenset([3])}})
+        self.assert_(isinstance(frozen['a'][1], FrozenDict))
+        self.assertEqual(hash(frozen), hash(freeze({'c': {'d': set([3])}, 'a': [1, {'b': 2}]})))
+
+    def test_frozen_dicts_cannot_be_changed(self):
+        frozen = freeze({'a': {'b': 1}})
+        self.assertRaises(TypeError, frozen.__setitem__, 'a', 2)
+        self.assertRaises(TypeError, frozen['a'].update, b=2)
+        self.assertRaises(TypeError, frozen.pop, 'a')
+        self.assert_(copy.deepcopy(frozen) is frozen)
+
+    def test_thaw(self):
+        thawed = thaw(freeze({'a': {'b': [1]}}))
+        thawed['a']['c'] = 2
+        self.assertEqual(thawed, {'a': {'b': (1,), 'c': 2}})
+        self.failIf(isinstance(thawed['a'], FrozenDict))
+
+
+class ConfigTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        (self.root / 'media').makedirs()
+        (self.root / 'media' / 'a.js').write_bytes('var a;\n')
+        (self.root / 'media' / 'b.js').write_bytes('var b;\n')
+        self.kwargs = dict(
+            debug = False,
+            common_path = self.root / 'media',
+            build_path = self.root / 'build',
+            base_urls = ['//a.example.com', '//b.example.com'],
+            base_url_strategy = 'hash',
+            js = dict(map = {'js/ab.js': ['js/a.js', 'b.js'], 'js/a.js': ['a.js']}, minify_cmd = 'cat'),
+            )
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_hashable(self):
+        config = managers.Config(**self.kwargs)
+        self.assertEqual(config, managers.Config(**self.kwargs))
+        self.assertEqual(hash(config), hash(managers.Config(**self.kwargs)))
+        self.assertNotEqual(config, config.replace(debug=True))
+        self.assertEqual(len(set([config, managers.Config(**self.kwargs)])), 1)
+
+    def test_options_are_frozen(self):
+        config = managers.Config(**self.kwargs)
+        self.assertRaises(TypeError, config.options.__setitem__, 'debug', True)
+        self.assertRaises(TypeError, config.options['js']['map'].__setitem__, 'js/c.js', ['c.js'])
+        self.assertEqual(config.options['js']['map']['js/ab.js'], ('js/a.js', 'b.js'))
+
+    def test_replace(self):
+        config = managers.Config(**self.kwargs)
+        other = config.replace(js=dict(map={'js/b.js': ['b.js']}))
+        self.assertEqual(sorted(other.options['js']['map']), ['js/a.js', 'js/ab.js', 'js/b.js'])
+        self.assertEqual(sorted(config.options['js']['map']), ['js/a.js', 'js/ab.js'])
+        self.assertEqual(other.options['js']['minify_cmd'], 'cat')
+
+    def test_include_cycles_are_found_when_compiling(self):
+        self.kwargs['js']['map']['js/a.js'] = ['js/ab.js']
+        self.assertRaises(managers.IncludeCycleError, managers.Config, **self.kwargs)
+
+    def test_managers_match_and_are_independent(self):
+        config = managers.Config(**self.kwargs)
+        one = config.manager()
+        two = managers.AssetManager.from_config(config)
+        direct = managers.AssetManager(**self.kwargs)
+        self.assert_(one.config is config)
+        self.assertEqual(one.options['js']['map']['js/ab.js'], ['a.js', 'b.js'])
+        self.assertEqual(one.get_js_html('js/ab.js'), direct.get_js_html('js/ab.js'))
+        one.options['debug'] = True
+        one.options['js']['map']['js/c.js'] = ['a.js']
+        self.failIf(two.options['debug'])
+        self.failIf('js/c.js' in two.options['js']['map'])
+        self.failIf(config.options['debug'])
+        self.failIf('js/c.js' in config.options['js']['map'])
+        self.assertRaises(TypeError, one.options['gzip'].__setitem__, 'enabled', True)
+
+    def test_bound_file_maps_are_real_dicts(self):
+        config = managers.Config(**self.kwargs)
+        file_map = config.manager().options['js']['map']
+        expected = {'js/ab.js': ['js/a.js', 'b.js'], 'js/a.js': ['a.js']}
+        self.assertEqual(dict(file_map), expected)
+        self.assertEqual(expected, file_map)
+        direct = managers.AssetManager(**self.kwargs).options['js']['map']
+        self.assertEqual(json.dumps(file_map, sort_keys=True), json.dumps(direct, sort_keys=True))
+        self.assertEqual(sorted(json.loads(json.dumps(file_map))), ['js/a.js', 'js/ab.js'])
+        copied = {}
+        copied.update(file_map)
+        self.assertEqual(copied, expected)
+        self.assertEqual((lambda **kwargs: kwargs)(**file_map), expected)
+        file_map['js/c.js'] = ['js/ab.js']
+        self.assertEqual(file_map['js/c.js'], ['a.js', 'b.js'])
+        self.assertEqual(sorted(config.manager().options['js']['map']), ['js/a.js', 'js/ab.js'])
+
+    def test_build(self):
+        assets = managers.Config(**self.kwargs).manager()
+        assets.options['js']['map'].combine_files()
+        self.assertEqual((self.root / 'build' / 'js' / 'ab.js').bytes().count('var'), 2)
+        self.assertEqual(sorted(assets.versions), ['js/a.js', 'js/ab.js'])
+
+    def test_load(self):
+        filename = self.root / 'stillness.json'
+        filename.write_bytes('{"debug": false, "js": {"map": {"js/a.js": ["a.js"]}, "minify_cmd": "cat"}}')
+        config = managers.Config.load(filename, common_path=self.root / 'media')
+        self.assertEqual(read_options(filename)['js']['map'], {'js/a.js': ['a.js']})
+        self.assertEqual(config.options['js']['minify_cmd'], 'cat')
+        self.assertEqual(config.options['common_path'], self.root / 'media')
+        self.assertEqual(config.manager().options['js']['map']['js/a.js'], ['a.js'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""cssmin_tests.py -- tests for the in-process CSS minifier.
+"""
+import unittest
+import subprocess
+import copy
+import re
+
+from stillness import managers
+from stillness.cssmin import minify_css
+from stillness.minifiers import get_engine
+from stillness.path import path
+
+from tests import have_java, ManagerTestCase
+from managers_tests import AssetManagerTests
+
+CSS_MEDIA = path(__file__).abspath().dirname() / 'media' / 'css'
+
+
+class MinifyCSSTests(unittest.TestCase):
+    def assertMinifies(self, css, expected):
+        self.assertEqual(minify_css(css), expected)
+
+    def test_whitespace_and_comments(self):
+        self.assertMinifies('/* header */\nbody {\n    color : red ;\n}\n\n/* footer */\n', 'body{color:red}')
+
+    def test_preserved_comments(self):
+        self.assertMinifies('/*! Copyright */\na { b: c; }', '/*! Copyright */a{b:c}')
+
+    def test_mac_ie_comment_hack(self):
+        self.assertMinifies('/*\\*/ a { b: c; } /* x */ /**/', '/*\\*/a{b:c}/**/')
+
+    def test_strings_are_untouched(self):
+        self.assertMinifies('a:after { content: "  /* not a comment */  0px  "; }',
+                            'a:after{content:"  /* not a comment */  0px  "}')
+
+    def test_descendant_pseudo_classes(self):
+        self.assertMinifies('p :link { a: b }', 'p :link{a:b}')
+        self.assertMinifies('a:hover , a:focus { a: b }', 'a:hover,a:focus{a:b}')
+
+    def test_media_queries_keep_their_spaces(self):
+        self.assertMinifies('@media only screen and (min-width: 768px) { a { b: c } }',
+                            '@media only screen and (min-width:768px){a{b:c}}')
+
+    def test_zero_units(self):
+        self.assertMinifies('a { margin: 0px 0em 0% 10px; width: 10px; }', 'a{margin:0 0 0 10px;width:10px}')
+        self.assertMinifies('a { padding: 0px 0px; }', 'a{padding:0}')
+        self.assertMinifies('a { margin: 0 0 0 0; }', 'a{margin:0}')
+        self.assertMinifies('a { background-position: 0 0; }', 'a{background-position:0 0}')
+
+    def test_leading_zeros(self):
+        self.assertMinifies('a { opacity: 0.5; word-spacing: -0.125em; }', 'a{opacity:.5;word-spacing:-.125em}')
+
+    def test_colors(self):
+        self.assertMinifies('a { color: rgb(51, 102, 153); }', 'a{color:#369}')
+        self.assertMinifies('a { color: #AABBCC; background: #abcdef; }', 'a{color:#ABC;background:#abcdef}')
+
+    def test_hex_in_filters_is_kept(self):
+        self.assertMinifies('a { filter: chroma(color="#FFFFFF"); }', 'a{filter:chroma(color="#FFFFFF")}')
+
+    def test_border_none(self):
+        self.assertMinifies('a { border: none; outline: none; }', 'a{border:0;outline:0}')
+
+    def test_redundancies(self):
+        self.assertMinifies('a { b: c;; } .empty { } d { e: f; }', 'a{b:c}d{e:f}')
+
+    def test_charset_is_hoisted(self):
+        self.assertMinifies('a { b: c } @charset "utf-8";', '@charset "utf-8";a{b:c}')
+
+
+class CSSCorpusTests(unittest.TestCase):
+    """Run the minifier over the test stylesheets."""
+    def corpus(self):
+        return [fp for fp in CSS_MEDIA.walkfiles('*.css') if fp.bytes().strip()]
+
+    def test_corpus_is_smaller_and_stable(self):
+        for fp in self.corpus():
+            css = fp.bytes()
+            minified = minify_css(css)
+            self.assert_(len(minified) < len(css), fp)
+            self.assertEqual(minify_css(minified), minified, fp)
+            self.assertEqual(minified.count('{'), minified.count('}'), fp)
+
+    def test_corpus_strings_survive(self):
+        for fp in self.corpus():
+            css = re.sub(r'(?s)/\*.*?\*/', '', fp.bytes())
+            for string in re.findall(r'"[^"\n]*"', css):
+                self.assert_(string in minify_css(fp.bytes()), (fp, string))
+
+    @unittest.skipUnless(have_java(), 'java is not installed')
+    def test_corpus_matches_yui(self):
+        for fp in self.corpus():
+            process = subprocess.Popen('java -jar %s --type css' % managers.YUICOMPRESSOR, shell=True,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            expected = process.communicate(fp.bytes())[0]
+            # YUI 2.4.2 drops the space in `and (`, which breaks media queries.
+            expected = expected.replace(' and(', ' and (')
+            self.assertEqual(minify_css(fp.bytes()), expected, fp)
+
+
+class CSSEngineTests(ManagerTestCase):
+    manager_options = copy.deepcopy(AssetManagerTests.options)
+    del manager_options['build_path']
+    manager_options['css'].update(minify_cmd='stillness:css', version=False)
+
+    def test_engine_lookup(self):
+        self.assert_(get_engine('stillness:css') is minify_css)
+        self.assertEqual(get_engine('java -jar yuicompressor.jar'), None)
+
+    def test_build_with_engine(self):
+        assets = self.make_manager()
+        css_map = assets.options['css']['map']
+        css_map.combine_files()
+        for file_key in css_map:
+            sources = [assets.options['common_path'] / fk for fk in css_map[file_key]]
+            expected = minify_css(css_map._combine(*sources))
+            self.assertEqual((self.root / 'build' / file_key).bytes(), expected)
+
+    def test_streaming_build_with_engine(self):
+        self.make_manager().options['css']['map'].combine_files()
+        buffered = dict((fp.name, fp.bytes()) for fp in (self.root / 'build').walkfiles())
+        (self.root / 'build').rmtree()
+        self.make_manager(streaming=True).options['css']['map'].combine_files()
+        streamed = dict((fp.name, fp.bytes()) for fp in (self.root / 'build').walkfiles())
+        self.assertEqual(streamed, buffered)
+
+    def test_cache_key_names_engine_version(self):
+        assets = self.make_manager(minify_cache={'path': self.root / 'cache'})
+        self.assertEqual(assets.options['css']['map']._minifier_id(), 'stillness:css@1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""discovery_tests.py -- tests for asset discovery.
+"""
+import unittest
+import tempfile
+
+from stillness import managers
+from stillness.discovery import AssetFinder
+from stillness.path import path
+
+PATTERN = r'.+\.(png|gif)$'
+
+
+class AssetFinderTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        for fn in ('logo.png', 'notes.txt',
+                   'icons/a.png', 'icons/b.gif', 'icons/small/c.png',
+                   'photos/d.png', '.svn/e.png', 'photos/.svn/f.png'):
+            fp = self.root / fn
+            if not fp.parent.exists():
+                fp.parent.makedirs()
+            fp.write_bytes('x')
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def found(self, finder, **kwargs):
+        return [self.root.relpathto(fp) for fp in finder.find(self.root, **kwargs)]
+
+    def test_find_recursively(self):
+        self.assertEqual(self.found(AssetFinder(PATTERN)),
+                         ['logo.png', '.svn/e.png', 'icons/a.png', 'icons/b.gif',
+                          'icons/small/c.png', 'photos/d.png', 'photos/.svn/f.png'])
+
+    def test_matches_walkfilesRE(self):
+        self.assertEqual(set(AssetFinder(PATTERN).find(self.root)),
+                         set(self.root.walkfilesRE(PATTERN)))
+
+    def test_find_without_recursing(self):
+        self.assertEqual(self.found(AssetFinder(PATTERN, recurse=False)), ['logo.png'])
+
+    def test_exclude_dirs(self):
+        finder = AssetFinder(PATTERN, exclude_dirs=r'(^|/)\.svn$')
+        self.assertEqual(self.found(finder),
+                         ['logo.png', 'icons/a.png', 'icons/b.gif', 'icons/small/c.png', 'photos/d.png'])
+
+    def test_include_dirs(self):
+        finder = AssetFinder(PATTERN, include_dirs=r'^icons($|/)', exclude_dirs=r'small')
+        self.assertEqual(self.found(finder), ['logo.png', 'icons/a.png', 'icons/b.gif'])
+
+    def test_parallel_find_matches_serial_find(self):
+        finder = AssetFinder(PATTERN)
+        self.assertEqual(self.found(finder, jobs=4), self.found(finder))
+
+    def test_find_assets_compiles_finders_once(self):
+        assets = managers.AssetManager(common_path=self.root, assets={
+                'paths': (('icons', {}), ('photos', {'exclude_dirs': r'\.svn'})),
+                'default_options': {'pattern': PATTERN}})
+        self.assertEqual([self.root.relpathto(fp) for fp in assets.find_assets()],
+                         ['icons/a.png', 'icons/b.gif', 'icons/small/c.png', 'photos/d.png'])
+        list(assets.find_assets())
+        self.assertEqual(len(assets._asset_finders), 2)
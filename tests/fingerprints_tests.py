@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""fingerprints_tests.py -- tests for fingerprinted output filenames.
+"""
+import unittest
+import tempfile
+import os
+
+from stillness.fingerprints import fingerprinted_key, ObjectStore
+from stillness.path import path
+
+from tests import ManagerTestCase
+
+PNG = '\x89PNG\r\n\x1a\n' + 'pixels' * 20
+
+
+class FingerprintedKeyTests(unittest.TestCase):
+    def test_version_goes_before_the_extension(self):
+        self.assertEqual(fingerprinted_key('css/main.min.css', '1a2b3c4d'), 'css/main.min.1a2b3c4d.css')
+        self.assertEqual(fingerprinted_key('images/a.png', 'v'), 'images/a.v.png')
+        self.assertEqual(fingerprinted_key('LICENSE', 'v'), 'LICENSE.v')
+
+
+class ObjectStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        self.store = ObjectStore(self.root / 'objects')
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_identical_contents_are_stored_once(self):
+        (self.root / 'a').write_bytes('same')
+        (self.root / 'b').write_bytes('same')
+        one = self.store.link(self.root / 'a', self.root / 'out' / 'a.1.txt')
+        two = self.store.link(self.root / 'b', self.root / 'out' / 'b.1.txt')
+        self.assertEqual(one.bytes(), 'same')
+        self.assert_(os.path.samefile(one, two))
+        self.assertEqual(len(list((self.root / 'objects').walkfiles())), 1)
+
+    def test_prune_removes_unlinked_objects(self):
+        (self.root / 'a').write_bytes('a')
+        (self.root / 'b').write_bytes('b')
+        self.store.link(self.root / 'a', self.root / 'a.1')
+        self.store.link(self.root / 'b', self.root / 'b.1')
+        (self.root / 'a.1').remove()
+        self.assertEqual(self.store.prune(), 1)
+        self.assertEqual(len(list((self.root / 'objects').walkfiles())), 1)
+
+
+class FingerprintBuildTests(ManagerTestCase):
+    manager_options = dict(
+        debug = False,
+        base_urls = ['/media'],
+        delimiter = '\n',
+        fingerprint = dict(enabled = True, retain = 2),
+        assets = dict(paths = (('images', {}),)),
+        css = dict(map = {'css/all.css': ['css/a.css']}, minify_cmd = 'cat'),
+        js = dict(map = {'js/a.min.js': ['js/a.js'], 'js/b.min.js': ['js/b.js']}, minify_cmd = 'cat'),
+        )
+
+    def setUp(self):
+        super(FingerprintBuildTests, self).setUp()
+        media = self.media
+        (media / 'images').makedirs()
+        (media / 'css').makedirs()
+        (media / 'js').makedirs()
+        (media / 'images' / 'a.png').write_bytes(PNG)
+        (media / 'images' / 'b.png').write_bytes(PNG)
+        (media / 'css' / 'a.css').write_bytes('.a { background: url(../images/a.png); }\n')
+        (media / 'js' / 'a.js').write_bytes('var a = 1;\n')
+        (media / 'js' / 'b.js').write_bytes('var a = 1;\n')
+
+    def build(self, assets):
+        assets.version_assets()
+        assets.options['css']['map'].combine_files()
+        assets.options['js']['map'].combine_files()
+
+    def fingerprinted(self, pattern):
+        return sorted(self.build_path.relpathto(fp) for fp in self.build_path.walkfiles(pattern)
+                      if '.stillness-objects' not in fp)
+
+    def test_outputs_and_assets_are_fingerprinted(self):
+        assets = self.make_manager()
+        self.build(assets)
+        version = assets.versions['js/a.min.js']
+        out = self.build_path / 'js' / ('a.min.%s.js' % version)
+        self.assertEqual(out.bytes(), (self.build_path / 'js' / 'a.min.js').bytes())
+        self.assert_((self.build_path / 'images' / ('a.%s.png' % assets.versions['images/a.png'])).exists())
+
+    def test_identical_outputs_share_storage(self):
+        assets = self.make_manager()
+        self.build(assets)
+        a = self.build_path / assets.fingerprinted('js/a.min.js')
+        b = self.build_path / assets.fingerprinted('js/b.min.js')
+        self.assert_(os.path.samefile(a, b))
+        images = self.build_path / 'images'
+        self.assert_(os.path.samefile(images / assets.fingerprinted('images/a.png').split('/')[-1],
+                                      images / assets.fingerprinted('images/b.png').split('/')[-1]))
+
+    def test_urls(self):
+        assets = self.make_manager()
+        self.build(assets)
+        version = assets.versions['js/a.min.js']
+        self.assertEqual(assets.get_js_urls('js/a.min.js'), ['/media/js/a.min.%s.js' % version])
+        self.assertEqual(assets.get_css_urls('css/all.css'),
+                         ['/media/css/all.%s.css' % assets.versions['css/all.css']])
+        self.assertEqual(assets.get_asset_url('images/a.png'),
+                         '/media/images/a.%s.png' % assets.versions['images/a.png'])
+        self.assert_('/media/js/a.min.%s.js' % version in assets.get_js_html('js/a.min.js'))
+
+    def test_debug_urls_are_not_fingerprinted(self):
+        assets = self.make_manager()
+        self.build(assets)
+        assets.options['debug'] = True
+        self.assertEqual(assets.get_js_urls('js/a.min.js')[0].split('?')[0], '/media/js/a.js')
+
+    def test_css_references_fingerprinted_assets(self):
+        assets = self.make_manager()
+        self.build(assets)
+        css = (self.build_path / assets.fingerprinted('css/all.css')).bytes()
+        self.assert_('url(/media/images/a.%s.png)' % assets.versions['images/a.png'] in css, css)
+
+    def test_css_fingerprint_follows_its_assets(self):
+        self.build(self.make_manager())
+        first = self.fingerprinted('all.*.css')
+        (self.media / 'images' / 'a.png').write_bytes(PNG + 'changed')
+        self.build(self.make_manager())
+        after = self.fingerprinted('all.*.css')
+        self.assertEqual(len(after), 2)
+        self.assert_(first[0] in after)
+
+    def test_old_fingerprints_are_retained_then_removed(self):
+        for i in range(4):
+            (self.media / 'js' / 'a.js').write_bytes('var a = %d;\n' % i)
+            assets = self.make_manager(gzip=dict(enabled=True, min_size=0, min_ratio=10))
+            self.build(assets)
+        self.assertEqual(len(self.fingerprinted('a.min.*.js')), 2)
+        self.assertEqual(len(self.fingerprinted('a.min.*.js.gz')), 2)
+        self.assert_(assets.fingerprinted('js/a.min.js') in self.fingerprinted('a.min.*.js'))
+
+    def test_disabled(self):
+        assets = self.make_manager(fingerprint=dict(enabled=False))
+        self.build(assets)
+        self.assertEqual(self.fingerprinted('a.min.*.js'), [])
+        self.assertEqual(assets.get_js_urls('js/a.min.js'), ['/media/js/a.min.js'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""images_tests.py -- tests for lossless PNG recompression.
+"""
+import zlib
+import struct
+import unittest
+import tempfile
+
+from stillness import managers, images
+from stillness.path import path
+
+from tests import ManagerTestCase
+
+IMAGES = path(__file__).abspath().dirname() / 'media' / 'images'
+
+
+def make_png(width=16, height=8, extra_chunks=(), level=1):
+    """Return an RGB gradient PNG, unfiltered and lightly compressed.
+    """
+    lines = []
+    for y in range(height):
+        lines.append('\0' + ''.join(chr(x * 16 % 256) + chr(y * 32 % 256) + chr((x + y) % 256) for x in range(width)))
+    chunks = [images.write_chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))]
+    chunks.extend(images.write_chunk(chunk_type, body) for chunk_type, body in extra_chunks)
+    chunks.append(images.write_chunk('IDAT', zlib.compress(''.join(lines), level)))
+    chunks.append(images.write_chunk('IEND', ''))
+    return images.PNG_SIGNATURE + ''.join(chunks)
+
+
+def pixels(data):
+    chunks = images.read_chunks(data)
+    width, height, bit_depth, color_type, compression, filter_method, interlace = \
+        struct.unpack('>IIBBBBB', chunks[0][1])
+    filtered = zlib.decompress(''.join(body for chunk_type, body in chunks if chunk_type == 'IDAT'))
+    if interlace:
+        return filtered
+    bits = images.CHANNELS[color_type] * bit_depth
+    return [str(line) for line in images._unfilter(filtered, height, (width * bits + 7) // 8, max(1, bits // 8))]
+
+
+def chunk_types(data):
+    return [chunk_type for chunk_type, body in images.read_chunks(data)]
+
+
+class OptimizePNGTests(unittest.TestCase):
+    def test_pixels_are_unchanged(self):
+        for fp in IMAGES.files('*.png'):
+            data = fp.bytes()
+            optimized = images.optimize_png(data)
+            self.assert_(len(optimized) <= len(data), fp)
+            self.assertEqual(pixels(optimized), pixels(data), fp)
+
+    def test_smaller(self):
+        data = make_png()
+        optimized = images.optimize_png(data)
+        self.assert_(len(optimized) < len(data))
+        self.assertEqual(pixels(optimized), pixels(data))
+
+    def test_ancillary_chunks_are_stripped(self):
+        data = make_png(extra_chunks=[('tEXt', 'Comment\0hello'), ('gAMA', struct.pack('>I', 45455)),
+                                      ('tRNS', '\0\0\0\0\0\0')])
+        self.assertEqual(chunk_types(images.optimize_png(data)), ['IHDR', 'gAMA', 'tRNS', 'IDAT', 'IEND'])
+        self.assertEqual(chunk_types(images.optimize_png(data, keep_chunks=())), ['IHDR', 'tRNS', 'IDAT', 'IEND'])
+
+    def test_animated_pngs_are_left_alone(self):
+        data = make_png(extra_chunks=[('acTL', struct.pack('>II', 1, 0))])
+        self.assert_(images.optimize_png(data) is data)
+
+    def test_not_a_png(self):
+        self.assertRaises(images.PNGError, images.optimize_png, 'GIF89a')
+        corrupt = make_png()
+        corrupt = corrupt[:40] + chr(ord(corrupt[40]) ^ 1) + corrupt[41:]
+        self.assertRaises(images.PNGError, images.optimize_png, corrupt)
+
+    def test_optimize_png_file(self):
+        root = path(tempfile.mkdtemp())
+        try:
+            data = make_png()
+            (root / 'a.png').write_bytes(data)
+            (root / 'b.png').write_bytes('GIF89a')
+            file_key, bytes_in, bytes_out, failure = images.optimize_png_file(
+                ('a.png', root / 'a.png', root / 'out' / 'a.png', 9, ()))
+            optimized = (root / 'out' / 'a.png').bytes()
+            self.assertEqual((file_key, bytes_in, bytes_out, failure), ('a.png', len(data), len(optimized), None))
+            self.assertEqual(pixels(optimized), pixels(data))
+            self.assertEqual(images.optimize_png_file(('b.png', root / 'b.png', root / 'out' / 'b.png', 9, ())),
+                             ('b.png', 6, 6, None))
+            self.assertEqual((root / 'out' / 'b.png').bytes(), 'GIF89a')
+            file_key, bytes_in, bytes_out, failure = images.optimize_png_file(
+                ('c.png', root / 'c.png', root / 'out' / 'c.png', 9, ()))
+            self.assertEqual((bytes_in, bytes_out), (None, None))
+            self.assert_('IOError' in failure, failure)
+            self.assertEqual(sorted((root / 'out').listdir()), [root / 'out' / 'a.png', root / 'out' / 'b.png'])
+        finally:
+            root.rmtree()
+
+
+class OptimizeImagesTests(ManagerTestCase):
+    manager_options = dict(
+        images = dict(optimize = True, jobs = 2),
+        assets = dict(paths = (('.', {}),)),
+        )
+
+    def setUp(self):
+        super(OptimizeImagesTests, self).setUp()
+        media = self.media
+        (media / 'icons').makedirs()
+        (media / 'photos').makedirs()
+        (media / 'icons' / 'a.png').write_bytes(make_png())
+        (media / 'icons' / 'b.png').write_bytes(make_png(24, 24))
+        (media / 'photos' / 'c.png').write_bytes(make_png(32, 16, [('tEXt', 'Comment\0' + 'x' * 200)]))
+        (media / 'photos' / 'd.gif').write_bytes('GIF89a')
+        self.events = []
+
+    def make_manager(self, **options):
+        assets = super(OptimizeImagesTests, self).make_manager(**options)
+        assets.add_listener(self.events.append)
+        return assets
+
+    def test_version_assets(self):
+        assets = self.make_manager()
+        assets.version_assets()
+        build = self.root / 'build'
+        for file_key in ('icons/a.png', 'icons/b.png', 'photos/c.png'):
+            optimized = (build / file_key).bytes()
+            self.assert_(len(optimized) < (self.media / file_key).getsize(), file_key)
+            self.assertEqual(pixels(optimized), pixels((self.media / file_key).bytes()))
+        self.failIf((build / 'photos' / 'd.gif').exists())
+        report = assets.image_report
+        self.assertEqual(sorted(report), ['icons', 'photos'])
+        self.assertEqual(report['icons']['files'], 2)
+        self.assert_(report['photos']['bytes_in'] - report['photos']['bytes_out'] > 200)
+        self.assert_('photos' in images.format_report(report))
+
+    def test_errors_are_aggregated(self):
+        (self.media / 'icons' / 'many').makedirs()
+        file_keys = ['photos/c.png']
+        for i in range(6):
+            file_keys.append('icons/many/%d.png' % i)
+            (self.media / file_keys[-1]).write_bytes(make_png(8 + i, 8))
+        (self.root / 'build' / 'photos' / 'c.png').makedirs()  # Can't be replaced by a file.
+        assets = self.make_manager(images=dict(batch_size=2))
+        try:
+            assets.optimize_images(file_keys)
+        except managers.BuildError, e:
+            self.assertEqual(e.errors.keys(), ['photos/c.png'])
+        else:
+            self.fail('BuildError not raised.')
+        self.assertEqual(len((self.root / 'build' / 'icons' / 'many').files('*.png')), 6)
+        self.assertEqual(len(list((self.root / 'build' / '.stillness-images').walkfiles())), 6)
+
+    def test_results_are_cached(self):
+        self.make_manager().version_assets()
+        assets = self.make_manager(images=dict(jobs=1))
+        assets.version_assets()
+        ends = [e for e in self.events if e.stage == 'images' and e.phase == 'end']
+        self.assertEqual([e.cache_hit for e in ends], [False, True])
+
+    def test_fingerprints_are_optimized(self):
+        assets = self.make_manager(fingerprint=dict(enabled=True))
+        assets.version_assets()
+        build = self.root / 'build'
+        self.assertEqual((build / assets.fingerprinted('icons/a.png')).bytes(), (build / 'icons' / 'a.png').bytes())
+        self.assertEqual((build / assets.fingerprinted('photos/d.gif')).bytes(), 'GIF89a')
+
+    def test_disabled(self):
+        assets = self.make_manager(images=dict(optimize=False))
+        assets.version_assets()
+        self.failIf((self.root / 'build').exists())
+        self.assertEqual(assets.image_report, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""instruments_tests.py -- tests for build timing events and collectors.
+"""
+import unittest
+import tempfile
+from StringIO import StringIO
+
+from stillness import managers
+from stillness.instruments import TimingCollector
+from stillness.path import path
+
+
+class BuildEventTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        (self.root / 'media' / 'css').makedirs()
+        (self.root / 'media' / 'css' / 'a.css').write_bytes('a { color: red }\n')
+        self.assets = managers.AssetManager(
+            common_path = self.root / 'media',
+            build_path = self.root / 'build',
+            css = dict(map = {'all.css': ['css/a.css']}, minify_cmd = 'cat'),
+            )
+        self.events = []
+        self.assets.add_listener(self.events.append)
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_no_listeners(self):
+        self.assets.remove_listener(self.events.append)
+        self.assertEqual(self.assets.start_stage('bundle'), None)
+        self.assets.end_stage(None)
+
+    def test_stage_events(self):
+        self.assets.options['css']['map'].combine_files()
+        self.assertEqual([(e.phase, e.stage) for e in self.events], [
+                ('start', 'bundle'),
+                ('start', 'read'), ('end', 'read'),
+                ('start', 'minify'), ('end', 'minify'),
+                ('start', 'write'), ('end', 'write'),
+                ('end', 'bundle'),
+                ('start', 'version'),
+                ('start', 'hash'), ('end', 'hash'),
+                ('start', 'css_rewrite'), ('end', 'css_rewrite'),
+                ('end', 'version'),
+                ])
+        bundle = self.events[7]
+        self.assertEqual((bundle.kind, bundle.file_key), ('css', 'all.css'))
+        self.assertEqual(bundle.bytes, len('\n/* BEGIN a.css */\na { color: red }\n'))
+        self.assert_(bundle.duration >= 0)
+
+    def test_cache_hits_are_flagged(self):
+        self.assets.options['minify_cache']['path'] = self.root / 'cache'
+        self.assets.options['css']['map'].combine_files()
+        self.assets.options['css']['map'].combine_files()
+        minify = [e.cache_hit for e in self.events if e.stage == 'minify' and e.phase == 'end']
+        self.assertEqual(minify, [False, True])
+
+    def test_skipped_bundles_are_flagged(self):
+        self.assets.options['incremental'] = True
+        self.assets.options['css']['map'].combine_files()
+        del self.events[:]
+        self.assets.options['css']['map'].combine_files()
+        self.assertEqual([(e.phase, e.stage, e.cache_hit) for e in self.events],
+                         [('start', 'bundle', None), ('end', 'bundle', True)])
+
+    def test_errors_are_reported(self):
+        (self.root / 'media' / 'css' / 'a.css').remove()
+        self.assertRaises(managers.BuildError, self.assets.options['css']['map'].combine_files)
+        self.assertEqual(self.events[-1].stage, 'bundle')
+        self.assert_(isinstance(self.events[-1].error, IOError))
+
+    def test_timing_collector(self):
+        collector = TimingCollector()
+        self.assets.add_listener(collector)
+        self.assets.options['css']['map'].combine_files()
+        self.assertEqual(sorted(collector.stages),
+                         ['bundle', 'css_rewrite', 'hash', 'minify', 'read', 'version', 'write'])
+        self.assertEqual(collector.file_keys[('css', 'all.css')].count, 2)
+        stream = StringIO()
+        collector.report(stream)
+        self.assert_('css all.css' in stream.getvalue())
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""jsmin_tests.py -- tests for the in-process JavaScript minifier.
+"""
+import unittest
+import tempfile
+import subprocess
+
+from stillness.jsmin import minify_js, JSMinError
+from stillness.minifiers import get_engine
+from stillness.path import path
+
+JS_MEDIA = path(__file__).abspath().dirname() / 'media' / 'js'
+
+
+def node_check(filename):
+    """Return True if node parses the file, False if it doesn't, and None without node."""
+    try:
+        process = subprocess.Popen(['node', '--check', filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    process.communicate()
+    return process.returncode == 0
+
+
+class MinifyJSTests(unittest.TestCase):
+    def assertMinifies(self, js, expected):
+        self.assertEqual(minify_js(js), expected)
+
+    def test_whitespace_and_comments(self):
+        self.assertMinifies('// header\nvar a = 1 ; /* b */\nfunction f ( x ) {\n    return x * 2;\n}\n',
+                            'var a=1;function f(x){return x*2;}')
+
+    def test_preserved_comments(self):
+        self.assertMinifies('/*! License */\nvar a = 1;', '/*! License */\nvar a=1;')
+        self.assertMinifies('var a = /*@cc_on!@*/false;', 'var a=/*@cc_on!@*/\nfalse;')
+
+    def test_strings(self):
+        self.assertMinifies('var s = "a  // b" + \'c /* d */\';', 'var s="a  // b"+\'c /* d */\';')
+        self.assertMinifies('var s = "a \\" b";', 'var s="a \\" b";')
+        self.assertMinifies('var t = `a  ${ b }  c`;', 'var t=`a  ${ b }  c`;')
+
+    def test_regular_expressions(self):
+        self.assertMinifies('var r = / a [/] b /g;', 'var r=/ a [/] b /g;')
+        self.assertMinifies('return /\\/ "x/.test(s);', 'return/\\/ "x/.test(s);')
+        self.assertMinifies('x = a / b / c;', 'x=a/b/c;')
+        self.assertMinifies('x = (a) / 2 / (b);', 'x=(a)/2/(b);')
+        self.assertMinifies('a++ / 2 / b', 'a++/2/b')
+
+    def test_asi_newlines(self):
+        self.assertMinifies('a = b\n(c)', 'a=b\n(c)')
+        self.assertMinifies('return\nx', 'return\nx')
+        self.assertMinifies('a\n++b', 'a\n++b')
+        self.assertMinifies('a = [\n  1,\n  2\n];', 'a=[1,2];')
+        self.assertMinifies('if (a) {\n  b();\n}\nelse {\n  c();\n}', 'if(a){b();}\nelse{c();}')
+
+    def test_operators_stay_apart(self):
+        self.assertMinifies('a = b + +c - -d;', 'a=b+ +c- -d;')
+        self.assertMinifies('a = b + ++c;', 'a=b+ ++c;')
+        self.assertMinifies('a = 1 .toString();', 'a=1 .toString();')
+
+    def test_unterminated_string(self):
+        self.assertRaises(JSMinError, minify_js, 'var a = "abc\n";')
+
+    def test_engine(self):
+        self.assert_(get_engine('stillness:js') is minify_js)
+
+
+class JSCorpusTests(unittest.TestCase):
+    """Run the minifier over the test scripts."""
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def test_corpus_is_smaller_and_stable(self):
+        for fp in JS_MEDIA.walkfiles('*.js'):
+            js = fp.bytes()
+            minified = minify_js(js)
+            self.assert_(len(minified) < len(js), fp)
+            self.assertEqual(minify_js(minified), minified, fp)
+
+    def test_corpus_still_parses(self):
+        for fp in JS_MEDIA.walkfiles('*.js'):
+            out = self.root / fp.name
+            out.write_bytes(minify_js(fp.bytes()))
+            parsed = node_check(out)
+            if parsed is None:
+                return
+            self.assert_(parsed, fp)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,15 @@
 import unittest
 import itertools
 import time
+import copy
+import tempfile
 
 from stillness import managers
+from stillness.runtime import shard_base_url
 from stillness.path import path
 
+from tests import have_java, ManagerTestCase
+
 __path__ = path(__file__).abspath().dirname()
 
 
@@ -24,6 +29,44 @@ class FileMapTests(unittest.TestCase):
         self.assertEqual(self.test_map['foo'],
                          ['bar', 'phlegm', 'auto', 'blah', 'blaz', 'bizbar'])
 
+    def test_unmapped_key_is_empty(self):
+        self.assertEqual(self.test_map['nope'], [])
+
+    def test_include_order(self):
+        self.assertEqual(self.test_map.include_order(), ['biz', 'baz', 'foo'])
+
+    def test_expansion_is_recompiled_after_changes(self):
+        self.test_map['foo']
+        self.test_map['biz'] = ['blip']
+        self.assertEqual(self.test_map['foo'], ['bar', 'phlegm', 'auto', 'blip', 'bizbar'])
+        del self.test_map['biz']
+        self.assertEqual(self.test_map['foo'], ['bar', 'phlegm', 'auto', 'biz', 'bizbar'])
+        self.test_map.update(biz=['blop'])
+        self.assertEqual(self.test_map['baz'], ['phlegm', 'auto', 'blop'])
+
+    def test_expansion_cannot_be_modified_by_callers(self):
+        self.test_map['foo'].append('oops')
+        self.assertEqual(self.test_map['foo'][-1], 'bizbar')
+
+    def test_include_cycle_is_reported(self):
+        self.test_map['biz'] = ['blah', 'foo']
+        try:
+            self.test_map['foo']
+        except managers.IncludeCycleError, e:
+            self.assertEqual(e.cycle, ['baz', 'biz', 'foo', 'baz'])
+        else:
+            self.fail('IncludeCycleError not raised.')
+
+    def test_self_include_is_reported(self):
+        self.test_map['blah'] = ['blah']
+        self.assertRaises(managers.IncludeCycleError, self.test_map.__getitem__, 'blah')
+
+    def test_deep_include_chain(self):
+        depth = 5000
+        for i in range(depth):
+            self.test_map['level%d' % i] = ['level%d' % (i + 1)]
+        self.assertEqual(self.test_map['level0'], ['level%d' % depth])
+
 
 class AssetManagerTests(unittest.TestCase):
     def setUp(self):
@@ -97,13 +140,20 @@ class AssetManagerTests(unittest.TestCase):
         self.assertEqual(js_files, expected_js_files)
 
     def test_combine_files(self):
-        self.rmBuildPath()
-        self.assets.options['debug'] = False
-        self.assets.options['css']['map'].combine_files()
-        self.assets.options['js']['map'].combine_files()
-        for file_key in (self.assets.options['css']['map'].keys() + self.assets.options['js']['map'].keys()):
-            fp = (self.assets.options['build_path'] / file_key)
-            self.assert_(fp.exists())
+        # Build into a temporary directory, so running the tests leaves the tree clean.
+        self.assets.options['build_path'] = path(tempfile.mkdtemp())
+        try:
+            self.assets.options['debug'] = False
+            if not have_java():  # YUI can't run; build with the in-process engines instead.
+                self.assets.options['css']['minify_cmd'] = 'stillness:css'
+                self.assets.options['js']['minify_cmd'] = 'stillness:js'
+            self.assets.options['css']['map'].combine_files()
+            self.assets.options['js']['map'].combine_files()
+            for file_key in (self.assets.options['css']['map'].keys() + self.assets.options['js']['map'].keys()):
+                fp = (self.assets.options['build_path'] / file_key)
+                self.assert_(fp.exists())
+        finally:
+            self.assets.options['build_path'].rmtree()
 
     def test_derive_absolute_url_from_relative(self):
         base_url = '/media'
@@ -118,6 +168,28 @@ class AssetManagerTests(unittest.TestCase):
                 )
             self.assertEqual(abs_path, expected_abs_path)
         
+    def test_version_css_url_includes(self):
+        self.assets.options['debug'] = False
+        self.assets.versions['images/foo.png'] = 'abcdef12'
+        css_map = self.assets.options['css']['map']
+        css = ('a{background:url(../images/foo.png)}'
+               'b{background:url("../images/bar.gif#frag")}'
+               "c{background:url('/static/baz.jpg')}"
+               'd{background:url(http://example.com/x.png)}')
+        self.assertEqual(css_map._version_css_url_includes('css/main.min.css', css),
+                         'a{background:url(http://a.mycdn.org/media/images/foo.png?v=abcdef12)}'
+                         'b{background:url(http://b.mycdn.org/media/images/bar.gif#frag)}'
+                         'c{background:url(/static/baz.jpg)}'
+                         'd{background:url(http://example.com/x.png)}')
+
+    def test_version_css_url_includes_memoizes_urls(self):
+        self.assets.options['debug'] = False
+        css_map = self.assets.options['css']['map']
+        css = 'a{background:url(../images/foo.png)}' * 3
+        rewritten = css_map._version_css_url_includes('css/main.min.css', css)
+        self.assertEqual(rewritten.count('http://a.mycdn.org/media/images/foo.png'), 3)
+        self.assertEqual(css_map._css_urls.keys(), [('css', '../images/foo.png')])
+
     def test_get_css_asset_html_debug_is_true(self):
         return
         self.assets.options['debug'] = True
@@ -159,6 +231,80 @@ class AssetManagerTests(unittest.TestCase):
         js_html = self.assets.get_js_html(main_file_key)
         self.assertEqual(js_html, expected_js_html)
 
+    def test_css_html_is_cached_in_production(self):
+        self.assets.options['debug'] = False
+        main_file_key = 'css/main.min.css'
+        expected = ['<link rel="stylesheet" type="text/css" href="http://%s.mycdn.org/media/%s" media="print" />\n\n'
+                    % (x, main_file_key) for x in 'abcabc']
+        self.assertEqual([self.assets.get_css_html(main_file_key, media='print') for x in range(6)], expected)
+        self.assets._render_css_html = lambda *args: self.fail('Should be cached.')
+        self.assertEqual(self.assets.get_css_html(main_file_key, media='print'), expected[0])
+
+    def test_js_html_is_cached_in_production(self):
+        self.assets.options['debug'] = False
+        main_file_key = 'js/main.min.js'
+        expected = '<script type="text/javascript" charset="utf-8" src="http://a.mycdn.org/media/js/main.min.js"></script>\n\n'
+        self.assertEqual(self.assets.get_js_html(main_file_key), expected)
+        self.assets.base_url_iter = itertools.cycle(self.assets.options['base_urls'])
+        self.assets._render_js_html = lambda *args: self.fail('Should be cached.')
+        self.assertEqual(self.assets.get_js_html(main_file_key), expected)
+
+    def test_html_cache_is_reset_by_changes(self):
+        self.assets.options['debug'] = False
+        self.assets.options['base_urls'] = ['/media']
+        self.assets.base_url_iter = itertools.cycle(self.assets.options['base_urls'])
+        main_file_key = 'js/main.min.js'
+        self.assets.get_js_html(main_file_key)
+        self.assets.options['js']['html_defaults']['charset'] = 'latin-1'
+        self.assert_('charset="latin-1"' in self.assets.get_js_html(main_file_key))
+        rendered = []
+        render = self.assets._render_js_html
+        def _render_js_html(*args):
+            rendered.append(args)
+            return render(*args)
+        self.assets._render_js_html = _render_js_html
+        self.assets.versions['js/main.min.js'] = '12345678'
+        self.assets.get_js_html(main_file_key)
+        self.assets.options['js']['map']['js/other.min.js'] = ['js/core.js']
+        self.assets.get_js_html(main_file_key)
+        self.assertEqual(len(rendered), 2)
+
+    def test_hash_base_url_strategy(self):
+        self.assets.options['debug'] = False
+        self.assets.options['base_url_strategy'] = 'hash'
+        main_file_key = 'js/main.min.js'
+        url = self.assets.get_js_urls(main_file_key)[0]
+        self.assertEqual(url, '%s/%s' % (shard_base_url(self.assets.options['base_urls'], main_file_key),
+                                         main_file_key))
+        self.assertEqual(self.assets.get_js_urls(main_file_key), [url])
+        self.assert_(url in self.assets.get_js_html(main_file_key))
+        self.assert_(url in self.assets.get_js_html(main_file_key))
+        hosts = set(self.assets.get_asset_url('images/%d.png' % i).split('/')[2] for i in range(30))
+        self.assertEqual(len(hosts), 3)
+
+    def test_hash_base_url_strategy_debug_is_true(self):
+        self.assets.options['debug'] = True
+        self.assets.options['base_url_strategy'] = 'hash'
+        base_urls = self.assets.options['base_urls']
+        main_file_key = 'js/main.min.js'
+        expected_js_files = ['%s/%s?time=42' % (shard_base_url(base_urls, js), js)
+                             for js in self.assets.options['js']['map'][main_file_key]]
+        for i in range(3):
+            self.assertEqual(self.assets.get_js_urls(main_file_key), expected_js_files)
+            self.assertEqual(self.assets.get_asset_url('images/foo.png'),
+                             '%s/images/foo.png?time=42' % shard_base_url(base_urls, 'images/foo.png'))
+
+    def test_hash_base_url_strategy_rewrites_css(self):
+        self.assets.options['base_url_strategy'] = 'hash'
+        css_map = self.assets.options['css']['map']
+        for i in range(3):
+            self.assertEqual(css_map._derive_absolute_url_from_relative(None, 'css/core.css', '../images/foo.png'),
+                             '%s/images/foo.png?time=42' % shard_base_url(
+                                 self.assets.options['base_urls'], 'images/foo.png'))
+
+    def test_unknown_base_url_strategy(self):
+        self.assertRaises(ValueError, managers.AssetManager, base_url_strategy='random')
+
     options = dict(
         debug = True,
 
@@ -243,3 +389,283 @@ class AssetManagerTests(unittest.TestCase):
                 ),
             ),
         )
+
+
+class ParallelCombineFilesTests(unittest.TestCase):
+    def setUp(self):
+        self.build_path = path(tempfile.mkdtemp())
+        options = copy.deepcopy(AssetManagerTests.options)
+        options['build_path'] = self.build_path
+        options['css']['minify'] = options['js']['minify'] = False
+        options['css']['version'] = False
+        self.assets = managers.AssetManager(**options)
+
+    def tearDown(self):
+        self.build_path.rmtree()
+
+    def build(self, jobs):
+        self.assets.options['js']['map'].combine_files(jobs=jobs)
+        self.assets.options['css']['map'].combine_files(jobs=jobs)
+        built = {}
+        for fp in self.build_path.walkfiles():
+            built[self.build_path.relpathto(fp)] = fp.bytes()
+        return built, dict(self.assets.versions)
+
+    def test_parallel_build_matches_serial_build(self):
+        serial = self.build(jobs=1)
+        self.build_path.rmtree()
+        self.assets.versions.clear()
+        parallel = self.build(jobs=4)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(parallel[0]), 8)
+
+    def test_errors_are_aggregated(self):
+        js_map = self.assets.options['js']['map']
+        js_map['js/broken.min.js'] = ['js/missing.js']
+        js_map['js/also-broken.min.js'] = ['js/also-missing.js']
+        try:
+            js_map.combine_files(jobs=4)
+        except managers.BuildError, e:
+            self.assertEqual(sorted(e.errors), ['js/also-broken.min.js', 'js/broken.min.js'])
+        else:
+            self.fail('BuildError not raised.')
+        self.assert_((self.build_path / 'js/main.min.js').exists())
+        self.assert_('js/main.min.js' in self.assets.versions)
+
+    def test_minifier_errors_are_aggregated(self):
+        js = self.assets.options['js']
+        js['minify'] = True
+        js['minify_cmd'] = "awk '/Modernizr/ { failed = 3 } { print } END { exit failed }'"
+        js['map']['js/broken.min.js'] = ['js/missing.js']
+        try:
+            js['map'].combine_files(jobs=4)
+        except managers.BuildError, e:
+            self.assertEqual(sorted(e.errors), ['js/broken.min.js', 'js/modernizr.min.js'])
+            self.assert_('MinifyError' in e.errors['js/modernizr.min.js'])
+        else:
+            self.fail('BuildError not raised.')
+        self.failIf((self.build_path / 'js/modernizr.min.js').exists())
+        self.failIf('js/modernizr.min.js' in self.assets.versions)
+        self.assert_((self.build_path / 'js/main.min.js').exists())
+
+
+class IncrementalCombineFilesTests(ManagerTestCase):
+    manager_options = dict(
+        incremental = True,
+        js = dict(map = {'ab.js': ['js/a.js', 'js/b.js'],
+                         'c.js': ['js/c.js']},
+                  minify_cmd = 'cat'),
+        )
+
+    def setUp(self):
+        super(IncrementalCombineFilesTests, self).setUp()
+        (self.media / 'js').makedirs()
+        for name in ('a.js', 'b.js', 'c.js'):
+            (self.media / 'js' / name).write_bytes('var %s;\n' % name[0])
+        self.assets = self.make_manager()
+
+    def build(self, assets):
+        js_map = assets.options['js']['map']
+        built = []
+        original = js_map._build_file
+        def _build_file(file_key, *args):
+            built.append(file_key)
+            return original(file_key, *args)
+        js_map._build_file = _build_file
+        js_map.combine_files()
+        return sorted(built)
+
+    def test_unchanged_bundles_are_skipped(self):
+        self.assertEqual(self.build(self.assets), ['ab.js', 'c.js'])
+        versions = dict(self.assets.versions)
+
+        assets = self.make_manager()
+        self.assertEqual(self.build(assets), [])
+        self.assertEqual(dict(assets.versions), versions)
+
+    def test_changed_input_rebuilds_only_its_bundle(self):
+        self.build(self.assets)
+        (self.root / 'media' / 'js' / 'b.js').write_bytes('var bb;\n')
+        assets = self.make_manager()
+        self.assertEqual(self.build(assets), ['ab.js'])
+        self.assertNotEqual(assets.versions['ab.js'], self.assets.versions['ab.js'])
+
+    def test_changed_settings_rebuild(self):
+        self.build(self.assets)
+        assets = self.make_manager(delimiter='\n// %(name)s\n')
+        self.assertEqual(self.build(assets), ['ab.js', 'c.js'])
+
+    def test_new_engine_version_rebuilds(self):
+        engine = managers.get_engine('stillness:js')
+        engine_id = engine.engine_id
+        options = dict(js=dict(minify_sources={'js/c.js': 'stillness:js'}))
+        self.assertEqual(self.build(self.make_manager(**options)), ['ab.js', 'c.js'])
+        try:
+            engine.engine_id = 'stillness:js@bumped'
+            self.assertEqual(self.build(self.make_manager(**options)), ['ab.js', 'c.js'])
+            self.assertEqual(self.build(self.make_manager(js=dict(minify_cmd='stillness:js'))), ['ab.js', 'c.js'])
+            self.assertEqual(self.build(self.make_manager(js=dict(minify_cmd='stillness:js'))), [])
+            engine.engine_id = 'stillness:js@bumped again'
+            self.assertEqual(self.build(self.make_manager(js=dict(minify_cmd='stillness:js'))), ['ab.js', 'c.js'])
+        finally:
+            engine.engine_id = engine_id
+
+    def test_missing_output_rebuilds(self):
+        self.build(self.assets)
+        (self.root / 'build' / 'c.js').remove()
+        self.assertEqual(self.build(self.make_manager()), ['c.js'])
+
+    def assertChangedAssetRebuilds(self, fingerprint):
+        media = self.root / 'media'
+        (media / 'images').makedirs()
+        (media / 'images' / 'a.png').write_bytes('one')
+        (media / 'css').makedirs()
+        (media / 'css' / 'a.css').write_bytes('.a { background: url(../images/a.png) }\n')
+        def build():
+            assets = self.make_manager(
+                debug = False,
+                assets = dict(paths = (('images', {}),)),
+                fingerprint = dict(enabled = fingerprint),
+                css = dict(map = {'css/all.css': ['css/a.css']}, minify_cmd = 'cat'))
+            assets.version_assets()
+            css_map = assets.options['css']['map']
+            built = []
+            original = css_map._build_file
+            def _build_file(file_key, *args):
+                built.append(file_key)
+                return original(file_key, *args)
+            css_map._build_file = _build_file
+            css_map.combine_files()
+            return assets, built
+        build()
+        (media / 'images' / 'a.png').write_bytes('two')
+        assets, built = build()
+        self.assertEqual(built, ['css/all.css'])
+        css = (self.root / 'build' / 'css' / 'all.css').bytes()
+        if fingerprint:
+            self.assert_(assets.fingerprinted('images/a.png') in css, css)
+        else:
+            self.assert_(assets.versions['images/a.png'] in css, css)
+        self.assertEqual(build()[1], [])
+
+    def test_failed_css_rewrite_leaves_the_output_whole(self):
+        (self.root / 'media' / 'css').makedirs()
+        (self.root / 'media' / 'css' / 'a.css').write_bytes('.a { background: url(../images/a.png) }\n')
+        assets = self.make_manager(debug=False, base_urls=[],
+                                   css=dict(map={'css/all.css': ['css/a.css']}, minify_cmd='cat'))
+        self.assertRaises(managers.BuildError, assets.options['css']['map'].combine_files)
+        self.assert_('url(../images/a.png)' in (self.root / 'build' / 'css' / 'all.css').bytes())
+        self.assertEqual((self.root / 'build' / 'css').listdir('*.tmp'), [])
+        self.failIf('css/all.css' in assets.get_build_manifest())
+
+    def test_changed_asset_rebuilds_the_stylesheet(self):
+        self.assertChangedAssetRebuilds(fingerprint=False)
+
+    def test_changed_asset_rebuilds_the_fingerprinted_stylesheet(self):
+        self.assertChangedAssetRebuilds(fingerprint=True)
+
+
+class StreamingCombineFilesTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        options = copy.deepcopy(AssetManagerTests.options)
+        options['css']['minify_cmd'] = options['js']['minify_cmd'] = 'tr a-z A-Z'
+        options['css']['version'] = False
+        options['chunk_size'] = 1024
+        self.options = options
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def build(self, name, **options):
+        kwargs = copy.deepcopy(self.options)
+        kwargs['build_path'] = self.root / name
+        managers.merge_dictionary(kwargs, options)
+        assets = self.assets = managers.AssetManager(**kwargs)
+        assets.options['js']['map'].combine_files()
+        assets.options['css']['map'].combine_files()
+        built = {}
+        for fp in kwargs['build_path'].walkfiles():
+            built[kwargs['build_path'].relpathto(fp)] = fp.bytes()
+        return built, dict(assets.versions)
+
+    def test_streaming_matches_buffered_build(self):
+        buffered = self.build('buffered')
+        streamed = self.build('streamed', streaming=True)
+        self.assertEqual(streamed, buffered)
+        self.assertEqual(len(streamed[1]), 4)
+
+    def test_streaming_without_minifying(self):
+        buffered = self.build('buffered', js={'minify': False})
+        streamed = self.build('streamed', streaming=True, js={'minify': False})
+        self.assertEqual(streamed, buffered)
+
+    def test_streaming_with_minify_cache(self):
+        cache = {'path': self.root / 'cache'}
+        first = self.build('first', streaming=True, minify_cache=cache)
+        cached = self.build('cached', streaming=True, minify_cache=cache)
+        self.assertEqual(cached, first)
+        self.assertEqual(self.assets.get_minify_cache().stats(), dict(hits=8, misses=0, evictions=0))
+
+    def test_failed_stream_leaves_no_output(self):
+        kwargs = copy.deepcopy(self.options)
+        kwargs['build_path'] = self.root / 'broken'
+        kwargs['streaming'] = True
+        kwargs['js']['map'] = {'js/broken.min.js': ['js/core.js', 'js/missing.js']}
+        assets = managers.AssetManager(**kwargs)
+        self.assertRaises(managers.BuildError, assets.options['js']['map'].combine_files)
+        self.assertEqual(kwargs['build_path'].listdir('js/*'), [])
+        self.assertEqual(list((kwargs['build_path'] / 'js').walkfiles()), [])
+
+
+class SourceMinifierTests(unittest.TestCase):
+    vendor = 'v.f=function(a){return a*2};' * 40
+
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        (self.root / 'media' / 'vendor').makedirs()
+        (self.root / 'media' / 'a.js').write_bytes('var a = 1;\n')
+        (self.root / 'media' / 'b.js').write_bytes('var b = 2;\n')
+        (self.root / 'media' / 'vendor' / 'v.min.js').write_bytes(self.vendor)
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def build(self, name='build', **options):
+        kwargs = dict(
+            common_path = self.root / 'media',
+            build_path = self.root / name,
+            js = dict(map = {'all.js': ['a.js', 'vendor/v.min.js', 'b.js']},
+                      minify_cmd = 'tr a-z A-Z', version = False),
+            )
+        managers.merge_dictionary(kwargs, options)
+        assets = managers.AssetManager(**kwargs)
+        minified = []
+        assets.add_listener(lambda e: e.phase == 'end' and e.stage == 'minify' and minified.append(e))
+        assets.options['js']['map'].combine_files()
+        self.minify_calls = len(minified)
+        return (self.root / name / 'all.js').bytes()
+
+    def test_skip_minified_passes_vendor_files_through(self):
+        built = self.build(js={'skip_minified': True})
+        self.assertEqual(built, '\n/* BEGIN A.JS */\nVAR A = 1;\n\n' + self.vendor + '\n\n/* BEGIN B.JS */\nVAR B = 2;\n')
+        self.assertEqual(self.minify_calls, 2)
+
+    def test_without_overrides_bundles_minify_at_once(self):
+        built = self.build()
+        self.assert_(self.vendor.upper() in built)
+        self.assertEqual(self.minify_calls, 1)
+
+    def test_source_rules(self):
+        built = self.build(js={'minify_sources': [('vendor/*', None), ('b.js', 'stillness:js')]})
+        self.assertEqual(built, '\n/* BEGIN A.JS */\nVAR A = 1;\n\n' + self.vendor + '\nvar b=2;')
+
+    def test_only_minified_sources_never_shell_out(self):
+        (self.root / 'media' / 'a.js').write_bytes(self.vendor)
+        self.build(js={'skip_minified': True, 'map': {'all.js': ['a.js', 'vendor/v.min.js']}})
+        self.assertEqual(self.minify_calls, 0)
+
+    def test_streaming_matches_buffered_build(self):
+        options = {'js': {'skip_minified': True, 'minify_sources': {'b.js': 'stillness:js'}}}
+        self.assertEqual(self.build('streamed', streaming=True, **copy.deepcopy(options)), self.build(**options))
+
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""minifiers_tests.py -- tests for the resident minifier services.
+"""
+import unittest
+import sys
+import subprocess
+
+from stillness import managers
+from stillness import minifiers
+from stillness.path import path
+
+from tests import have_java
+
+UPPERCASE_WORKER = '%s -m stillness.minifiers tr a-z A-Z' % sys.executable
+FAILING_WORKER = '%s -m stillness.minifiers false' % sys.executable
+
+
+class MinifierServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.service = minifiers.MinifierService(UPPERCASE_WORKER, workers=2)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_minify_reuses_worker(self):
+        self.assertEqual(self.service.minify('foo'), 'FOO')
+        worker = [w for w in self.service._all if w.alive][0]
+        pid = worker.process.pid
+        self.assertEqual(self.service.minify('bar'), 'BAR')
+        self.assertEqual(worker.process.pid, pid)
+
+    def test_minify_empty_and_framing_characters(self):
+        self.assertEqual(self.service.minify(''), '')
+        self.assertEqual(self.service.minify('3:a,b,\n'), '3:A,B,\n')
+
+    def test_restart_after_crash(self):
+        self.service.minify('foo')
+        for worker in self.service._all:
+            if worker.alive:
+                worker.process.kill()
+                worker.process.wait()
+        self.assertEqual(self.service.minify('baz'), 'BAZ')
+
+    def test_error_frame_raises(self):
+        service = minifiers.MinifierService(FAILING_WORKER)
+        try:
+            self.assertRaises(minifiers.MinifyError, service.minify, 'foo')
+        finally:
+            service.shutdown()
+
+    def test_shutdown_stops_workers(self):
+        self.service.minify('foo')
+        processes = [w.process for w in self.service._all if w.alive]
+        self.service.shutdown()
+        for process in processes:
+            self.assertNotEqual(process.poll(), None)
+
+
+class FileMapMinifierServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.manager = managers.AssetManager(css={'minify_service_cmd': UPPERCASE_WORKER})
+
+    def tearDown(self):
+        self.manager.shutdown_minifiers()
+
+    def test_minify_text_uses_shared_service(self):
+        css_map = self.manager.options['css']['map']
+        self.assertEqual(css_map._minify_text('a { color: red }'), 'A { COLOR: RED }')
+        other_map = managers.FileMap(self.manager, 'css', {})
+        other_map._minify_text('b')
+        self.assertEqual(self.manager.minifier_services.keys(), [UPPERCASE_WORKER])
+
+
+class YUIWorkerTests(unittest.TestCase):
+    media = path(__file__).abspath().dirname() / 'media'
+
+    def test_command(self):
+        command = minifiers.yui_worker_command('css', charset='latin-1')
+        self.assert_(command.startswith('java -cp %s ' % managers.YUICOMPRESSOR), command)
+        self.assert_(command.endswith('YUIWorker.java css latin-1'), command)
+        self.assert_(path(minifiers.YUI_WORKER).exists())
+        self.assertRaises(ValueError, minifiers.yui_worker_command, 'html')
+
+    @unittest.skipUnless(have_java(), 'java is not installed')
+    def test_matches_the_command_line(self):
+        for kind, fp in (('css', self.media / 'css' / '_print' / 'core.css'), ('js', self.media / 'js' / 'core.js')):
+            process = subprocess.Popen('java -jar %s --type %s' % (managers.YUICOMPRESSOR, kind), shell=True,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            expected = process.communicate(fp.bytes())[0]
+            service = minifiers.MinifierService(minifiers.yui_worker_command(kind))
+            try:
+                self.assertEqual(service.minify(fp.bytes()), expected)
+                if kind == 'js':
+                    self.assertRaises(minifiers.MinifyError, service.minify, 'var = ;')
+            finally:
+                service.shutdown()
+
+
+class LooksMinifiedTests(unittest.TestCase):
+    js = path(__file__).abspath().dirname() / 'media' / 'js'
+
+    def test_minified_vendor_files(self):
+        for name in ('modernizr-1.5.js', '_jquery/jquery.1.4.2.js'):
+            self.assert_(minifiers.looks_minified((self.js / name).bytes()), name)
+
+    def test_hand_written_files(self):
+        for name in ('underscore.js', 'backbone.js', '_jquery/json2.js', '_hyphenator/Hyphenator.js'):
+            self.failIf(minifiers.looks_minified((self.js / name).bytes()), name)
+
+    def test_small_files_are_never_minified(self):
+        self.failIf(minifiers.looks_minified('var a=1;'))
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""runtime_tests.py -- tests for serving asset URLs and HTML without the build machinery.
+"""
+import os
+import sys
+import unittest
+import tempfile
+import subprocess
+
+from stillness import managers, runtime
+from stillness.path import path
+
+from tests import ManagerTestCase
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+class AssetResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        media = self.root / 'media'
+        (media / 'js').makedirs()
+        (media / 'css').makedirs()
+        (media / 'images').makedirs()
+        (media / 'js' / 'a.js').write_bytes('var a;')
+        (media / 'css' / 'a.css').write_bytes('.a { color: red }')
+        (media / 'images' / 'a.png').write_bytes('png')
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def build(self, fingerprint, base_url_strategy='cycle'):
+        assets = managers.AssetManager(
+            debug = False,
+            common_path = self.root / 'media',
+            build_path = self.root / 'build',
+            base_urls = ['//a.example.com', '//b.example.com'],
+            base_url_strategy = base_url_strategy,
+            version_manifest = 'versions.bin',
+            fingerprint = dict(enabled = fingerprint),
+            assets = dict(paths = (('images', {}),)),
+            css = dict(map = {'css/all.css': ['css/a.css']}, minify_cmd = 'cat'),
+            js = dict(map = {'js/all.js': ['js/a.js']}, minify_cmd = 'cat'),
+            )
+        assets.version_assets()
+        assets.options['css']['map'].combine_files()
+        assets.options['js']['map'].combine_files()
+        resolver = runtime.load(self.root / 'build' / 'versions.bin',
+                                base_urls=assets.options['base_urls'], fingerprint=fingerprint,
+                                base_url_strategy=base_url_strategy)
+        return assets, resolver
+
+    def assertSameAnswers(self, assets, resolver):
+        self.assertEqual(resolver.get_asset_url('images/a.png'), assets.get_asset_url('images/a.png'))
+        self.assertEqual(resolver.get_css_urls('css/all.css'), assets.get_css_urls('css/all.css'))
+        self.assertEqual(resolver.get_js_urls('js/all.js'), assets.get_js_urls('js/all.js'))
+        self.assertEqual(resolver.get_css_html('css/all.css', media='screen', title='Main'),
+                         assets.get_css_html('css/all.css', media='screen', title='Main'))
+        self.assertEqual(resolver.get_js_html('js/all.js', charset='latin-1'),
+                         assets.get_js_html('js/all.js', charset='latin-1'))
+
+    def test_matches_the_manager(self):
+        assets, resolver = self.build(fingerprint=False)
+        self.assertSameAnswers(assets, resolver)
+        self.assertEqual(resolver.get_js_urls('js/all.js'), ['//b.example.com/js/all.js'])
+
+    def test_matches_the_manager_with_fingerprints(self):
+        assets, resolver = self.build(fingerprint=True)
+        self.assertSameAnswers(assets, resolver)
+        self.assert_(assets.versions['js/all.js'] in resolver.get_js_html('js/all.js'))
+
+    def test_matches_the_manager_with_hashed_base_urls(self):
+        assets, resolver = self.build(fingerprint=True, base_url_strategy='hash')
+        self.assertSameAnswers(assets, resolver)
+        self.assertEqual(resolver.get_js_urls('js/all.js'), resolver.get_js_urls('js/all.js'))
+
+    def test_shard_base_url_is_stable(self):
+        base_urls = ['//a.example.com', '//b.example.com', '//c.example.com']
+        self.assertEqual(runtime.shard_base_url(base_urls, 'images/a.png'), '//c.example.com')
+        self.assertEqual(runtime.shard_base_url(base_urls, 'css/all.css'), '//b.example.com')
+
+    def test_fragments_follow_a_new_build(self):
+        assets, resolver = self.build(fingerprint=True)
+        before = resolver.get_js_html('js/all.js', delimiter='')
+        resolver.get_js_html('js/all.js', delimiter='')
+        (self.root / 'media' / 'js' / 'a.js').write_bytes('var b;')
+        assets, ignored = self.build(fingerprint=True)
+        resolver.refresh()
+        resolver.get_js_html('js/all.js', delimiter='')
+        after = resolver.get_js_html('js/all.js', delimiter='')
+        self.assertNotEqual(before, after)
+        self.assert_(assets.versions['js/all.js'] in after)
+
+
+class HTMLManifestTests(ManagerTestCase):
+    manager_options = dict(
+        debug = False,
+        base_urls = ['//a.example.com', '//b.example.com', '//c.example.com'],
+        base_url_strategy = 'cycle',
+        version_manifest = 'versions.bin',
+        html_manifest = 'html.json',
+        fingerprint = dict(enabled = True),
+        css = dict(map = {'css/all.css': ['css/a.css']}, minify_cmd = 'cat',
+                   html_variants = [{}, {'media': 'print'}]),
+        js = dict(map = {'js/all.js': ['js/a.js']}, minify_cmd = 'cat'),
+        )
+
+    def setUp(self):
+        super(HTMLManifestTests, self).setUp()
+        media = self.media
+        (media / 'js').makedirs()
+        (media / 'css').makedirs()
+        (media / 'js' / 'a.js').write_bytes('var a;')
+        (media / 'css' / 'a.css').write_bytes('.a { color: red }')
+        self.render_css_html = runtime.render_css_html
+        self.render_js_html = runtime.render_js_html
+
+    def tearDown(self):
+        runtime.render_css_html = self.render_css_html
+        runtime.render_js_html = self.render_js_html
+        super(HTMLManifestTests, self).tearDown()
+
+    def build(self, base_url_strategy='cycle'):
+        assets = self.make_manager(base_url_strategy=base_url_strategy)
+        assets.options['css']['map'].combine_files()
+        assets.options['js']['map'].combine_files()
+        return assets
+
+    def load(self, assets):
+        return runtime.load(self.root / 'build' / 'versions.bin', base_urls=assets.options['base_urls'],
+                            base_url_strategy=assets.options['base_url_strategy'], fingerprint=True,
+                            html_manifest=self.root / 'build' / 'html.json')
+
+    def forbid_rendering(self):
+        def render(*args):
+            self.fail('Should come from the manifest.')
+        runtime.render_css_html = runtime.render_js_html = render
+
+    def assertLookedUp(self, base_url_strategy):
+        assets = self.build(base_url_strategy)
+        resolver = self.load(assets)
+        expected = [assets.get_css_html('css/all.css', media='print') for i in range(3)]
+        expected.append(assets.get_js_html('js/all.js'))
+        self.forbid_rendering()
+        actual = [resolver.get_css_html('css/all.css', media='print') for i in range(3)]
+        actual.append(resolver.get_js_html('js/all.js'))
+        self.assertEqual(actual, expected)
+
+    def test_tags_are_looked_up(self):
+        self.assertLookedUp('cycle')
+
+    def test_tags_are_looked_up_with_hashed_base_urls(self):
+        self.assertLookedUp('hash')
+
+    def test_manager_looks_tags_up(self):
+        assets = self.build()
+        expected = assets.get_css_html('css/all.css')
+        worker = self.make_manager()
+        worker.load_version_manifest()
+        worker.load_html_manifest()
+        worker._render_css_html = lambda *args: self.fail('Should come from the manifest.')
+        self.assertEqual(worker.get_css_html('css/all.css'), expected)
+
+    def test_other_arguments_are_rendered(self):
+        assets = self.build()
+        resolver = self.load(assets)
+        self.assertEqual(resolver.get_css_html('css/all.css', media='screen'),
+                         assets.get_css_html('css/all.css', media='screen'))
+
+    def test_manifest_for_other_settings_is_ignored(self):
+        self.build()
+        worker = self.make_manager()
+        worker.options['js']['html_defaults']['charset'] = 'latin-1'
+        worker.load_version_manifest()
+        self.assertEqual(worker.load_html_manifest().fragments, {})
+        self.assert_('charset="latin-1"' in worker.get_js_html('js/all.js'))
+
+    def test_manifest_follows_a_new_build(self):
+        resolver = self.load(self.build())
+        before = resolver.get_js_html('js/all.js')
+        (self.root / 'media' / 'js' / 'a.js').write_bytes('var b;')
+        assets = self.build()
+        resolver.refresh()
+        self.forbid_rendering()
+        after = resolver.get_js_html('js/all.js')
+        self.assertNotEqual(before, after)
+        self.assert_(assets.fingerprinted('js/all.js') in after)
+
+
+class ImportTests(unittest.TestCase):
+    def test_runtime_does_not_import_the_build_machinery(self):
+        script = ('import sys; import stillness.runtime; '
+                  'print " ".join(sorted(name for name in sys.modules if sys.modules[name] is not None))')
+        process = subprocess.Popen([sys.executable, '-c', script], cwd=ROOT, stdout=subprocess.PIPE)
+        modules = process.communicate()[0].split()
+        self.assertEqual(process.returncode, 0)
+        self.assert_('stillness.runtime' in modules)
+        for name in ('stillness.managers', 'stillness.versioners', 'stillness.path', 'subprocess', 'threading'):
+            self.failIf(name in modules, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""versioners_tests.py -- tests for the Versions map.
+"""
+import unittest
+import tempfile
+import hashlib
+
+from stillness.versioners import Versions, StatCache, MappedVersions
+from stillness import managers
+from stillness.path import path
+
+
+class VersionsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = path(tempfile.mkdtemp())
+        self.contents = 'line one\r\nline two\r\n' + ''.join(chr(i) for i in range(256)) * 100
+        (self.directory / 'asset.js').write_bytes(self.contents)
+        self.versions = Versions()
+        self.versions.buffer_size = 1000
+
+    def tearDown(self):
+        self.directory.rmtree()
+
+    def test_sha1sum_hashes_bytes_on_disk(self):
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.js')
+        self.assertEqual(self.versions['asset.js'], hashlib.sha1(self.contents).hexdigest()[:8])
+
+    def test_md5sum_hashes_bytes_on_disk(self):
+        self.versions.mapVersions('MD5Sum', self.directory, 'asset.js')
+        self.assertEqual(self.versions['asset.js'], hashlib.md5(self.contents).hexdigest()[:8])
+
+    def test_mmap_matches_buffered_reads(self):
+        buffered = self.versions.SHA1Sum(self.directory / 'asset.js')
+        self.versions.mmap_threshold = 1
+        self.assertEqual(self.versions.SHA1Sum(self.directory / 'asset.js'), buffered)
+
+    def test_empty_file(self):
+        (self.directory / 'empty.js').write_bytes('')
+        self.versions.mmap_threshold = 0
+        self.assertEqual(self.versions.SHA1Sum(self.directory / 'empty.js'),
+                         hashlib.sha1('').hexdigest()[:8])
+
+
+class StatCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = path(tempfile.mkdtemp())
+        self.asset = self.directory / 'asset.png'
+        self.asset.write_bytes('png')
+        self.asset.utime((1000, 1000))
+        self.versions = Versions()
+        self.versions.stat_cache = StatCache(self.directory / 'stat.json')
+        self.hashed = []
+        original = self.versions.hashFile
+        def hashFile(hasher, filename):
+            self.hashed.append(filename)
+            return original(hasher, filename)
+        self.versions.hashFile = hashFile
+
+    def tearDown(self):
+        self.directory.rmtree()
+
+    def test_unchanged_file_is_not_rehashed(self):
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.versions.saveStatCache()
+        versions = Versions()
+        versions.stat_cache = StatCache(self.directory / 'stat.json')
+        versions.hashFile = lambda hasher, filename: self.fail('Should not hash.')
+        versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.assertEqual(versions['asset.png'], self.versions['asset.png'])
+        self.assertEqual(len(self.hashed), 1)
+
+    def test_changed_file_is_rehashed(self):
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.asset.write_bytes('gif')
+        self.asset.utime((2000, 2000))
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.assertEqual(self.versions['asset.png'], hashlib.sha1('gif').hexdigest()[:8])
+        self.assertEqual(len(self.hashed), 2)
+
+    def test_methods_are_cached_separately(self):
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.versions.mapVersions('MD5Sum', self.directory, 'asset.png')
+        self.assertEqual(self.versions['asset.png'], hashlib.md5('png').hexdigest()[:8])
+
+    def test_recently_modified_file_is_not_cached(self):
+        self.asset.touch()
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.versions.mapVersions('SHA1Sum', self.directory, 'asset.png')
+        self.assertEqual(len(self.hashed), 2)
+
+
+class MappedVersionsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = path(tempfile.mkdtemp())
+        self.filename = self.directory / 'versions.bin'
+        self.versions = Versions()
+        for i in range(1000):
+            self.versions['images/%04d.png' % i] = '%08x' % (i * 7919)
+        self.versions[u'images/caf\xe9.png'] = u'v\xe9'
+        self.versions.writeBinary(self.filename)
+
+    def tearDown(self):
+        self.directory.rmtree()
+
+    def test_lookups(self):
+        mapped = MappedVersions(self.filename)
+        self.assertEqual(len(mapped), len(self.versions))
+        for key, value in self.versions.items():
+            self.assertEqual(mapped[key], value)
+        self.assertEqual(mapped.get(u'images/caf\xe9.png'), u'v\xe9')
+        self.assertEqual(mapped.get('images/missing.png'), None)
+        self.failIf('images/1000.png' in mapped)
+        self.assertRaises(KeyError, lambda: mapped[''])
+        self.assertEqual(dict(mapped.iteritems()), dict(self.versions))
+        mapped.close()
+
+    def test_empty(self):
+        Versions().writeBinary(self.filename)
+        mapped = MappedVersions(self.filename)
+        self.assertEqual(len(mapped), 0)
+        self.assertEqual(mapped.get('a'), None)
+
+    def test_read_binary(self):
+        self.assertEqual(Versions().readBinary(self.filename), self.versions)
+
+    def test_not_a_version_map(self):
+        self.filename.write_bytes('{"a": "b"}')
+        self.assertRaises(ValueError, MappedVersions, self.filename)
+
+    def test_refresh_picks_up_a_new_build(self):
+        mapped = MappedVersions(self.filename)
+        self.failIf(mapped.refresh())
+        self.versions['images/0000.png'] = 'changed'
+        self.versions.writeBinary(self.filename)
+        self.assertEqual(mapped['images/0000.png'], '00000000')
+        self.assert_(mapped.refresh())
+        self.assertEqual(mapped['images/0000.png'], 'changed')
+        self.assertEqual(mapped.generation, 1)
+
+    def test_manager_writes_and_serves_the_map(self):
+        media = self.directory / 'media'
+        (media / 'js').makedirs()
+        (media / 'js' / 'a.js').write_bytes('var a;')
+        options = dict(debug=False, common_path=media, build_path=self.directory / 'build',
+                       base_urls=['/media'], version_manifest='versions.bin', fingerprint=dict(enabled=True),
+                       js=dict(map={'js/all.js': ['js/a.js']}, minify_cmd='cat'))
+        builder = managers.AssetManager(**options)
+        builder.options['js']['map'].combine_files()
+        worker = managers.AssetManager(**options)
+        worker.load_version_manifest()
+        self.assertEqual(worker.get_js_urls('js/all.js'), ['/media/js/all.%s.js' % builder.versions['js/all.js']])
+        self.assertEqual(dict(worker.versions), dict(builder.versions))
+
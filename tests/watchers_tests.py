@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""watchers_tests.py -- tests for watch mode.
+"""
+import unittest
+import tempfile
+
+from stillness import managers
+from stillness.watchers import Watcher
+from stillness.path import path
+
+
+class WatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.root = path(tempfile.mkdtemp())
+        (self.root / 'media' / 'js').makedirs()
+        for name in ('a.js', 'b.js', 'c.js'):
+            self.write(name, 'var %s;\n' % name[0])
+        self.assets = managers.AssetManager(
+            common_path = self.root / 'media',
+            build_path = self.root / 'build',
+            js = dict(map = {'ab.js': ['js/a.js', 'js/b.js'],
+                             'all.js': ['ab.js', 'js/c.js'],
+                             'c.js': ['js/c.js']},
+                      minify = False),
+            )
+        self.assets.options['js']['map'].combine_files()
+        self.builds = []
+        self.errors = []
+        self.watcher = Watcher(self.assets, debounce=0, use_inotify=False,
+                               on_build=lambda affected, changed: self.builds.append(affected),
+                               on_error=self.errors.append)
+
+    def tearDown(self):
+        self.root.rmtree()
+
+    def write(self, name, text, mtime=1000):
+        fp = self.root / 'media' / 'js' / name
+        fp.write_bytes(text)
+        fp.utime((mtime, mtime))
+
+    def test_reverse_index_includes_transitive_file_keys(self):
+        index = self.watcher.reverse_index()
+        self.assertEqual(index[self.root / 'media' / 'js' / 'a.js'],
+                         set([('js', 'ab.js'), ('js', 'all.js')]))
+        self.assertEqual(index[self.root / 'media' / 'js' / 'c.js'],
+                         set([('js', 'all.js'), ('js', 'c.js')]))
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.watcher.step(timeout=0), {})
+        self.assertEqual(self.builds, [])
+
+    def test_only_affected_bundles_are_rebuilt(self):
+        old_version = self.assets.versions['c.js']
+        self.write('b.js', 'var bee;\n', mtime=2000)
+        self.assertEqual(self.watcher.step(timeout=0), {'js': ['ab.js', 'all.js']})
+        self.assert_('var bee;' in (self.root / 'build' / 'all.js').text())
+        self.assertEqual(self.assets.versions['c.js'], old_version)
+
+    def test_mapping_changes_refresh_the_index(self):
+        self.assets.options['js']['map']['b.js'] = ['js/b.js']
+        self.write('b.js', 'var bee;\n', mtime=2000)
+        self.assertEqual(self.watcher.step(timeout=0), {'js': ['ab.js', 'all.js', 'b.js']})
+
+    def test_build_errors_are_reported(self):
+        (self.root / 'media' / 'js' / 'c.js').remove()
+        self.assertEqual(self.watcher.step(timeout=0), {'js': ['all.js', 'c.js']})
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(sorted(self.errors[0].errors), ['all.js', 'c.js'])